@@ -0,0 +1,49 @@
+"""
+Benchmark of the batch postage-stamp injection in pynrc.maths.image_manip.
+
+Random PSF stamps are placed at sub-pixel offsets within a subarray, once
+with add_stamps() and once with the previous per-source approach used by
+obs_coronagraphy.gen_planets_image(), which padded each stamp to the full
+image size and shifted it with fshift().
+
+Usage:
+    python benchmarks/bench_add_stamps.py [nsource ...]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import sys, time
+import numpy as np
+
+from pynrc.maths.image_manip import add_stamps, fshift, pad_or_cut_to_size
+
+
+def add_stamps_loop(image, stamps, delx, dely):
+    """Previous implementation."""
+    for stamp, dx, dy in zip(stamps, delx, dely):
+        stamp = pad_or_cut_to_size(stamp, image.shape)
+        image += fshift(stamp, delx=dx, dely=dy, pad=True)
+    return image
+
+
+if __name__ == '__main__':
+    nsrc_list = [int(v) for v in sys.argv[1:]] if len(sys.argv) > 1 else [10, 100, 500]
+    image_shape = (320, 320)
+    stamp_size = 64
+
+    print('{:>7s} {:>12s} {:>12s} {:>8s} {:>12s}'
+          .format('nsource', 'Loop (s)', 'Batch (s)', 'Speedup', 'Max diff'))
+    for nsrc in nsrc_list:
+        rng = np.random.RandomState(0)
+        stamps = rng.rand(nsrc, stamp_size, stamp_size)
+        delx = rng.uniform(-150, 150, nsrc)
+        dely = rng.uniform(-150, 150, nsrc)
+
+        t0 = time.time()
+        im1 = add_stamps_loop(np.zeros(image_shape), stamps, delx, dely)
+        t1 = time.time()
+        im2 = add_stamps(np.zeros(image_shape), stamps, delx, dely)
+        t2 = time.time()
+
+        print('{:7d} {:12.3f} {:12.3f} {:8.1f} {:12.2e}'
+              .format(nsrc, t1-t0, t2-t1, (t1-t0)/(t2-t1), np.abs(im1-im2).max()))
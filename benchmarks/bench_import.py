@@ -0,0 +1,58 @@
+"""
+Startup benchmark for pynrc.
+
+Each statement is timed in a fresh Python process so that nothing is
+already cached in sys.modules. The median wall time of several runs is
+reported, along with the heavy packages that ended up being imported.
+
+Usage:
+    python benchmarks/bench_import.py [nrepeat]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os, sys
+import subprocess
+
+stmts = [
+    'import pynrc',
+    'from pynrc import pix_noise',
+    'from pynrc.reduce import ref_pixels',
+    'from pynrc.maths.fast_poly import jl_poly',
+    'from pynrc import NIRCam',
+]
+
+heavy = ['webbpsf', 'poppy', 'pysynphot', 'matplotlib', 'scipy', 'astropy.convolution']
+
+code = """
+import sys, time
+t0 = time.time()
+{stmt}
+t1 = time.time()
+heavy = {heavy!r}
+print(t1-t0, ','.join(m for m in heavy if m in sys.modules))
+"""
+
+def time_stmt(stmt, nrepeat=5):
+    """Median import time of stmt and the list of heavy modules loaded."""
+    times = []
+    for i in range(nrepeat):
+        out = subprocess.check_output([sys.executable, '-c', code.format(stmt=stmt, heavy=heavy)])
+        t, mods = (out.decode().strip().split(' ') + [''])[:2]
+        times.append(float(t))
+    times.sort()
+    return times[len(times)//2], mods
+
+if __name__ == '__main__':
+    if os.getenv('PYNRC_PATH') is None:
+        sys.exit('Environment variable $PYNRC_PATH is not set!')
+
+    nrepeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print('{:45s} {:>8s}  {}'.format('Statement', 'Time (s)', 'Heavy modules loaded'))
+    for stmt in stmts:
+        try:
+            t, mods = time_stmt(stmt, nrepeat)
+            print('{:45s} {:8.3f}  {}'.format(stmt, t, mods))
+        except subprocess.CalledProcessError:
+            print('{:45s} {:>8s}'.format(stmt, 'FAILED'))
@@ -0,0 +1,86 @@
+"""
+Benchmark of the amplifier offset correction in pynrc.reduce.ref_pixels.
+
+A synthetic 2048x2048xN ramp with per-channel, per-column-parity offsets
+is corrected with reffix_amps() and compared against the previous
+implementation, which looped over channels and frames and computed the
+resistant mean of each frame separately with the 0.4 robust.mean()
+(robust_v04.py).
+
+Usage:
+    python benchmarks/bench_ref_pixels.py [nz ...]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import sys, time
+import numpy as np
+
+from pynrc.reduce.ref_pixels import reffix_amps
+import robust_v04 as robust
+
+
+def reffix_amps_loop(cube, nchans=4, altcol=True, ntop=4, nbot=4):
+    """Previous implementation (in place, top and bottom references)."""
+    nz, ny, nx = cube.shape
+    chsize = int(nx / nchans)
+    refs_all = np.hstack((cube[:,:nbot,:], cube[:,-ntop:,:]))
+
+    for ch in range(nchans):
+        ich1 = ch*chsize
+        ich2 = ich1 + chsize
+        if altcol:
+            refs_ch1 = refs_all[:,:,ich1:ich2-1:2].reshape((nz,-1))
+            refs_ch2 = refs_all[:,:,ich1+1:ich2:2].reshape((nz,-1))
+            chavg1 = [robust.mean(r) for r in refs_ch1]
+            chavg2 = [robust.mean(r) for r in refs_ch2]
+            for i in range(nz):
+                cube[i,:,ich1:ich2-1:2] -= chavg1[i]
+                cube[i,:,ich1+1:ich2:2] -= chavg2[i]
+        else:
+            refs_ch = refs_all[:,:,ich1:ich2].reshape((nz,-1))
+            chavg = [robust.mean(r) for r in refs_ch]
+            for i in range(nz):
+                cube[i,:,ich1:ich2] -= chavg[i]
+    return cube
+
+
+def make_cube(nz, ny=2048, nx=2048, nchans=4, seed=0):
+    """Ramp with read noise, outliers, and amplifier offsets drifting per frame."""
+    rng = np.random.RandomState(seed)
+    cube = rng.normal(0, 10, size=(nz,ny,nx)).astype(np.float32)
+    cube += 50 * np.arange(nz, dtype=np.float32).reshape([-1,1,1])
+
+    chsize = nx // nchans
+    offsets = rng.normal(1e4, 500, size=(nz,1,nchans,chsize//2,2)).astype(np.float32)
+    offsets[:] = offsets[:,:,:,0:1,:]
+    cube += offsets.reshape((nz,1,nx))
+
+    # Hot pixels in the reference rows
+    ind = rng.randint(0, nx, size=200)
+    cube[:,0,ind] += 1e4
+    return cube
+
+
+if __name__ == '__main__':
+    nz_list = [int(v) for v in sys.argv[1:]] if len(sys.argv) > 1 else [10, 50, 100]
+
+    print('{:>5s} {:>7s} {:>12s} {:>12s} {:>8s} {:>12s}'
+          .format('nz', 'altcol', 'Loop (s)', 'Batch (s)', 'Speedup', 'Max diff'))
+    for nz in nz_list:
+        cube = make_cube(nz)
+        for altcol in [True, False]:
+            c1 = cube.copy()
+            t0 = time.time()
+            reffix_amps_loop(c1, altcol=altcol)
+            t1 = time.time()
+
+            c2 = cube.copy()
+            t2 = time.time()
+            reffix_amps(c2, altcol=altcol, in_place=True)
+            t3 = time.time()
+
+            diff = np.abs(c1-c2).max()
+            print('{:5d} {:>7} {:12.3f} {:12.3f} {:8.1f} {:12.2e}'
+                  .format(nz, str(altcol), t1-t0, t3-t2, (t1-t0)/(t3-t2), diff))
+            del c1, c2
@@ -0,0 +1,69 @@
+"""
+Benchmark of the axis-vectorized estimators in pynrc.maths.robust.
+
+Each estimator is evaluated along an axis of a synthetic data set with
+outliers, once with the axis keyword (vectorized) and once with the 0.4
+implementation in robust_v04.py, which works row by row with
+np.apply_along_axis. The chunked mode is checked on a memory-mapped cube.
+
+Usage:
+    python benchmarks/bench_robust.py [nrow] [ncol]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os, sys, time, tempfile
+import numpy as np
+
+from pynrc.maths import robust
+import robust_v04
+
+
+def make_data(nrow, ncol, seed=0):
+    rng = np.random.RandomState(seed)
+    data = rng.normal(100, 5, size=(nrow,ncol))
+    bad = rng.rand(nrow,ncol) < 0.02
+    data[bad] += rng.uniform(50, 500, size=bad.sum())
+    return data
+
+
+if __name__ == '__main__':
+    nrow = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    ncol = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    data = make_data(nrow, ncol)
+
+    print('Data shape: {}'.format(data.shape))
+    print('{:14s} {:>12s} {:>12s} {:>8s} {:>12s}'
+          .format('Function', 'Rows (s)', 'Axis (s)', 'Speedup', 'Max diff'))
+    for name in ['mean', 'std', 'biweightMean', 'mode']:
+        func_ref = getattr(robust_v04, name)
+        func = getattr(robust, name)
+
+        t0 = time.time()
+        res1 = func_ref(data, axis=1)
+        t1 = time.time()
+        res2 = func(data, axis=1)
+        t2 = time.time()
+
+        diff = np.abs(res1-res2).max()
+        print('{:14s} {:12.3f} {:12.3f} {:8.1f} {:12.2e}'
+              .format(name, t1-t0, t2-t1, (t1-t0)/(t2-t1), diff))
+
+    # Out-of-core processing of a memory-mapped cube
+    cube = make_data(50, 256*256).reshape([50,256,256]).astype(np.float32)
+    fd, fname = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    try:
+        np.save(fname, cube)
+        cube_mm = np.load(fname, mmap_mode='r')
+
+        t0 = time.time()
+        res1 = robust.mean(cube, axis=0)
+        t1 = time.time()
+        res2 = robust.mean(cube_mm, axis=0, mem_MB=16)
+        t2 = time.time()
+        print('\nCube mean along axis 0 {}: in memory {:.3f} s, chunked (16 MB) {:.3f} s, max diff {:.2e}'
+              .format(cube.shape, t1-t0, t2-t1, np.abs(res1-res2).max()))
+    finally:
+        del cube_mm
+        os.remove(fname)
@@ -0,0 +1,89 @@
+"""
+Statistical comparison of the streaming detector noise in
+pynrc.simul.nghxrg (HXRGNoise.mknoise_iter and PinkNoiseStream) against
+the FFT-based noise of HXRGNoise.mknoise, which remains the default in
+ngNRC.slope_to_ramp() (see the stream_noise keyword).
+
+For a set of noise realizations, the script reports:
+  - the mean frame standard deviation
+  - the standard deviation of CDS frames (frame 1 - frame 0)
+  - the power spectrum of the read-out time series of a single output,
+    averaged in log-spaced frequency bands
+  - the power spectrum of PinkNoiseStream against pink_noise()
+Ratios close to 1 mean that the two generators are statistically
+equivalent.
+
+Usage:
+    python benchmarks/check_noise_stream.py [nreal]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import sys
+import numpy as np
+
+from pynrc.simul.nghxrg import HXRGNoise, PinkNoiseStream
+
+# NIRCam-like noise values (e-), without bias and kTC offsets
+noise_kw = {'rd_noise':12., 'c_pink':6., 'u_pink':2., 'acn':1.,
+            'ktc_noise':0., 'bias_off_avg':0., 'bias_amp':0., 'out_ADU':False}
+
+
+def band_psd(series, nband=8):
+    """Mean periodogram of each row of series in log-spaced frequency bands."""
+    psd = np.mean(np.abs(np.fft.rfft(series, axis=-1))**2, axis=0) / series.shape[-1]
+    f = np.fft.rfftfreq(series.shape[-1])
+    edges = np.logspace(np.log10(f[1]), np.log10(0.5), nband+1)
+    edges[-1] *= 1.001
+    ind = np.digitize(f, edges) - 1
+    return edges, np.array([psd[ind==i].mean() for i in range(nband)])
+
+
+def channel_series(cube, xsize):
+    """Time series of the first output, in read-out order (overheads excluded)."""
+    return cube[:,:,:xsize].reshape(-1)
+
+
+if __name__ == '__main__':
+    nreal = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    ng = HXRGNoise(naxis1=256, naxis2=256, naxis3=20, n_out=4, det_size=256,
+                   reference_pixel_border_width=4)
+    xsize = ng.xsize
+
+    stats = {}
+    for name in ['mknoise', 'mknoise_iter']:
+        np.random.seed(0)
+        fstd, cds, series = [], [], []
+        for i in range(nreal):
+            if name == 'mknoise':
+                cube = ng.mknoise(None, **noise_kw).data
+            else:
+                cube = np.array(list(ng.mknoise_iter(**noise_kw)))
+            fstd.append(np.mean([fr.std() for fr in cube]))
+            cds.append((cube[1] - cube[0]).std())
+            series.append(channel_series(cube, xsize))
+        edges, psd = band_psd(np.array(series))
+        stats[name] = (np.mean(fstd), np.mean(cds), psd)
+
+    s1, s2 = stats['mknoise'], stats['mknoise_iter']
+    print('Realizations: {}, cube shape: {}'.format(nreal, cube.shape))
+    print('{:20s} {:>10s} {:>12s} {:>8s}'.format('', 'mknoise', 'mknoise_iter', 'Ratio'))
+    print('{:20s} {:10.3f} {:12.3f} {:8.3f}'.format('Frame std (e-)', s1[0], s2[0], s2[0]/s1[0]))
+    print('{:20s} {:10.3f} {:12.3f} {:8.3f}'.format('CDS std (e-)', s1[1], s2[1], s2[1]/s1[1]))
+    print('\nPSD of output 1 (ratio mknoise_iter / mknoise)')
+    for i in range(len(edges)-1):
+        print('  {:9.2e} - {:9.2e}  {:8.3f}'.format(edges[i], edges[i+1], s2[2][i]/s1[2][i]))
+
+    # Pink noise generators alone (cheap, so use more realizations)
+    np.random.seed(0)
+    ng_pink = HXRGNoise(naxis1=256, naxis2=256, naxis3=1, n_out=1, det_size=256)
+    p1 = np.array([ng_pink.pink_noise('pink') for i in range(10*nreal)])
+    nstep = p1.shape[-1]
+    p2 = np.array([PinkNoiseStream(nstep).next(nstep) for i in range(10*nreal)])
+    edges, psd1 = band_psd(p1)
+    edges, psd2 = band_psd(p2)
+    print('\nPSD of PinkNoiseStream / pink_noise() ({} samples)'.format(nstep))
+    for i in range(len(edges)-1):
+        print('  {:9.2e} - {:9.2e}  {:8.3f}'.format(edges[i], edges[i+1], psd2[i]/psd1[i]))
+    print('  Std: {:.3f} / {:.3f}'.format(p2.std(axis=1).mean(), p1.std(axis=1).mean()))
@@ -35,6 +35,13 @@ class Conf(_config.ConfigNamespace):
         path += '/'
     PYNRC_PATH = _config.ConfigItem(path, 'Directory path to data files required for pynrc calculations.')
 
+    # PSF coefficient cache (see psf_cache.py)
+    psf_cache_disk_GB = _config.ConfigItem(10.0,
+        'Disk budget (GB) for cached PSF coefficients. Least recently used files are '
+        'deleted once exceeded. Set <=0 for no limit.')
+    psf_cache_mem_MB = _config.ConfigItem(512.0,
+        'Memory budget (MB) for PSF coefficients cached in each process.')
+
     logging_level = _config.ConfigItem(
         ['INFO', 'DEBUG', 'WARN', 'WARNING', 'ERROR', 'CRITICAL', 'NONE'],
         'Desired logging level for pyNRC.'
@@ -56,17 +63,56 @@ conf = Conf()
 from .logging_utils import setup_logging#, restart_logging
 setup_logging(conf.default_logging_level, verbose=False)
 
-from .nrc_utils import (read_filter, pix_noise, nrc_header, stellar_spectrum)
-
-from .pynrc_core import (multiaccum, DetectorOps, NIRCam, planets_sb11, planets_sb12)
-
-from .obs_nircam import obs_coronagraphy
-
-#from .ngNRC import slope_to_ramp, nproc_use_ng
-
-# from . import maths, simul, reduce
-from .maths import *
-
-from .simul import ngNRC
-
-from .reduce import ref_pixels
+# Submodules and their heavy dependencies (WebbPSF, Poppy, Pysynphot, etc.) 
+# are only imported when one of the following attributes is first accessed.
+# For instance, pynrc.pix_noise and pynrc.reduce.ref_pixels do not
+# require WebbPSF or Pysynphot.
+_lazy_attrs = {
+    'read_filter'      : ('nrc_utils', 'read_filter'),
+    'nrc_header'       : ('nrc_utils', 'nrc_header'),
+    'stellar_spectrum' : ('nrc_utils', 'stellar_spectrum'),
+    'pix_noise'        : ('nrc_noise', 'pix_noise'),
+    'multiaccum'       : ('pynrc_core', 'multiaccum'),
+    'DetectorOps'      : ('pynrc_core', 'DetectorOps'),
+    'RampTiming'       : ('pynrc_core', 'RampTiming'),
+    'NIRCam'           : ('pynrc_core', 'NIRCam'),
+    'planets_sb11'     : ('pynrc_core', 'planets_sb11'),
+    'planets_sb12'     : ('pynrc_core', 'planets_sb12'),
+    'obs_coronagraphy' : ('obs_nircam', 'obs_coronagraphy'),
+    'ngNRC'            : ('simul.ngNRC', None),
+    'ref_pixels'       : ('reduce.ref_pixels', None),
+    # Previously imported with "from .maths import *"
+    'robust'           : ('maths.robust', None),
+    'image_manip'      : ('maths.image_manip', None),
+    'fast_poly'        : ('maths.fast_poly', None),
+    'coords'           : ('maths.coords', None),
+}
+_lazy_modules = ['nrc_utils', 'nrc_noise', 'pynrc_core', 'obs_nircam', 'speckle_noise',
+                 'psf_cache', 'psf_library', 'bp_registry', 'spec_grid', 'bg_provider', 'maths', 'simul', 'reduce']
+
+def __getattr__(name):
+    import importlib
+    if name in _lazy_attrs:
+        mod_name, attr = _lazy_attrs[name]
+        mod = importlib.import_module('.' + mod_name, __name__)
+        val = mod if attr is None else getattr(mod, attr)
+    elif name in _lazy_modules:
+        val = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    # Cache so that __getattr__ is only called once per name
+    globals()[name] = val
+    return val
+
+# "from pynrc import *" resolves (and imports) the same names as before
+__all__ = ['conf', 'setup_logging'] + list(_lazy_attrs.keys()) + \
+          ['nrc_utils', 'pynrc_core', 'obs_nircam', 'maths', 'simul', 'reduce']
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(_lazy_attrs.keys()) | set(_lazy_modules))
+
+# Module-level __getattr__ requires Python 3.7+ (PEP 562)
+import sys as _sys
+if _sys.version_info < (3,7):
+    for _name in list(_lazy_attrs.keys()):
+        __getattr__(_name)
@@ -0,0 +1,529 @@
+"""
+Zodiacal background providers for the Euclid background model
+
+zodi_spec() (via zodi_euclid) can scale the zodiacal light model to a
+specific target position and date. Originally, this always queried the
+IPAC Euclid Background Model web service, which is slow and unusable on
+machines without network access. The lookup is now delegated to a
+background provider:
+
+    TableProvider  - Interpolates a precomputed table of zodiacal intensities
+                     on a grid of (wavelength, ecliptic latitude, ecliptic
+                     longitude relative to the Sun). No network required.
+    HTTPProvider   - Queries the IPAC web service using a pool of persistent
+                     connections. Responses are cached on disk so each
+                     (locstr, wavelength, year, day) is only fetched once.
+    AnalyticProvider - Simple closed-form model. Not physical; only intended
+                     as a stand-in for testing.
+
+StandInServer mimics the IPAC web service locally (serving values from any
+provider), so HTTPProvider can be exercised without network access.
+
+All providers accept many (locstr, year, day) combinations in a single call
+and return intensities in MJy/sr with shape [ntarget, nwave].
+
+Example
+==========
+# Build the table from the web service (only needs to be done once)
+build_zodi_table()
+
+prov = get_bg_provider()
+vals = prov.zodi(['17:26:44 -73:19:56', '266.4 -29.0'], 2019, [1,180], [1.0,5.5])
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+import os, datetime, json, tempfile, threading, socket
+import xml.etree.ElementTree as ET
+
+from six.moves import http_client
+from six.moves.urllib.parse import urlencode, urlparse, parse_qs
+from six.moves import BaseHTTPServer, socketserver
+
+from . import conf
+from .psf_cache import _replace
+
+import logging
+_log = logging.getLogger('pynrc')
+
+_irsa_url = 'https://irsa.ipac.caltech.edu/cgi-bin/BackgroundModel/nph-bgmodel'
+
+
+def _broadcast_inputs(locstr, year, day):
+    """Broadcast targets and dates to 1D arrays; also return if input was scalar."""
+    scalar = (np.ndim(locstr)==0) and (np.ndim(year)==0) and (np.ndim(day)==0)
+    locstr, year, day = np.broadcast_arrays(np.atleast_1d(np.array(locstr, dtype=object)),
+                                            np.atleast_1d(year), np.atleast_1d(day))
+    return locstr.ravel(), year.ravel().astype(int), day.ravel().astype(int), scalar
+
+_coord_cache = {}
+def _parse_locstr(locstr):
+    """
+    RA and Dec (deg) for an array of object names, decimal degrees
+    or sexigesimal strings. Object names require Sesame (network).
+    """
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+
+    locstr = [str(s).strip() for s in locstr]
+    for s in set(locstr) - set(_coord_cache.keys()):
+        # Decimal degrees don't need astropy's (slow) string parsing
+        try:
+            ra, dec = [float(v) for v in s.replace(',', ' ').split()]
+            _coord_cache[s] = (ra, dec)
+            continue
+        except ValueError:
+            pass
+        try:
+            c = SkyCoord(s, unit=(u.hourangle, u.deg))
+        except ValueError:
+            c = SkyCoord.from_name(s)
+        _coord_cache[s] = (c.icrs.ra.deg, c.icrs.dec.deg)
+
+    radec = np.array([_coord_cache[s] for s in locstr]).reshape([-1,2])
+    return radec[:,0], radec[:,1]
+
+def _ecliptic(ra, dec):
+    """Ecliptic longitude and latitude (deg) from ICRS RA and Dec."""
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+    c = SkyCoord(ra=ra*u.deg, dec=dec*u.deg, frame='icrs').barycentrictrueecliptic
+    return c.lon.deg, c.lat.deg
+
+def _icrs(lon, lat):
+    """ICRS RA and Dec (deg) from ecliptic longitude and latitude."""
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+    c = SkyCoord(lon=lon*u.deg, lat=lat*u.deg, frame='barycentrictrueecliptic').icrs
+    return c.ra.deg, c.dec.deg
+
+def sun_longitude(year, day):
+    """
+    Ecliptic longitude of the Sun (deg) at noon on the given day of year.
+    Low precision formula from the Astronomical Almanac (~0.01 deg),
+    which is more than adequate for zodiacal light.
+    """
+    year = np.asarray(year, dtype=int)
+    day = np.asarray(day, dtype=float)
+
+    uyear, iyear = np.unique(year, return_inverse=True)
+    jd_jan1 = np.array([datetime.date(y,1,1).toordinal() for y in uyear]) + 1721424.5
+    jd = jd_jan1[iyear].reshape(year.shape) + (day - 1) + 0.5
+
+    n = jd - 2451545.0
+    L = 280.460 + 0.9856474*n
+    g = np.deg2rad(357.528 + 0.9856003*n)
+    lam = L + 1.915*np.sin(g) + 0.020*np.sin(2*g)
+    return lam % 360
+
+
+class BackgroundProvider(object):
+    """
+    Base class for zodiacal background providers. Subclasses
+    implement zodi(), which returns intensities in MJy/sr.
+    """
+
+    def zodi(self, locstr, year, day, wavelengths=[1.0,5.5]):
+        """
+        Zodiacal intensity (MJy/sr) for one or more targets and dates.
+
+        Parameters
+        ==========
+        locstr      : Object name, RA/DEC in decimal degrees or sexigesimal input.
+                      Can be a list of targets.
+        year        : Year of observation (scalar or array).
+        day         : Day of year of observation (scalar or array).
+        wavelengths : Wavelengths (um).
+
+        Returns an array of shape [nwave] for a single target and date,
+        otherwise [ntarget, nwave] after broadcasting locstr, year, and day.
+        """
+        raise NotImplementedError
+
+
+class TableProvider(BackgroundProvider):
+    """
+    Interpolates a precomputed zodiacal light table (see build_zodi_table).
+    The table is log-interpolated in wavelength, ecliptic latitude, and
+    ecliptic longitude relative to the Sun, which is where the day of year
+    comes in. The small dependence on the Earth's position along its
+    orbit is ignored.
+
+    Parameters
+    ==========
+    file_path : Path to the npz table. Default is PYNRC_PATH/zodi_table.npz.
+    """
+
+    def __init__(self, file_path=''):
+        if file_path == '':
+            file_path = conf.PYNRC_PATH + 'zodi_table.npz'
+        self.file_path = file_path
+        self._interp = None
+
+    def _load(self):
+        from scipy.interpolate import RegularGridInterpolator
+
+        if not os.path.isfile(self.file_path):
+            raise IOError('Zodiacal table {} does not exist. See build_zodi_table().'
+                          .format(self.file_path))
+        with np.load(self.file_path) as data:
+            wave, elat, dlon = data['wave'], data['elat'], data['dlon']
+            vals = data['zodi']
+
+        self.wave, self.elat, self.dlon = wave, elat, dlon
+        self._interp = RegularGridInterpolator((np.log10(wave), elat, dlon), np.log10(vals),
+                                               bounds_error=False, fill_value=None)
+
+    def zodi(self, locstr, year, day, wavelengths=[1.0,5.5]):
+        if self._interp is None:
+            self._load()
+
+        locstr, year, day, scalar = _broadcast_inputs(locstr, year, day)
+        ra, dec = _parse_locstr(locstr)
+        lon, lat = _ecliptic(ra, dec)
+        dlon = (lon - sun_longitude(year, day)) % 360
+
+        # Extrapolation is only allowed in wavelength
+        lat = np.clip(lat, self.elat.min(), self.elat.max())
+        dlon = np.clip(dlon, self.dlon.min(), self.dlon.max())
+
+        lwave = np.log10(np.atleast_1d(wavelengths).astype(float))
+        nt, nw = len(lat), len(lwave)
+        pts = np.array([np.tile(lwave, nt), np.repeat(lat, nw), np.repeat(dlon, nw)]).T
+        res = 10**self._interp(pts).reshape([nt,nw])
+
+        return res[0] if scalar else res
+
+
+class HTTPProvider(BackgroundProvider):
+    """
+    Queries the IPAC Euclid Background Model web service. Requests are
+    distributed over a pool of threads, each of which keeps a persistent
+    connection to the server. Responses are cached in memory and in a JSON
+    file, so repeated lookups never go out over the network.
+
+    Parameters
+    ==========
+    url        : Web service URL. Can point to a StandInServer for testing.
+    cache_file : Path to the JSON response cache. Default is
+                 PYNRC_PATH/zodi_euclid_cache.json. Set to None for memory only.
+    nthread    : Number of simultaneous connections.
+    timeout    : Connection timeout (sec).
+    ido_viewin : Passed to the web service. 0 uses the specified day;
+                 1 uses the median of the target's visibility window.
+    """
+
+    def __init__(self, url=_irsa_url, cache_file='', nthread=8, timeout=60, ido_viewin=0):
+
+        if cache_file == '':
+            cache_file = conf.PYNRC_PATH + 'zodi_euclid_cache.json'
+        self.cache_file = cache_file
+        self.url = url
+        self.nthread = nthread
+        self.timeout = timeout
+        self.ido_viewin = ido_viewin
+
+        parsed = urlparse(url)
+        self._https = (parsed.scheme == 'https')
+        self._netloc = parsed.netloc
+        self._path = parsed.path
+
+        self._local = threading.local()
+        self._pool = None
+        self._cache = None
+
+    def _query(self, locstr, wave, year, day):
+        return urlencode([('locstr',locstr), ('wavelength','{:.2f}'.format(wave)),
+                          ('year',int(year)), ('day',int(day)), ('obslocin',0),
+                          ('ido_viewin',int(self.ido_viewin))])
+
+    def _connection(self):
+        """Persistent connection for the calling thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http_client.HTTPSConnection if self._https else http_client.HTTPConnection
+            conn = cls(self._netloc, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _fetch(self, query):
+        """Send a single request and return the zodiacal intensity (MJy/sr)."""
+        # Retry once if the server closed a kept-alive connection
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request('GET', self._path + '?' + query)
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (http_client.HTTPException, socket.error):
+                conn.close()
+                self._local.conn = None
+                if attempt > 0: raise
+
+        if resp.status != 200:
+            raise IOError('Background model query failed ({} {}): {}'
+                          .format(resp.status, resp.reason, query))
+        return _parse_zody(body)
+
+    def _load_cache(self):
+        self._cache = {}
+        if (self.cache_file is None) or (not os.path.isfile(self.cache_file)):
+            return
+        try:
+            with open(self.cache_file, 'r') as f:
+                self._cache.update(json.load(f))
+        except (IOError, OSError, ValueError):
+            _log.warning('Could not read background cache {}'.format(self.cache_file))
+
+    def _save_cache(self):
+        """Atomically write the cache to disk, merging with other processes."""
+        if self.cache_file is None:
+            return
+
+        mem = self._cache
+        self._load_cache()
+        self._cache.update(mem)
+
+        fdir = os.path.dirname(self.cache_file)
+        try:
+            fd, tmp_name = tempfile.mkstemp(suffix='.tmp', dir=fdir)
+        except OSError:
+            _log.debug('Unable to write background cache to {}'.format(fdir))
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._cache, f)
+            os.chmod(tmp_name, 0o644)
+            _replace(tmp_name, self.cache_file)
+        except Exception:
+            if os.path.exists(tmp_name): os.remove(tmp_name)
+            raise
+
+    def zodi(self, locstr, year, day, wavelengths=[1.0,5.5]):
+        from multiprocessing.pool import ThreadPool
+
+        if self._cache is None:
+            self._load_cache()
+
+        locstr, year, day, scalar = _broadcast_inputs(locstr, year, day)
+        wavelengths = np.atleast_1d(wavelengths).astype(float)
+
+        queries = [self._query(str(s), w, y, d) for s, y, d in zip(locstr, year, day)
+                   for w in wavelengths]
+        missing = sorted(set(q for q in queries if q not in self._cache))
+        if len(missing) > 0:
+            _log.info('Querying background model for {} values'.format(len(missing)))
+            nthread = min(self.nthread, len(missing))
+            if nthread == 1:
+                res = [self._fetch(q) for q in missing]
+            else:
+                # Reuse the pool (and its connections) between calls
+                if (self._pool is None) or (self._pool._processes != nthread):
+                    if self._pool is not None: self._pool.close()
+                    self._pool = ThreadPool(nthread)
+                res = self._pool.map(self._fetch, missing)
+            self._cache.update(zip(missing, res))
+            self._save_cache()
+
+        res = np.array([self._cache[q] for q in queries]).reshape([len(locstr),-1])
+        return res[0] if scalar else res
+
+    def close(self):
+        """Shut down the thread pool."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+
+def _parse_zody(body):
+    """Zodiacal intensity from the web service XML response."""
+    root = ET.fromstring(body)
+    el = root.find('.//statistics/zody')
+    if el is None:
+        raise IOError('Unexpected background model response.')
+    return float(el.text.strip().split(' ')[0])
+
+
+class AnalyticProvider(BackgroundProvider):
+    """
+    Closed-form zodiacal intensity: the two blackbody components of
+    zodi_spec scaled by 1 + 2*cos(elat)^2, so zfact=1 at the ecliptic
+    poles and 3 in the ecliptic plane. Not physical; only intended as a
+    stand-in for testing (e.g. with StandInServer).
+    """
+
+    # Flux density (Jy/sr per zfact) of a Pysynphot blackbody
+    # (1 Rsun at 1 kpc) times the zodi_spec component scale factors
+    _components = ((5300.0, 4.0e7), (282.0, 2.0e13))
+    _dilution = np.pi * (6.957e8 / 3.0857e19)**2
+
+    def _unit_mjy(self, wavelengths):
+        h, c, k = 6.62607e-34, 2.99792458e8, 1.380649e-23
+        nu = c / (np.atleast_1d(wavelengths) * 1e-6)
+        res = 0
+        for temp, norm in self._components:
+            bnu = 2*h*nu**3/c**2 / np.expm1(h*nu/(k*temp))
+            res = res + norm * self._dilution * bnu * 1e26 / 1e6
+        return res
+
+    def zodi(self, locstr, year, day, wavelengths=[1.0,5.5]):
+        locstr, year, day, scalar = _broadcast_inputs(locstr, year, day)
+        ra, dec = _parse_locstr(locstr)
+        _, lat = _ecliptic(ra, dec)
+        zfact = 1 + 2*np.cos(np.deg2rad(lat))**2
+        res = zfact.reshape([-1,1]) * self._unit_mjy(wavelengths).reshape([1,-1])
+        return res[0] if scalar else res
+
+
+class _StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        try:
+            q = parse_qs(urlparse(self.path).query)
+            val = self.server.provider.zodi(q['locstr'][0], int(q['year'][0]),
+                                            int(q['day'][0]), [float(q['wavelength'][0])])
+            body = '<results><result><statistics><zody>{:.6f} (MJy/sr)</zody>'\
+                   '</statistics></result></results>'.format(val[0])
+            status = 200
+        except Exception as e:
+            body = '<error>{}</error>'.format(e)
+            status = 400
+        body = body.encode('utf-8')
+        self.server.nrequests += 1
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class _ThreadingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class StandInServer(object):
+    """
+    Local HTTP server that mimics the IPAC Background Model web service.
+
+    Parameters
+    ==========
+    provider : Background provider used to compute responses.
+               Default is AnalyticProvider().
+    port     : Port number (0 picks any free port).
+
+    Example
+    ==========
+    with StandInServer() as server:
+        prov = HTTPProvider(url=server.url, cache_file=None)
+        vals = prov.zodi('266.4 -29.0', 2019, 100)
+    """
+
+    def __init__(self, provider=None, port=0):
+        self._server = _ThreadingServer(('127.0.0.1', port), _StandInHandler)
+        self._server.provider = AnalyticProvider() if provider is None else provider
+        self._server.nrequests = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[0:2]
+        return 'http://{}:{}/cgi-bin/BackgroundModel/nph-bgmodel'.format(host, port)
+
+    @property
+    def nrequests(self):
+        """Number of requests served."""
+        return self._server.nrequests
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def build_zodi_table(provider=None, out_file='', wavelengths=None, elat=None, dlon=None,
+                     year=2019, day=1):
+    """
+    Tabulate the zodiacal intensity on a grid of ecliptic latitude and
+    ecliptic longitude relative to the Sun for use with TableProvider.
+    Only needs to be done once.
+
+    Parameters
+    ==========
+    provider    : Background provider used to compute the table.
+                  Default is HTTPProvider() (IPAC web service).
+    out_file    : Output path. Default is PYNRC_PATH/zodi_table.npz.
+    wavelengths : Wavelengths (um). Default covers the NIRCam bandpasses.
+    elat        : Ecliptic latitudes (deg). Default -90 to 90 in 5 deg steps.
+    dlon        : Longitudes relative to the Sun (deg). Default 0 to 360 in 10 deg steps.
+    year, day   : Date used to place the grid points on the sky.
+    """
+    if provider is None: provider = HTTPProvider()
+    if out_file == '': out_file = conf.PYNRC_PATH + 'zodi_table.npz'
+    if wavelengths is None: wavelengths = np.array([0.6, 1.0, 1.5, 2.0, 3.0, 4.0, 5.5])
+    if elat is None: elat = np.arange(-90, 91, 5)
+    if dlon is None: dlon = np.arange(0, 361, 10)
+    wavelengths, elat, dlon = [np.asarray(v, dtype=float) for v in (wavelengths, elat, dlon)]
+
+    lat_grid, dlon_grid = np.meshgrid(elat, dlon, indexing='ij')
+    lon = (dlon_grid.ravel() + sun_longitude(year, day)) % 360
+    ra, dec = _icrs(lon, lat_grid.ravel())
+    locstr = np.array(['{:.5f} {:.5f}'.format(r, d) for r, d in zip(ra, dec)], dtype=object)
+
+    vals = provider.zodi(locstr, year, day, wavelengths)
+    vals = vals.reshape([len(elat), len(dlon), len(wavelengths)]).transpose([2,0,1])
+
+    fdir = os.path.dirname(out_file)
+    fd, tmp_name = tempfile.mkstemp(suffix='.tmp', dir=fdir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, wave=wavelengths, elat=elat, dlon=dlon, zodi=vals)
+        os.chmod(tmp_name, 0o644)
+        _replace(tmp_name, out_file)
+    except Exception:
+        if os.path.exists(tmp_name): os.remove(tmp_name)
+        raise
+
+    _log.info('Saved zodiacal table to {}'.format(out_file))
+
+
+_bg_provider = None
+_http_providers = {}
+def get_bg_provider(ido_viewin=0):
+    """
+    Return the process-wide background provider. Uses the local table
+    if PYNRC_PATH/zodi_table.npz exists, otherwise the web service.
+
+    Only the web service supports ido_viewin != 0, in which case a single
+    HTTPProvider is kept for each value of ido_viewin.
+    """
+    global _bg_provider
+    if ido_viewin != 0:
+        if ido_viewin not in _http_providers:
+            _http_providers[ido_viewin] = HTTPProvider(ido_viewin=ido_viewin)
+        return _http_providers[ido_viewin]
+
+    if _bg_provider is None:
+        tbl = TableProvider()
+        _bg_provider = tbl if os.path.isfile(tbl.file_path) else HTTPProvider()
+    return _bg_provider
+
+def set_bg_provider(provider):
+    """Set the process-wide background provider (None resets to default)."""
+    global _bg_provider
+    _bg_provider = provider
@@ -0,0 +1,154 @@
+"""
+Registry of pre-computed NIRCam bandpass throughputs
+
+read_filter() combines the STScI filter curves with grism/DHS response
+polynomials, coronagraphic substrates, Lyot stop wedges, weak lenses, and
+ice/NVR contamination. Each (filter, pupil, mask, module, ND_acq, ice_scale,
+nvr_scale) combination only needs to be built once. The resulting wavelength
+and throughput arrays are kept in memory and saved to a single npz file
+(PYNRC_PATH/bp_registry.npz) that is read back on first use.
+
+Each entry stores the modification times of the source files that went
+into it. If any of those files change, the entry is rebuilt.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+import os, tempfile
+
+from . import conf
+from .psf_cache import cache_key, _replace
+
+import logging
+_log = logging.getLogger('pynrc')
+
+
+def _mtimes(files):
+    """Modification times for a list of files (-1 if missing)."""
+    out = []
+    for f in files:
+        try:
+            out.append(os.stat(f).st_mtime)
+        except OSError:
+            out.append(-1.)
+    return np.array(out, dtype=float)
+
+
+class BandpassRegistry(object):
+    """
+    Memory + npz file store of bandpass (wave, throughput) arrays.
+
+    Parameters
+    ==========
+    file_path : Path to the npz file. Default is PYNRC_PATH/bp_registry.npz.
+                Set to None to only use the memory tier.
+    """
+
+    def __init__(self, file_path=''):
+
+        if file_path == '':
+            file_path = conf.PYNRC_PATH + 'bp_registry.npz'
+        self.file_path = file_path
+
+        # key -> (wave, throughput, mtimes)
+        self._mem = {}
+        self._disk_loaded = False
+
+    def _load_disk(self):
+        """Read all entries from the npz file into memory."""
+        self._disk_loaded = True
+        if (self.file_path is None) or (not os.path.isfile(self.file_path)):
+            return
+
+        try:
+            with np.load(self.file_path) as data:
+                keys = set(k.rsplit('_',1)[0] for k in data.files)
+                for key in keys:
+                    if key in self._mem: continue
+                    wave, th = data[key+'_wave'], data[key+'_th']
+                    for arr in (wave, th):
+                        arr.flags.writeable = False
+                    self._mem[key] = (wave, th, data[key+'_mtime'])
+        except (IOError, OSError, ValueError, KeyError):
+            # Corrupted or written by an incompatible version; rebuild as needed
+            _log.warning('Could not read bandpass registry {}'.format(self.file_path))
+
+    def _save_disk(self):
+        """Atomically write all memory entries to the npz file."""
+        if self.file_path is None:
+            return
+
+        # Merge with any entries written by other processes
+        mem = self._mem
+        self._mem = {}
+        self._disk_loaded = False
+        self._load_disk()
+        self._mem.update(mem)
+
+        out = {}
+        for key, (wave, th, mtime) in self._mem.items():
+            out[key+'_wave'] = wave
+            out[key+'_th'] = th
+            out[key+'_mtime'] = mtime
+
+        fdir = os.path.dirname(self.file_path)
+        try:
+            fd, tmp_name = tempfile.mkstemp(suffix='.tmp', dir=fdir)
+        except OSError:
+            # Read-only data directory
+            _log.debug('Unable to write bandpass registry to {}'.format(fdir))
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **out)
+            os.chmod(tmp_name, 0o644)
+            _replace(tmp_name, self.file_path)
+        except Exception:
+            if os.path.exists(tmp_name): os.remove(tmp_name)
+            raise
+
+    def get(self, build_func, files, *args):
+        """
+        Return (wave, throughput) for the combination of args. The arrays
+        are created by build_func(*args) if they don't exist or if any of
+        the source files have been modified since they were saved.
+        """
+        key = 'bp' + cache_key(*args)
+        mtime = _mtimes(files)
+
+        if not self._disk_loaded:
+            self._load_disk()
+
+        entry = self._mem.get(key)
+        if (entry is not None) and (entry[2].shape == mtime.shape) and np.all(entry[2] == mtime):
+            return entry[0], entry[1]
+
+        wave, th = build_func(*args)
+        wave = np.array(wave, dtype=float)
+        th = np.array(th, dtype=float)
+        for arr in (wave, th):
+            arr.flags.writeable = False
+        self._mem[key] = (wave, th, mtime)
+        self._save_disk()
+
+        return wave, th
+
+    def clear(self, disk=True):
+        """Empty the memory tier and (optionally) delete the npz file."""
+        self._mem.clear()
+        self._disk_loaded = False
+        if disk and (self.file_path is not None) and os.path.isfile(self.file_path):
+            try:
+                os.remove(self.file_path)
+            except OSError:
+                pass
+
+
+_bp_registry = None
+def get_bp_registry():
+    """Return the process-wide bandpass registry."""
+    global _bp_registry
+    if _bp_registry is None:
+        _bp_registry = BandpassRegistry()
+    return _bp_registry
@@ -223,6 +223,78 @@ def fshift(image, delx=0, dely=0, pad=False):
                           Found {} dimensions.'.format(len(image.shape)))
                           
                           
+def add_stamps(image, stamps, delx, dely, chunk_MB=64):
+    """
+    Add a set of (centered) postage stamps into an image at sub-pixel offsets
+    from the image center. For each stamp, this is equivalent to
+
+        image += fshift(pad_or_cut_to_size(stamp, image.shape), delx, dely, pad=True)
+
+    but without creating a full-size array per stamp. Each stamp is shifted 
+    by bi-linear interpolation (as in fshift) to a (ny+1, nx+1) array, and
+    all shifted stamps are scatter-added into the image with np.bincount.
+    Pixels that fall outside of the image are discarded. Unlike the above,
+    stamps that are larger than the image aren't cropped before shifting.
+
+    Parameters
+    ==========
+    image    : 2D image; modified in place and returned.
+    stamps   : Cube of stamps [nstamp, ny, nx], or a single 2D stamp.
+    delx     : Shift(s) in x (pixels) relative to the image center.
+    dely     : Shift(s) in y (pixels) relative to the image center.
+    chunk_MB : Approximate memory limit for the shifted stamps in each pass.
+    """
+    stamps = np.asarray(stamps, dtype=float)
+    if stamps.ndim == 2:
+        stamps = stamps.reshape((1,) + stamps.shape)
+    nstamp, sy, sx = stamps.shape
+    ny, nx = image.shape
+    delx = np.broadcast_to(np.asarray(delx, dtype=float), nstamp)
+    dely = np.broadcast_to(np.asarray(dely, dtype=float), nstamp)
+
+    # Location of the lower-left stamp pixel when centered (pad_or_cut_to_size)
+    x0 = (nx-sx)//2 if nx>=sx else -((sx-nx)//2)
+    y0 = (ny-sy)//2 if ny>=sy else -((sy-ny)//2)
+
+    # Integer and fractional parts of the total shift (fshift convention)
+    xpos = x0 + delx
+    ypos = y0 + dely
+    intx = np.floor(xpos).astype(int)
+    inty = np.floor(ypos).astype(int)
+    fracx = xpos - intx
+    fracy = ypos - inty
+    fracx[np.isclose(fracx, 0, atol=1e-5)] = 0
+    fracy[np.isclose(fracy, 0, atol=1e-5)] = 0
+
+    # Pixel coordinates of the shifted stamp, relative to (inty, intx)
+    yy = np.arange(sy+1).reshape([1,-1,1])
+    xx = np.arange(sx+1).reshape([1,1,-1])
+
+    nchunk = max(int(chunk_MB * 2**20 / (8*3*(sy+1)*(sx+1))), 1)
+    out = np.zeros(ny*nx)
+    for i1 in range(0, nstamp, nchunk):
+        i2 = min(i1+nchunk, nstamp)
+        st = stamps[i1:i2]
+        fx = fracx[i1:i2].reshape([-1,1,1])
+        fy = fracy[i1:i2].reshape([-1,1,1])
+
+        # Bi-linear interpolation onto the shifted grid
+        sh = np.zeros((i2-i1, sy+1, sx+1))
+        sh[:,:-1,:-1] += st * ((1-fx)*(1-fy))
+        sh[:,1:,:-1]  += st * ((1-fx)*fy)
+        sh[:,:-1,1:]  += st * (fx*(1-fy))
+        sh[:,1:,1:]   += st * (fx*fy)
+
+        ypix = yy + inty[i1:i2].reshape([-1,1,1])
+        xpix = xx + intx[i1:i2].reshape([-1,1,1])
+        ind = (ypix>=0) & (ypix<ny) & (xpix>=0) & (xpix<nx) & (sh!=0)
+        ind_flat = (ypix*nx + xpix)[ind]
+        out += np.bincount(ind_flat, weights=sh[ind], minlength=ny*nx)
+
+    image += out.reshape((ny,nx))
+    return image
+
+
 def fourier_imshift(image, xshift, yshift, pad=False):
     '''
     Shift an image by use of Fourier shift theorem
@@ -840,3 +912,58 @@ def binned_statistic(x, values, func=np.mean, bins=10):
         res = np.array([func(values_flat[ind]) for ind in igroups])
     
     return res
+
+
+def bin_labels(igroups, size):
+    """
+    Convert a list of binned indices from hist_indices() into an array
+    holding the bin number of each element (-1 if not in any bin).
+    """
+    labels = np.zeros(size, dtype=int) - 1
+    for i, ind in enumerate(igroups):
+        labels[ind] = i
+    return labels
+
+
+def binned_std(igroups, data):
+    """
+    Standard deviation within each bin for a set of images at once.
+    Equivalent to
+
+        np.array([binned_statistic(igroups, im, func=np.std) for im in data])
+
+    but computed with np.bincount over all images, rather than with a
+    Python loop over bins and images.
+
+    Parameters
+    ==========
+    igroups - List of binned indices from hist_indices().
+    data    - Array of images [nimage, ny, nx] (or a single image).
+    
+    Returns an array of shape [nimage, nbins] (or [nbins] for a single image).
+    Empty bins are set to NaN.
+    """
+    data = np.asarray(data, dtype=float)
+    single = (data.ndim < 3)
+    npix = data.shape[-1] * (data.shape[-2] if data.ndim>1 else 1)
+    data = data.reshape((-1, npix))
+    nimage = data.shape[0]
+    nbins = len(igroups)
+
+    labels = bin_labels(igroups, npix)
+    good = labels >= 0
+    labels = labels[good]
+    data = data[:,good]
+
+    counts = np.bincount(labels, minlength=nbins).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Offset bin numbers for each image and accumulate in one pass
+        ind = (labels + nbins*np.arange(nimage).reshape([-1,1])).ravel()
+        sums = np.bincount(ind, weights=data.ravel(), minlength=nimage*nbins)
+        mean = sums.reshape((nimage,nbins)) / counts
+        # Two-pass variance for numerical stability
+        dev = data - mean[:,labels]
+        sqsum = np.bincount(ind, weights=(dev**2).ravel(), minlength=nimage*nbins)
+        res = np.sqrt(sqsum.reshape((nimage,nbins)) / counts)
+
+    return res[0] if single else res
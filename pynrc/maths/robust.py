@@ -21,13 +21,12 @@ For additional information about the original IDL routines, see:
 
 from __future__ import division, print_function#, unicode_literals
 
-import math
 import numpy as np
 
 import logging
 _log = logging.getLogger('pynrc')
 
-__version__ = '0.4'
+__version__ = '0.5'
 __revision__ = '$Rev$'
 __all__ = ['medabsdev','biweightMean', 'mean', 'mode', 'std', \
            'checkfit', 'linefit', 'polyfit', \
@@ -75,7 +74,222 @@ def medabsdev(data, axis=None, keepdims=False):
 
 
 
-def biweightMean(inputData, axis=None, dtype=None):
+def _as_rows(inputData, axis=None, dtype=None):
+    """
+    Reshape data to a 2D array [nrow, n] with the reduction axis last.
+    Masked elements are set to NaN. Also returns the output shape
+    (None for axis=None).
+    """
+    if dtype is None:
+        dtype = inputData.dtype if inputData.dtype.kind == 'f' else np.float64
+    if isinstance(inputData, np.ma.MaskedArray):
+        data = inputData.astype(dtype).filled(np.nan)
+    else:
+        data = np.asarray(inputData).astype(dtype, copy=False)
+
+    if axis is None:
+        return data.reshape([1,-1]), None
+    data = np.moveaxis(data, axis, -1)
+    shape = data.shape[:-1]
+    return data.reshape([-1,data.shape[-1]]), shape
+
+def _from_rows(res, shape):
+    """Inverse of _as_rows for the reduced output."""
+    return res[0] if shape is None else res.reshape(shape)
+
+def _reduce(func, inputData, axis=None, dtype=None, mem_MB=None, **kwargs):
+    """
+    Apply a row-wise kernel func([nrow,n], **kwargs) -> [nrow] along axis.
+    If mem_MB is set, the data are processed in chunks along another axis
+    so that only a portion of the data (e.g. a memory-mapped cube) needs
+    to be in memory at once.
+    """
+    ndim = np.ndim(inputData)
+    if (axis is None) or (mem_MB is None) or (ndim < 2):
+        rows, shape = _as_rows(inputData, axis, dtype)
+        return _from_rows(func(rows, **kwargs), shape)
+
+    axis = axis % ndim
+    shape = inputData.shape
+    out_shape = shape[:axis] + shape[axis+1:]
+
+    # Iterate over the first non-reduced axis. Allow ~8 float64 temporaries per element.
+    it_ax = 0 if axis != 0 else 1
+    it_out = it_ax if it_ax < axis else it_ax - 1
+    slice_bytes = 8 * 8 * np.prod(shape) / shape[it_ax]
+    step = max(1, int(mem_MB * 1024**2 / slice_bytes))
+
+    out = None
+    for i0 in range(0, shape[it_ax], step):
+        sl = [slice(None)] * ndim
+        sl[it_ax] = slice(i0, i0+step)
+        res = _reduce(func, inputData[tuple(sl)], axis, dtype, None, **kwargs)
+        if out is None:
+            out = np.empty(out_shape, dtype=res.dtype)
+        osl = [slice(None)] * (ndim-1)
+        osl[it_out] = slice(i0, i0+step)
+        out[tuple(osl)] = res
+    return out
+
+def _median(data):
+    """
+    Median along the last axis of a 2D array, ignoring NaNs. Uses a partial 
+    sort (np.partition) when there are no NaNs; otherwise a full sort.
+    """
+    nrow, n = data.shape
+    nan = np.isnan(data)
+    if not nan.any():
+        kth = [(n-1)//2, n//2]
+        part = np.partition(data, kth, axis=-1)
+        return 0.5 * (part[:,kth[0]] + part[:,kth[1]])
+
+    # NaNs get sorted to the end of each row
+    srt = np.sort(data, axis=-1)
+    nvalid = n - nan.sum(axis=-1)
+    lo = np.clip((nvalid-1)//2, 0, n-1).reshape([-1,1])
+    hi = np.clip(nvalid//2, 0, n-1).reshape([-1,1])
+    med = 0.5 * (np.take_along_axis(srt, lo, -1) + np.take_along_axis(srt, hi, -1))[:,0]
+    med[nvalid==0] = np.nan
+    return med
+
+def _sum(data, mask):
+    """Sum along the last axis of the elements where mask is True."""
+    return np.where(mask, data, 0).sum(axis=-1)
+
+def _mean_rows(data, Cut=3.0):
+    """Row-wise kernel for mean()."""
+    valid = ~np.isnan(data)
+
+    data0 = _median(data).reshape([-1,1])
+    absdev = np.abs(data-data0)
+    maxAbsDev = _median(absdev) / 0.6745
+    small = maxAbsDev < __epsilon
+    if small.any():
+        meanAbsDev = _sum(absdev, valid) / valid.sum(axis=-1)
+        maxAbsDev = np.where(small, meanAbsDev / 0.8000, maxAbsDev)
+    maxAbsDev = maxAbsDev.reshape([-1,1])
+
+    sigmaCut = Cut if Cut > 1.0 else 1.0
+    if sigmaCut <= 4.5:
+        sigmaCorr = -0.15405 + 0.90723*sigmaCut - 0.23584*sigmaCut**2.0 + 0.020142*sigmaCut**3.0
+    else:
+        sigmaCorr = 1.0
+
+    # NaNs always fail the comparisons, so are excluded from good
+    with np.errstate(invalid='ignore', divide='ignore'):
+        good = absdev <= Cut*maxAbsDev
+        nGood = good.sum(axis=-1, keepdims=True)
+        dataMean = _sum(data, good).reshape([-1,1]) / nGood
+        dataSigma = np.sqrt(_sum((data-dataMean)**2.0, good).reshape([-1,1]) / nGood)
+        dataSigma = dataSigma / sigmaCorr
+
+        good = absdev <= Cut*dataSigma
+        dataMean = _sum(data, good) / good.sum(axis=-1)
+
+    return dataMean
+
+def _std_rows(data, Zero=False):
+    """Row-wise kernel for std()."""
+    valid = ~np.isnan(data)
+    nElements = valid.sum(axis=-1)
+
+    data0 = 0.0 if Zero else _median(data).reshape([-1,1])
+    dev = data - data0
+    absdev = np.abs(dev)
+    maxAbsDev = _median(absdev) / 0.6744897501960817
+    small = maxAbsDev < __epsilon
+    if small.any():
+        meanAbsDev = _sum(absdev, valid) / nElements
+        maxAbsDev = np.where(small, meanAbsDev / 0.8000, maxAbsDev)
+    zero = maxAbsDev < __epsilon
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u2 = (dev / 6.0 / maxAbsDev.reshape([-1,1]))**2.0
+        good = u2 <= 1.0
+        nGood = good.sum(axis=-1)
+
+        numerator = _sum(dev**2.0 * (1.0-u2)**2.0, good)
+        denominator = _sum((1.0-u2)*(1.0-5.0*u2), good)
+        sigma = nElements*numerator / (denominator*(denominator-1.0))
+        sigma = np.where(sigma > 0, np.sqrt(np.abs(sigma)), 0.0)
+
+    sigma[zero] = 0.0
+    strange = (nGood < 3) & (~zero)
+    if strange.any():
+        _log.warning("Distribution is too strange to compute standard deviation")
+        sigma[strange] = -1.0
+
+    return sigma
+
+def _biweight_rows(y):
+    """Row-wise kernel for biweightMean()."""
+    nrow = y.shape[0]
+    n = (~np.isnan(y)).sum(axis=-1)
+    closeEnough = 0.03*np.sqrt(0.5/(n-1))
+
+    y0 = _median(y)
+    sigma = _std_rows(y - y0.reshape([-1,1]))
+
+    # Rows still iterating
+    active = np.arange(nrow)[sigma >= __epsilon]
+    for nIter in range(__iterMax):
+        if len(active) == 0:
+            break
+
+        ya = y[active]
+        sa = sigma[active].reshape([-1,1])
+        uu = ((ya - y0[active].reshape([-1,1])) / (6.0*sa))**2.0
+        uu = np.where(uu > 1.0, 1.0, uu)
+        weights = np.where(np.isnan(ya), 0, (1.0-uu)**2.0)
+        weights /= weights.sum(axis=-1, keepdims=True)
+        y0[active] = _sum(weights*ya, weights > 0)
+
+        prevSigma = sigma[active]
+        sigma[active] = _std_rows(ya - y0[active].reshape([-1,1]), Zero=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            diff = np.where(sigma[active] > __epsilon, 
+                            np.abs(prevSigma - sigma[active]) / prevSigma, 0.0)
+        active = active[diff > closeEnough[active]]
+
+    return y0
+
+def _hsm_rows(data):
+    """Half-sample mode of each row of a 2D array sorted along the last axis."""
+    n = data.shape[-1]
+    while n > 3:
+        N = n//2 + n%2
+        # Choose the narrowest window containing half of the samples
+        w = data[:,N-1:2*N-1] - data[:,0:N]
+        j = np.argmin(w, axis=-1).reshape([-1,1])
+        data = np.take_along_axis(data, j + np.arange(N), -1)
+        n = N
+
+    if n == 1:
+        return data[:,0]
+    elif n == 2:
+        return data.mean(axis=-1)
+    else:
+        i1 = data[:,1] - data[:,0]
+        i2 = data[:,2] - data[:,1]
+        return np.where(i1 < i2, data[:,0:2].mean(axis=-1), data[:,1])
+
+def _mode_rows(data):
+    """Row-wise kernel for mode()."""
+    data = np.sort(data, axis=-1)
+    nan = np.isnan(data)
+    if not nan.any():
+        return _hsm_rows(data)
+
+    # Rows with a different number of valid elements are done separately
+    dataMode = np.empty(data.shape[0], dtype=data.dtype)
+    nvalid = data.shape[-1] - nan.sum(axis=-1)
+    for nv in np.unique(nvalid):
+        ind = (nvalid == nv)
+        dataMode[ind] = np.nan if nv == 0 else _hsm_rows(data[ind,0:nv])
+    return dataMode
+
+
+def biweightMean(inputData, axis=None, dtype=None, mem_MB=None):
     """
     Calculate the mean of a data set using bisquare weighting.  
 
@@ -85,51 +299,16 @@ def biweightMean(inputData, axis=None, dtype=None):
     .. versionchanged:: 1.0.3
         Added the 'axis' and 'dtype' keywords to make this function more
         compatible with np.mean()
+
+    All rows along axis are computed at once (each row converges within the
+    fixed maximum number of iterations). Masked and NaN elements are
+    ignored. Set mem_MB to process data along axis in chunks.
     """
 
-    if axis is not None:
-        fnc = lambda x: biweightMean(x, dtype=dtype)
-        y0 = np.apply_along_axis(fnc, axis, inputData)
-    else:
-        y = inputData.ravel()
-        if type(y).__name__ == "MaskedArray":
-            y = y.compressed()
-        if dtype is not None:
-            y = y.astype(dtype)
-        
-        n = len(y)
-        closeEnough = 0.03*np.sqrt(0.5/(n-1))
-    
-        diff = 1.0e30
-        nIter = 0
-    
-        y0 = np.median(y)
-        deviation = y - y0
-        sigma = std(deviation)
-    
-        if sigma < __epsilon:
-            diff = 0
-        while diff > closeEnough:
-            nIter = nIter + 1
-            if nIter > __iterMax:
-                break
-            uu = ((y-y0)/(6.0*sigma))**2.0
-            uu = np.where(uu > 1.0, 1.0, uu)
-            weights = (1.0-uu)**2.0
-            weights /= weights.sum()
-            y0 = (weights*y).sum()
-            deviation = y - y0
-            prevSigma = sigma
-            sigma = std(deviation, Zero=True)
-            if sigma > __epsilon:
-                diff = np.abs(prevSigma - sigma) / prevSigma
-            else:
-                diff = 0.0
-            
-    return y0
+    return _reduce(_biweight_rows, inputData, axis, dtype, mem_MB)
 
 
-def mean(inputData, Cut=3.0, axis=None, dtype=None):
+def mean(inputData, Cut=3.0, axis=None, dtype=None, mem_MB=None):
     """
     Robust estimator of the mean of a data set.  Based on the 
     resistant_mean function from the AstroIDL User's Library.
@@ -137,107 +316,28 @@ def mean(inputData, Cut=3.0, axis=None, dtype=None):
     .. versionchanged:: 1.0.3
         Added the 'axis' and 'dtype' keywords to make this function more
         compatible with np.mean()
+
+    All rows along axis are computed at once. Masked and NaN elements are ignored.
+    Set mem_MB to process data along axis in chunks.
     """
 
-    if axis is not None:
-        fnc = lambda x: mean(x, dtype=dtype)
-        dataMean = np.apply_along_axis(fnc, axis, inputData)
-    else:
-        data = inputData.ravel()
-        if type(data).__name__ == "MaskedArray":
-            data = data.compressed()
-        if dtype is not None:
-            data = data.astype(dtype)
-        
-        data0 = np.median(data)
-        maxAbsDev = np.median(np.abs(data-data0)) / 0.6745
-        if maxAbsDev < __epsilon:
-            maxAbsDev = (np.abs(data-data0)).mean() / 0.8000
-        
-        cutOff = Cut*maxAbsDev
-        good = np.where( np.abs(data-data0) <= cutOff )
-        good = good[0]
-        dataMean = data[good].mean()
-        dataSigma = math.sqrt( ((data[good]-dataMean)**2.0).sum() / len(good) )
-
-        if Cut > 1.0:
-            sigmaCut = Cut
-        else:
-            sigmaCut = 1.0
-        if sigmaCut <= 4.5:
-            dataSigma = dataSigma / (-0.15405 + 0.90723*sigmaCut - 0.23584*sigmaCut**2.0 + 0.020142*sigmaCut**3.0)
-        
-        cutOff = Cut*dataSigma
-        good = np.where(  np.abs(data-data0) <= cutOff )
-        good = good[0]
-        dataMean = data[good].mean()
-        if len(good) > 3:
-            dataSigma = math.sqrt( ((data[good]-dataMean)**2.0).sum() / len(good) )
-        
-        if Cut > 1.0:
-            sigmaCut = Cut
-        else:
-            sigmaCut = 1.0
-        if sigmaCut <= 4.5:
-            dataSigma = dataSigma / (-0.15405 + 0.90723*sigmaCut - 0.23584*sigmaCut**2.0 + 0.020142*sigmaCut**3.0)
-        
-        dataSigma = dataSigma / math.sqrt(len(good)-1)
-    
-    return dataMean
+    return _reduce(_mean_rows, inputData, axis, dtype, mem_MB, Cut=Cut)
 
 
-def mode(inputData, axis=None, dtype=None):
+def mode(inputData, axis=None, dtype=None, mem_MB=None):
     """
     Robust estimator of the mode of a data set using the half-sample mode.
 
     .. versionadded: 1.0.3
+
+    All rows along axis are computed at once. Masked and NaN elements are ignored.
+    Set mem_MB to process data along axis in chunks.
     """
 
-    if axis is not None:
-        fnc = lambda x: mode(x, dtype=dtype)
-        dataMode = np.apply_along_axis(fnc, axis, inputData)
-    else:
-        # Create the function that we can use for the half-sample mode
-        def _hsm(data):
-            if data.size == 1:
-                return data[0]
-            elif data.size == 2:
-                return data.mean()
-            elif data.size == 3:
-                i1 = data[1] - data[0]
-                i2 = data[2] - data[1]
-                if i1 < i2:
-                    return data[:2].mean()
-                elif i2 > i1:
-                    return data[1:].mean()
-                else:
-                    return data[1]
-            else:
-                wMin = data[-1] - data[0]
-                N = data.size/2 + data.size%2 
-                for i in xrange(0, N):
-                    w = data[i+N-1] - data[i] 
-                    if w < wMin:
-                        wMin = w
-                        j = i
-                return _hsm(data[j:j+N])
-            
-        data = inputData.ravel()
-        if type(data).__name__ == "MaskedArray":
-            data = data.compressed()
-        if dtype is not None:
-            data = data.astype(dtype)
-        
-        # The data need to be sorted for this to work
-        data = np.sort(data)
-    
-        # Find the mode
-        dataMode = _hsm(data)
-    
-    return dataMode
+    return _reduce(_mode_rows, inputData, axis, dtype, mem_MB)
 
 
-def std(inputData, Zero=False, axis=None, dtype=None):
+def std(inputData, Zero=False, axis=None, dtype=None, mem_MB=None):
     """
     Robust estimator of the standard deviation of a data set.  
 
@@ -246,48 +346,12 @@ def std(inputData, Zero=False, axis=None, dtype=None):
     .. versionchanged:: 1.0.3
         Added the 'axis' and 'dtype' keywords to make this function more
         compatible with np.std()
+
+    All rows along axis are computed at once. Masked and NaN elements are ignored.
+    Set mem_MB to process data along axis in chunks.
     """
 
-    if axis is not None:
-        fnc = lambda x: std(x, dtype=dtype)
-        sigma = np.apply_along_axis(fnc, axis, inputData)
-    else:
-        data = inputData.ravel()
-        if type(data).__name__ == "MaskedArray":
-            data = data.compressed()
-        if dtype is not None:
-            data = data.astype(dtype)
-        
-        if Zero:
-            data0 = 0.0
-        else:
-            data0 = np.median(data)
-        maxAbsDev = np.median(np.abs(data-data0)) / 0.6744897501960817
-        if maxAbsDev < __epsilon:
-            maxAbsDev = np.mean(np.abs(data-data0)) / 0.8000
-        if maxAbsDev < __epsilon:
-            sigma = 0.0
-            return sigma
-        
-        u = (data-data0) / 6.0 / maxAbsDev
-        u2 = u**2.0
-        good = np.where( u2 <= 1.0 )
-        good = good[0]
-        if len(good) < 3:
-            print("WARNING:  Distribution is too strange to compute standard deviation")
-            sigma = -1.0
-            return sigma
-        
-        numerator = ((data[good]-data0)**2.0 * (1.0-u2[good])**2.0).sum()
-        nElements = (data.ravel()).shape[0]
-        denominator = ((1.0-u2[good])*(1.0-5.0*u2[good])).sum()
-        sigma = nElements*numerator / (denominator*(denominator-1.0))
-        if sigma > 0:
-            sigma = math.sqrt(sigma)
-        else:
-            sigma = 0.0
-        
-    return sigma
+    return _reduce(_std_rows, inputData, axis, dtype, mem_MB, Zero=Zero)
 
 
 def checkfit(inputData, inputFit, epsilon, delta, BisquareLimit=6.0):
@@ -0,0 +1,168 @@
+"""
+Convolution of an image with a spatially-varying PSF
+
+Coronagraphic PSFs change with distance from the mask center. A disk model
+is split into annuli (or strips for the bar masks), and each annulus is
+convolved with the PSF appropriate for that radius. Rather than performing
+one full-frame convolution per PSF, SpatialConvolver:
+
+  - Crops each annulus to its bounding box and convolves only that region,
+    adding the result into the output (overlap-add).
+  - Uses real FFTs padded to fast sizes, and caches the PSF transforms for
+    each FFT shape, so repeated calls (e.g., for each roll angle) only
+    transform the image.
+  - Processes the annuli in a pool of threads, which share the input image
+    and PSF arrays in memory rather than pickling copies to subprocesses.
+
+The output is the same as the sum of astropy.convolution.convolve_fft()
+calls with boundary='fill' on each masked copy of the image.
+
+Example
+==========
+conv = SpatialConvolver(psf_list)
+edges = annulus_edges(offset_list, rho.max())
+image_conv = conv.convolve(image, rho, edges)
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+import threading
+
+import logging
+_log = logging.getLogger('pynrc')
+
+try:
+    from scipy import fft as _fft
+    from scipy.fft import next_fast_len
+except ImportError:
+    # scipy<1.4
+    _fft = np.fft
+    from scipy.fftpack import next_fast_len
+
+
+def annulus_edges(offset_list, rmax):
+    """
+    Annulus boundaries for a list of PSF offset positions. PSF i is used for
+    edges[i] <= rho < edges[i+1], where the boundaries lie half way between
+    offsets. The first annulus starts at offset_list[0] and the last one
+    extends to rmax.
+    """
+    offset_list = np.asarray(offset_list, dtype=float)
+    noff = len(offset_list)
+    if noff == 1:
+        return np.array([0, rmax+1.])
+
+    mid = (offset_list[1:] + offset_list[:-1]) / 2
+    return np.concatenate(([offset_list[0]], mid, [rmax+1.]))
+
+
+class SpatialConvolver(object):
+    """
+    Convolve images with a set of PSFs, each applied to a separate region.
+
+    Parameters
+    ==========
+    psf_list  : List of 2D PSF images. As with convolve_fft, the PSF center
+                is taken to be pixel (ny//2, nx//2).
+    normalize : Normalize each PSF to a sum of 1 (convolve_fft default).
+    nthreads  : Number of threads used to process regions in parallel.
+    """
+
+    def __init__(self, psf_list, normalize=True, nthreads=1):
+
+        self.psf_list = []
+        for psf in psf_list:
+            psf = np.asarray(psf, dtype=float)
+            if normalize:
+                psf = psf / psf.sum()
+            self.psf_list.append(psf)
+        self.nthreads = 1 if nthreads is None else max(int(nthreads), 1)
+
+        # (psf index, fft shape) -> rfft2 of zero-padded PSF
+        self._psf_fft = {}
+        self._lock = threading.Lock()
+
+    def psf_fft(self, i, fshape):
+        """Cached real FFT of PSF i padded to shape fshape."""
+        key = (i, fshape)
+        with self._lock:
+            res = self._psf_fft.get(key)
+        if res is None:
+            res = _fft.rfft2(self.psf_list[i], s=fshape)
+            with self._lock:
+                self._psf_fft[key] = res
+        return res
+
+    def _convolve_region(self, image, i, ind=None):
+        """
+        Full linear convolution of image (masked by ind, if specified) with
+        PSF i, restricted to the bounding box of ind. Returns the slices
+        of the output image and the values to add to them.
+        """
+        ny, nx = image.shape
+        ky, kx = self.psf_list[i].shape
+
+        if ind is None:
+            y0, y1, x0, x1 = 0, ny, 0, nx
+            sub = image
+        else:
+            rows = np.where(ind.any(axis=1))[0]
+            cols = np.where(ind.any(axis=0))[0]
+            if (len(rows) == 0) or (len(cols) == 0):
+                return None
+            y0, y1, x0, x1 = rows[0], rows[-1]+1, cols[0], cols[-1]+1
+            sub = np.where(ind[y0:y1,x0:x1], image[y0:y1,x0:x1], 0)
+
+        h, w = sub.shape
+        fshape = (next_fast_len(h+ky-1), next_fast_len(w+kx-1))
+        sub_fft = _fft.rfft2(sub, s=fshape)
+        sub_fft *= self.psf_fft(i, fshape)
+        full = _fft.irfft2(sub_fft, s=fshape)
+
+        # Full convolution index j maps to output pixel j + y0 - ky//2
+        oy0 = max(y0 - ky//2, 0); oy1 = min(y0 - ky//2 + h+ky-1, ny)
+        ox0 = max(x0 - kx//2, 0); ox1 = min(x0 - kx//2 + w+kx-1, nx)
+        jy0 = oy0 - (y0 - ky//2); jx0 = ox0 - (x0 - kx//2)
+        vals = full[jy0:jy0+(oy1-oy0), jx0:jx0+(ox1-ox0)]
+
+        return (slice(oy0,oy1), slice(ox0,ox1)), vals
+
+    def convolve(self, image, rho=None, edges=None):
+        """
+        Convolve image, using PSF i where edges[i] <= rho < edges[i+1].
+        If rho is None, the entire image is convolved with the first PSF.
+        """
+        image = np.asarray(image, dtype=float)
+        out = np.zeros_like(image)
+
+        if rho is None:
+            sl, vals = self._convolve_region(image, 0)
+            out[sl] += vals
+            return out
+
+        npsf = len(self.psf_list)
+        if len(edges) != npsf+1:
+            raise ValueError('Number of edges ({}) must be one more than the number of PSFs ({}).'
+                             .format(len(edges), npsf))
+
+        def worker(i):
+            ind = (rho >= edges[i]) & (rho < edges[i+1])
+            return self._convolve_region(image, i, ind)
+
+        if (self.nthreads <= 1) or (npsf == 1):
+            results = map(worker, range(npsf))
+        else:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self.nthreads, npsf))
+            try:
+                results = pool.map(worker, range(npsf))
+            finally:
+                pool.close()
+
+        for res in results:
+            if res is None: continue
+            sl, vals = res
+            out[sl] += vals
+
+        return out
@@ -0,0 +1,130 @@
+"""
+Theoretical detector noise for MULTIACCUM ramps
+
+Only depends on numpy, so that noise estimates are available without
+importing WebbPSF or Pysynphot.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+
+
+def pix_noise(ngroup=2, nf=1, nd2=0, tf=10.737, rn=15.0, ktc=29.0, p_excess=(0,0),
+    fsrc=0.0, idark=0.003, fzodi=0, fbg=0, ideal_Poisson=False, **kwargs):
+    """
+    Theoretical noise calculation of a generalized MULTIACCUM ramp in terms of e-/sec.
+    Includes flat field errors from JWST-CALC-003894.
+
+    Parameters
+    ===========
+    n (int) : Number of groups in integration ramp
+    m (int) : Number of frames in each group
+    s (int) : Number of dropped frames in each group
+    tf (float) : Frame time
+    rn (float) : Read Noise per pixel
+    ktc (float) : kTC noise only valid for single frame (n=1)
+    p_excess: An array or list of two elements that holding the
+        parameters that describe the excess variance observed in
+        effective noise plots. By default these are both 0.
+        Recommended values are [1.0,5.0] or SW and [1.5,10.0] for LW.
+
+    fsrc  (float) : Flux of source in e-/sec/pix
+    idark (float) : Dark current in e-/sec/pix
+    fzodi (float) : Zodiacal light emission in e-/sec/pix
+    fbg   (float) : Any additional background (telescope emission or scattered light?)
+
+    ideal_Poisson : If set to True, use total signal for noise estimate,
+                    otherwise MULTIACCUM equation is used?
+
+    Various parameters can either be single values or numpy arrays.
+    If multiple inputs are arrays, make sure their array sizes match.
+    Variables that need to have the same array sizes (or a single value):
+        - n, m, s, & tf
+        - rn, idark, ktc, fsrc, fzodi, & fbg
+
+    Array broadcasting also works:
+        For Example
+        n = np.arange(50)+1 # An array of groups to test out
+
+        # Create 2D Gaussian PSF with FWHM = 3 pix
+        npix = 20 # Number of pixels in x and y direction
+        x = np.arange(0, npix, 1, dtype=float)
+        y = x[:,np.newaxis]
+        x0 = y0 = npix // 2 # Center position
+        fwhm = 3.0
+        fsrc = np.exp(-4*np.log(2.) * ((x-x0)**2 + (y-y0)**2) / fwhm**2)
+        fsrc /= fsrc.max()
+        fsrc *= 10 # Total source counts/sec (arbitrarily scaled)
+        fsrc = fsrc.reshape(npix,npix,1) # Necessary for broadcasting
+
+        # Represents pixel array w/ different RN/pix
+        rn = np.ones([npix,npix,1])*15. 
+        # Results is a (20x20)x50 showing the noise in e-/sec/pix at each group
+        noise = pix_noise(ngroup=n, rn=rn, fsrc=fsrc) 
+    """
+
+    n = np.array(ngroup)
+    m = np.array(nf)
+    s = np.array(nd2)
+    tf = np.array(tf)
+    # Broadcast (rather than repeat) so that multi-dimensional 
+    # ramp settings keep their shape
+    n, m, s, tf = np.broadcast_arrays(n, m, s, tf)
+
+    # Total flux (e-/sec/pix)
+    ftot = fsrc + idark + fzodi + fbg
+
+    # Special case if n=1
+    if (n==1).any():
+        # Variance after averaging m frames
+        var = ktc**2 + (rn**2 + ftot*tf) / m
+        noise = np.sqrt(var) 
+        noise /= tf # In terms of e-/sec
+
+        if (n==1).all(): return noise
+        noise_n1 = noise
+
+    ind_n1 = (n==1)
+    temp = np.array(rn+ktc+ftot)
+    temp_bool = np.zeros(temp.shape, dtype=bool)
+    ind_n1_all = (temp_bool | ind_n1)
+
+    # Group time
+    tg = tf * (m + s)
+    # Effective integration time
+    tint = tg * (n - 1)
+
+    # Read noise, group time, and frame time variances
+    # This is the MULTIACCUM eq from Rauscher et al. (2007).
+    # This equation assumes that the slope-fitting routine uses
+    # incorrect covariance matrix that doesn't take into account
+    # the correlated Poisson noise up the ramp.
+    var_rn = rn**2       * 12.               * (n - 1.) / (m * n * (n + 1.))
+    var_gp = ftot * tint * 6. * (n**2. + 1.) / (5 * n * (n + 1.))
+    var_fm = ftot   * tf * 2. * (m**2. - 1.) * (n - 1.) / (m * n * (n + 1.))
+
+    # Functional form for excess variance above theoretical
+    # Empirically measured formulation
+    var_ex = 12. * (n - 1.)/(n + 1.) * p_excess[0]**2 - p_excess[1] / m**0.5
+
+    # Variance of total signal
+    var_poisson = (ftot * tint) if ideal_Poisson else (var_gp - var_fm)
+    
+    # Noise floor
+    var = var_rn + var_poisson + var_ex
+    sig = np.sqrt(var)
+
+    # Noise in e-/sec
+    noise = sig / tint
+    #print(ind_n1_all.shape,noise.shape,noise_n1.shape)
+    if (n==1).any():
+        noise[ind_n1_all] = noise_n1[ind_n1_all]
+
+    # Include flat field noise
+    # JWST-CALC-003894
+    noise_ff = 1E-4 # Uncertainty in the flat field
+    factor = 1 + noise_ff*np.sqrt(ftot)
+    noise *= factor
+
+    return noise
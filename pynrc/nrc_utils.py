@@ -28,7 +28,14 @@ import datetime, time
 import yaml, re, os
 import sys, platform
 import multiprocessing as mp
-import traceback
+import traceback, atexit
+
+from collections import OrderedDict
+try:
+    # Python 3.8+
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 
 from astropy.io import fits
 from astropy.io import ascii
@@ -46,6 +53,12 @@ from .maths.image_manip import *
 from .maths.fast_poly import *
 from .maths.coords import *
 
+from .psf_cache import cache_key, get_psf_cache
+from .nrc_noise import pix_noise
+from .bp_registry import get_bp_registry
+from .spec_grid import get_spec_grid, get_planet_grid
+from .bg_provider import get_bg_provider
+
 ###########################################################################
 #
 #    WebbPSF Stuff
@@ -154,6 +167,10 @@ def read_filter(filter, pupil=None, mask=None, module=None, ND_acq=False,
     """
     Read in filter throughput curve from file generated by STScI.
     Includes: OTE, NRC mirrors, dichroic, filter curve, and detector QE.
+
+    Each combination of inputs is only built once. The throughputs are
+    stored in the bandpass registry (see bp_registry.py), which is saved
+    to disk and rebuilt whenever the source throughput files are modified.
     
     Additional Keywords
     ===================
@@ -168,6 +185,42 @@ def read_filter(filter, pupil=None, mask=None, module=None, ND_acq=False,
 
     if module is None: module = 'A'
 
+    files = _read_filter_files(filter, pupil, mask, module, ND_acq, ice_scale, nvr_scale)
+    wave, th = get_bp_registry().get(_read_filter_build, files,
+        filter, pupil, mask, module, ND_acq, ice_scale, nvr_scale)
+
+    # Copy so that users can't modify the registry arrays
+    return S.ArrayBandpass(wave.copy(), th.copy(), name=filter)
+
+
+def _read_filter_files(filter, pupil=None, mask=None, module='A', ND_acq=False, 
+    ice_scale=None, nvr_scale=None):
+    """List of throughput files that read_filter() depends on."""
+
+    filt_dir = conf.PYNRC_PATH + 'throughputs/'
+    files = [filt_dir + filter + '_nircam_plus_ote_throughput_mod' + module.lower() + '_sorted.txt']
+    if ((mask is not None) and ('MASK' in mask)) or ND_acq:
+        files.append(filt_dir + 'jwst_nircam_moda_com_substrate_trans.fits')
+    if ND_acq:
+        files.append(filt_dir + 'NDspot_ODvsWavelength.txt')
+    if (pupil is not None) and ('LYOT' in pupil):
+        files.append(filt_dir + 'jwst_nircam_sw-lyot_trans_modmean.fits')
+        files.append(filt_dir + 'jwst_nircam_lw-lyot_trans_modmean.fits')
+    if (pupil is not None) and ('WEAK LENS' in pupil):
+        files.append(filt_dir + 'jwst_nircam_wlp8.fits')
+    if (ice_scale is not None) or (nvr_scale is not None):
+        files.append(filt_dir + 'ote_nc_sim_1.00.txt')
+
+    return files
+
+
+def _read_filter_build(filter, pupil=None, mask=None, module='A', ND_acq=False, 
+    ice_scale=None, nvr_scale=None):
+    """
+    Create the bandpass for read_filter() from the throughput files.
+    Returns the wavelength (Angstrom) and throughput arrays.
+    """
+
     # Select filter file and read
     f = filter.lower(); m = module.lower()
     #filt_dir = __location__ + 'throughputs_stsci/'
@@ -387,9 +440,8 @@ def read_filter(filter, pupil=None, mask=None, module=None, ND_acq=False,
     # Need to place zeros at either end so Pysynphot doesn't extrapolate
     warr = np.concatenate(([bp.wave.min()-dw],bp.wave,[bp.wave.max()+dw]))
     tarr = np.concatenate(([0],bp.throughput,[0]))
-    bp   = S.ArrayBandpass(warr, tarr, name=filter)
 
-    return bp
+    return warr, tarr
 
 
 ###########################################################################
@@ -614,20 +666,105 @@ def nproc_use(fov_pix, oversample, nwavelengths=None, coron=False):
 
     return int(nproc)
 
+def _psf_inst_setup(config):
+    """
+    Build a WebbPSF NIRCam instance from a configuration dictionary
+    created by psf_coeff(). This is the expensive part of setting up
+    a PSF calculation, so workers cache the result (see _psf_worker_inst).
+    """
+    # Change log levels to WARNING for pyNRC, WebbPSF, and POPPY
+    log_prev = conf.logging_level
+    setup_logging('WARN', verbose=False)
+
+    inst = webbpsf_NIRCam_mod()
+    inst.options['output_mode'] = 'oversampled'
+    inst.options['parity'] = 'odd'
+    inst.filter = config['filter']
+    setup_logging(log_prev, verbose=False)
+
+    # Check if mask and pupil names exist in WebbPSF lists.
+    # We don't want to pass values that WebbPSF does not recognize,
+    # but are otherwise completely valid in the NIRCam framework.
+    mask, pupil = (config['mask'], config['pupil'])
+    if mask in list(inst.image_mask_list): inst.image_mask = mask
+    if pupil in list(inst.pupil_mask_list): inst.pupil_mask = pupil
+    
+    # Telescope Pupil
+    if config['tel_pupil'] is not None:
+        inst.pupil = config['tel_pupil']
+
+    inst.options['source_offset_r']     = config['offset_r']
+    inst.options['source_offset_theta'] = config['offset_theta']
+    inst.pupilopd = config['opd']
+
+    # WebbPSF has wavelength limits depending on the channel by default
+    # We don't care about this, so set these to low/high values
+    inst.SHORT_WAVELENGTH_MIN = inst.LONG_WAVELENGTH_MIN = 0
+    inst.SHORT_WAVELENGTH_MAX = inst.LONG_WAVELENGTH_MAX = 10e-6
+
+    return inst
+
+# Instruments built by this process, keyed by configuration hash.
+# Only a few are kept, since each holds its own OPD and pupil arrays.
+_psf_worker_insts = OrderedDict()
+_psf_worker_ninst = 4
+def _psf_worker_inst(config_key, config):
+    """Return a (possibly cached) WebbPSF instance for this configuration."""
+    try:
+        inst = _psf_worker_insts.pop(config_key)
+    except KeyError:
+        inst = _psf_inst_setup(config)
+        while len(_psf_worker_insts) >= _psf_worker_ninst:
+            _psf_worker_insts.popitem(last=False)
+    _psf_worker_insts[config_key] = inst
+    return inst
+
+def _shm_attach(name):
+    """
+    Attach to an existing SharedMemory block owned (and unlinked) by the 
+    parent process. Pool workers share the parent's resource tracker, 
+    so Python < 3.13 (no track keyword) needs no extra bookkeeping.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
 def _wrap_coeff_for_mp(args):
     """
     Internal helper routine for parallelizing computations across multiple processors.
+
+    Each task is a chunk of wavelengths for a single optical configuration.
+    npsf is the total number of wavelengths (images) in the shared memory block.
+    If shm_name is specified, images are written directly into that shared 
+    memory block at the given indices and only success flags are returned.
+    Otherwise, a list of images is returned. Failed calculations are None.
     """
     # No multiprocessing for monochromatic wavelengths
     mp_prev = poppy.conf.use_multiprocessing
     poppy.conf.use_multiprocessing = False
 
-    inst,w,fov_pix,oversample = args
-    fov_pix_orig = fov_pix # Does calc_psf change fov_pix??
+    config_key, config, waves, inds, npsf, fov_pix, oversample, shm_name = args
+    npix = fov_pix * oversample # Does calc_psf change fov_pix??
+
+    if shm_name is not None:
+        shm = _shm_attach(shm_name)
+        images = np.ndarray((npsf,npix,npix), dtype=np.float64, buffer=shm.buf)
+
+    out = []
+    w = None
     try:
-        hdu_list = inst.calc_psf(outfile=None, save_intermediates=False, \
-                                 oversample=oversample, rebin=True, \
-                                 fov_pixels=fov_pix, monochromatic=w*1e-6)
+        inst = _psf_worker_inst(config_key, config)
+        for w, i in zip(waves, inds):
+            hdu_list = inst.calc_psf(outfile=None, save_intermediates=False, \
+                                     oversample=oversample, rebin=True, \
+                                     fov_pixels=fov_pix, monochromatic=w*1e-6)
+            im = pad_or_cut_to_size(hdu_list[0].data, npix)
+            if shm_name is None:
+                out.append(im)
+            else:
+                images[i] = im
+                out.append(True)
     except Exception as e:
         print('Caught exception in worker thread (w = {}):'.format(w))
         # This prints the type, value, and stack trace of the
@@ -635,18 +772,286 @@ def _wrap_coeff_for_mp(args):
         traceback.print_exc()
 
         print()
-        #raise e
-        return None
+        out += [None] * (len(waves) - len(out))
+    finally:
+        if shm_name is not None:
+            del images
+            shm.close()
+        # Return to previous setting
+        poppy.conf.use_multiprocessing = mp_prev
+
+    return out
+
+# Persistent pool of PSF workers shared by all psf_coeff() calls.
+_psf_pool = None
+_psf_pool_nproc = 0
+def _get_psf_pool(nproc):
+    """
+    Return the process-wide PSF worker pool, creating it on first use
+    (or growing it if more than the current number of processes are needed).
+    """
+    global _psf_pool, _psf_pool_nproc
+    if (_psf_pool is not None) and (nproc > _psf_pool_nproc):
+        close_psf_pool()
+    if _psf_pool is None:
+        _log.debug('Starting PSF worker pool with {} processes.'.format(nproc))
+        _psf_pool = mp.Pool(nproc)
+        _psf_pool_nproc = nproc
+    return _psf_pool
+
+def close_psf_pool(terminate=False):
+    """
+    Shut down the persistent PSF worker pool used by psf_coeff().
+    Called automatically at exit. A new pool is started as needed.
+    """
+    global _psf_pool, _psf_pool_nproc
+    if _psf_pool is None:
+        return
+    _log.debug('Closing PSF worker pool.')
+    if terminate:
+        _psf_pool.terminate()
+    else:
+        _psf_pool.close()
+    _psf_pool.join()
+    _psf_pool = None
+    _psf_pool_nproc = 0
+atexit.register(close_psf_pool, terminate=True)
+
+def _psf_images(config, waves, fov_pix, oversample, nproc=1):
+    """
+    Generate monochromatic WebbPSF images at each wavelength in waves
+    for a configuration dictionary created by psf_coeff(). 
 
-    # Return to previous setting
-    poppy.conf.use_multiprocessing = mp_prev
-    return pad_or_cut_to_size(hdu_list[0].data, fov_pix_orig*oversample)
-    #return hdu_list[0].data
+    With nproc>1, wavelengths are split into nproc chunks that are sent
+    to the persistent worker pool. Each worker builds the optical system
+    once per configuration, and images are returned via shared memory 
+    (Python 3.8+). Returns an array of shape (npsf, ny, nx).
+    """
 
+    waves = np.asarray(waves)
+    npsf = len(waves)
+    npix = fov_pix * oversample
+    # Workers cache the instrument by optical configuration only, so it is
+    # reused across calls with different wavelengths (e.g., adaptive sampling)
+    config_key = cache_key(config)
+
+    # Serial calculation
+    if nproc <= 1:
+        res = _wrap_coeff_for_mp((config_key, config, waves, np.arange(npsf), npsf,
+                                  fov_pix, oversample, None))
+        if any(im is None for im in res):
+            raise RuntimeError('Returned None values. Issue with WebbPSF??')
+        return np.array(res)
+
+    # Split wavelengths into (interleaved) chunks, one per process
+    inds_list = [np.arange(npsf)[i::nproc] for i in range(nproc)]
+    inds_list = [inds for inds in inds_list if len(inds)>0]
+
+    shm = None
+    if shared_memory is not None:
+        shm = shared_memory.SharedMemory(create=True, size=npsf*npix*npix*8)
+        shm_name = shm.name
+    else:
+        shm_name = None
+
+    worker_arguments = [(config_key, config, waves[inds], inds, npsf, fov_pix, oversample, shm_name) 
+                        for inds in inds_list]
+    pool = _get_psf_pool(nproc)
+    try:
+        res = pool.map(_wrap_coeff_for_mp, worker_arguments, chunksize=1)
+        flags = [r for res_chunk in res for r in res_chunk]
+        if any(r is None for r in flags):
+            raise RuntimeError('Returned None values. Issue with multiprocess or WebbPSF??')
+
+        if shm is None:
+            images = np.zeros((npsf,npix,npix))
+            for inds, res_chunk in zip(inds_list, res):
+                images[inds] = np.array(res_chunk)
+        else:
+            images = np.ndarray((npsf,npix,npix), dtype=np.float64, buffer=shm.buf).copy()
+    except Exception as e:
+        _log.error('Caught an exception during multiprocess.')
+        _log.error('Closing multiprocess pool.')
+        close_psf_pool(terminate=True)
+        raise e
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    return images
+
+
+def _psf_grism_stretch(images, pupil):
+    """
+    Take into account reduced beam factor for grism data.
+
+    Account for the circular pupil that does not allow all grism grooves to have their 
+    full length illuminated (Erickson & Rabanus 2000), effectively broadening the FWHM.
+    It's actually a hexagonal pupil, so the factor is 1.07, not 1.15.
+    """
+    wfact = 1.07
+    # We want to stretch the PSF in the dispersion direction
+    scale = (1,wfact) if 'GRISM0' in pupil else (wfact,1)
+    for i,im in enumerate(images):
+        im_scale = frebin(im, scale=scale)
+        images[i] = pad_or_cut_to_size(im_scale, im.shape)
+    return images
+
+def _psf_fit_resid(waves, images, wtest, imtest, deg):
+    """
+    Fit polynomial of degree deg to images and return the residuals of the
+    held-out images at wtest, relative to each held-out PSF's peak value.
+    """
+    cf = jl_poly_fit(waves, images, deg)
+    diff = jl_poly(wtest, cf) - imtest
+    diff = diff.reshape([len(wtest),-1])
+    peak = np.abs(imtest.reshape([len(wtest),-1])).max(axis=1)
+    return np.abs(diff).max(axis=1) / peak
+
+def _psf_coeff_adaptive(config, w1, w2, fov_pix, oversample, pupil=None, 
+    ndeg_max=7, npsf_max=None, psf_tol=1e-3, ndeg_min=2, npsf_init=None):
+    """
+    Adaptively sample wavelengths for the PSF polynomial fits.
+
+    Starts with a coarse, evenly-spaced grid of monochromatic PSFs. Each 
+    iteration generates PSFs at the midpoints of the intervals being tested
+    and compares them to the polynomial fit of the current grid (held-out
+    residuals, relative to the PSF peak). The lowest polynomial degree
+    with all residuals below psf_tol is selected, but never lower than the
+    degree chosen on a previous iteration, since the final fit applies a 
+    single degree to the whole band. Intervals that fail are split in two
+    and tested again on the next iteration, while intervals that pass are
+    left alone. All generated PSFs are included in the final fit.
+
+    Parameters
+    ==========
+    ndeg_max  : Maximum polynomial degree.
+    npsf_max  : Maximum total number of monochromatic PSFs.
+    psf_tol   : Tolerance for the held-out residuals (relative to PSF peak).
+    ndeg_min  : Minimum polynomial degree.
+    npsf_init : Size of initial wavelength grid. Default is 5 PSFs/um,
+                but at least ndeg_min+2.
+
+    Returns
+    =======
+    Coefficients and a dictionary containing the final wavelength grid
+    ('waves'), the polynomial degree ('ndeg'), the held-out wavelengths 
+    ('test_waves') and the residuals of the returned fit at those 
+    wavelengths ('resid') for auditing.
+    """
+
+    def gen_psfs(wvals):
+        nproc = nproc_use(fov_pix, oversample, len(wvals)) \
+            if poppy.conf.use_multiprocessing else 1
+        images = _psf_images(config, wvals, fov_pix, oversample, nproc=nproc)
+        if (pupil is not None) and ('GRISM' in pupil):
+            images = _psf_grism_stretch(images, pupil)
+        return images
+
+    if ndeg_max < ndeg_min:
+        raise ValueError('ndeg_max ({}) must be greater than or equal to ndeg_min ({}).'\
+            .format(ndeg_max, ndeg_min))
+
+    if npsf_init is None:
+        npsf_init = int(np.ceil(5 * (w2-w1)))
+    npsf_init = int(np.max([npsf_init, ndeg_min+2]))
+    if npsf_max is None:
+        npsf_max = int(np.ceil(20 * (w2-w1)))
+    npsf_max = int(np.max([npsf_max, npsf_init]))
+
+    waves = np.linspace(w1, w2, npsf_init)
+    images = gen_psfs(waves)
+
+    # Intervals to test on the next iteration
+    test_int = list(zip(waves[:-1], waves[1:]))
+    test_waves = []
+    deg = np.min([ndeg_min, len(waves)-1])
+    while len(test_int) > 0:
+        wmid = np.array([0.5*(wa+wb) for wa,wb in test_int])
+        nleft = npsf_max - len(waves)
+        if nleft <= 0:
+            break
+        last_iter = len(wmid) > nleft
+        if last_iter:
+            _log.warning('Reached npsf_max={} before all PSF fit residuals were below {}.'\
+                .format(npsf_max, psf_tol))
+            wmid = wmid[:nleft]
+            test_int = test_int[:nleft]
+        immid = gen_psfs(wmid)
+
+        # Lowest degree (at least that of the previous pass) that passes 
+        # everywhere, otherwise the best one
+        deg_max = np.min([ndeg_max, len(waves)-1])
+        res_best = None
+        for d in range(deg, deg_max+1):
+            res = _psf_fit_resid(waves, images, wmid, immid, d)
+            if (res_best is None) or (res.max() < res_best.max()):
+                deg, res_best = (d, res)
+            if res.max() <= psf_tol:
+                deg, res_best = (d, res)
+                break
+        test_waves += list(wmid)
+        _log.debug('Adaptive PSF sampling: npsf={}, ndeg={}, max resid={:.2e}'\
+            .format(len(waves), deg, res_best.max()))
+
+        # Include held-out PSFs in the grid
+        waves = np.concatenate([waves, wmid])
+        images = np.concatenate([images, immid])
+        isort = np.argsort(waves)
+        waves, images = (waves[isort], images[isort])
+
+        if last_iter:
+            break
+
+        # Split intervals that failed
+        test_int_new = []
+        for (wa,wb), wm, r in zip(test_int, wmid, res_best):
+            if r > psf_tol:
+                test_int_new += [(wa,wm), (wm,wb)]
+        test_int = test_int_new
+
+    coeff_all = jl_poly_fit(waves, images, deg)
+
+    # Residuals of the final fit at the (previously held-out) test wavelengths
+    test_waves = np.sort(test_waves)
+    test_resid = np.array([])
+    if len(test_waves) > 0:
+        itest = np.searchsorted(waves, test_waves)
+        imtest = images[itest].reshape([len(itest),-1])
+        diff = jl_poly(test_waves, coeff_all).reshape([len(itest),-1]) - imtest
+        test_resid = np.abs(diff).max(axis=1) / np.abs(imtest).max(axis=1)
+
+    info = {'waves':waves, 'ndeg':deg, 'test_waves':test_waves, 'resid':test_resid}
+    _log.info('Adaptive PSF sampling used {} PSFs (ndeg={}, max test resid={:.2e})'\
+        .format(len(waves), deg, np.max(test_resid) if len(test_resid)>0 else np.nan))
+
+    return coeff_all, info
+
+
+def psf_offset_used(mask, offset_r=0, offset_theta=0):
+    """
+    Source offset (r, theta) that psf_coeff() actually simulates
+    for a given coronagraphic mask:
+
+    1. Round masks - Always assume theta=0 due to symmetry.
+    2. Bar Masks - PSF positioning is different depending on r and theta.
+    3. All other imaging - Just perform nominal r=theta=0.
+       Any PSF movement is more quickly applied with sub-pixel shifting routines.
+    NB: Implementation of field-dependent OPD maps may change these settings.
+    """
+    mtemp = 'none' if mask is None else mask
+    if ('210R' in mtemp) or ('335R' in mtemp) or ('430R' in mtemp):
+        return (offset_r, 0)
+    elif ('MASKSWB' in mtemp) or ('MASKLWB' in mtemp):
+        return (offset_r, offset_theta)
+    else:
+        return (0, 0)
 
 def psf_coeff(filter_or_bp, pupil=None, mask=None, module='A', 
     fov_pix=11, oversample=None, npsf=None, ndeg=7, opd=None, tel_pupil=None,
-    offset_r=0, offset_theta=0, save=True, force=False, **kwargs):
+    offset_r=0, offset_theta=0, save=True, force=False, 
+    adaptive=False, psf_tol=1e-3, return_info=False, **kwargs):
     """
     Creates a set of coefficients that will generate a simulated PSF at any
     arbitrary wavelength. This function first uses webbPSF to simulate
@@ -687,11 +1092,23 @@ def psf_coeff(filter_or_bp, pupil=None, mask=None, module='A',
     tel_pupil : Telescope entrance pupil mask. By default pupil_RevV.fits. 
         Should either be a filename string or HDUList.
            
-    offset_r     :
-    offset_theta :
-    
-    save  :
-    force :
+    offset_r     : Radial offset of the source from the center (arcsec).
+    offset_theta : Position angle of the offset (deg CCW).
+    
+    save  : Store the coefficients in the PSF cache (memory and disk) and
+            return previously cached coefficients if they exist.
+            Cached arrays are read-only. See pynrc.psf_cache.
+    force : Recalculate coefficients even if they exist in the cache.
+
+    adaptive : Adaptively choose the wavelength sampling and polynomial degree.
+        Starts from a coarse grid and only adds wavelengths where held-out 
+        PSFs differ from the fit by more than psf_tol (relative to the PSF peak). 
+        In this mode, npsf and ndeg are the maximum allowed values 
+        (ndeg must be at least 2). 
+    psf_tol  : Residual tolerance for adaptive sampling.
+    return_info : Also return a dictionary with the wavelength grid ('waves'),
+        polynomial degree ('ndeg'), and for adaptive mode, the held-out
+        wavelengths ('test_waves') and their fractional residuals ('resid').
     """
 
     grism_obs = (pupil is not None) and ('GRISM' in pupil)
@@ -712,49 +1129,10 @@ def psf_coeff(filter_or_bp, pupil=None, mask=None, module='A',
         bp = filter_or_bp
         filter = bp.name
 
-    # Change log levels to WARNING for pyNRC, WebbPSF, and POPPY
-    log_prev = conf.logging_level
-    setup_logging('WARN', verbose=False)
-
-    # Create a simulated PSF with WebbPSF
-    inst = webbpsf_NIRCam_mod()
-    inst.options['output_mode'] = 'oversampled'
-    inst.options['parity'] = 'odd'
-    #inst.options['source_offset_r'] = offset_r
-    #inst.options['source_offset_theta'] = offset_theta
-    #inst.pupilopd = opd
-    inst.filter = filter
-    setup_logging(log_prev, verbose=False)
-
-    # Check if mask and pupil names exist in WebbPSF lists.
-    # We don't want to pass values that WebbPSF does not recognize,
-    # but are otherwise completely valid in the NIRCam framework.
-    if mask in list(inst.image_mask_list): inst.image_mask = mask
-    if pupil in list(inst.pupil_mask_list): inst.pupil_mask = pupil
-    
-    # Telescope Pupil
-    if tel_pupil is not None:
-        #print('Adding telescope pupil')
-        inst.pupil = tel_pupil
-
-
     mtemp = 'none' if mask is None else mask
     ptemp = 'none' if pupil is None else pupil
     # Get source offset positions
-    # 1. Round masks - Always assume theta=0 due to symmetry.
-    # 2. Bar Masks - PSF positioning is different depending on r and theta.
-    # 3. All other imaging - Just perform nominal r=theta=0.
-    #    Any PSF movement is more quickly applied with sub-pixel shifting routines.
-    # NB: Implementation of field-dependent OPD maps may change these settings.
-    rtemp, ttemp = (offset_r, offset_theta)
-    if ('210R' in mtemp) or ('335R' in mtemp) or ('430R' in mtemp):
-        rtemp, ttemp = (offset_r, 0)
-    elif ('MASKSWB' in mtemp) or ('MASKLWB' in mtemp):
-        rtemp, ttemp = (offset_r, offset_theta)
-    else:
-        rtemp = ttemp = 0
-    inst.options['source_offset_r']     = rtemp
-    inst.options['source_offset_theta'] = ttemp
+    rtemp, ttemp = psf_offset_used(mask, offset_r, offset_theta)
 
     # Deal with OPD file name
     #print(opd)
@@ -779,19 +1157,29 @@ def psf_coeff(filter_or_bp, pupil=None, mask=None, module='A',
     else:
         raise ValueError("opd must be a tuple or HDUList.")
     
-    # Name to save array of oversampled coefficients
-    save_dir = conf.PYNRC_PATH + 'psf_coeffs/'
-    # Create directory if it doesn't already exist
-    if not os.path.isdir(save_dir):
-        os.makedirs(save_dir)
-        
-    # Final filename to save coeff
-    fname = '{}_{}_{}_{}_{}_{}_{:.1f}_{:.1f}_{}.npy'.\
-        format(filter,mtemp,ptemp,module,fov_pix,oversample,rtemp,ttemp,otemp)
-    save_name = save_dir + fname
-
-    if (not force) and (save and os.path.exists(save_name)):
-        return np.load(save_name)
+    # Hash every input that affects the coefficients.
+    # The bandpass throughput is included since filter names alone do not
+    # capture modifications such as ND, ice, or NVR scaling.
+    cache = get_psf_cache()
+    cache_name = cache_key('psf_coeff', filter, bp.wave, bp.throughput, 
+        mtemp, ptemp, module, fov_pix, oversample, npsf, ndeg, 
+        rtemp, ttemp, opd, wfe_drift, tel_pupil)
+    if adaptive:
+        cache_name = cache_key(cache_name, 'adaptive', psf_tol)
+    _log.debug('PSF coeff cache key {} ({}_{}_{}_{}_{}_{}_{:.1f}_{:.1f}_{})'.\
+        format(cache_name,filter,mtemp,ptemp,module,fov_pix,oversample,rtemp,ttemp,otemp))
+
+    if (not force) and save:
+        coeff_all = cache.get(cache_name)
+        if coeff_all is not None:
+            if not return_info:
+                return coeff_all
+            info_waves = cache.get(cache_name + '_waves')
+            info_resid = cache.get(cache_name + '_resid')
+            if (info_waves is not None) and (info_resid is not None):
+                info = {'waves':info_waves, 'ndeg':coeff_all.shape[0]-1,
+                        'test_waves':info_resid[0], 'resid':info_resid[1]}
+                return coeff_all, info
 
     # Only drift OPD if PSF is in nominal position (rtemp=0).
     # Anything that is in an offset position is currently considered
@@ -834,108 +1222,257 @@ def psf_coeff(filter_or_bp, pupil=None, mask=None, module='A',
 
         hdu.header = header.copy()
         opd_hdulist = fits.HDUList([hdu]) 
-        inst.pupilopd = opd_hdulist
+        pupilopd = opd_hdulist
     else:
-        inst.pupilopd = opd
+        pupilopd = opd
+
+    # Everything needed to build the WebbPSF instrument.
+    # Workers build (and cache) the instrument from this information,
+    # so that only wavelengths need to be sent for each calculation.
+    config = {'filter':filter, 'pupil':pupil, 'mask':mask, 'tel_pupil':tel_pupil,
+              'offset_r':rtemp, 'offset_theta':ttemp, 'opd':pupilopd}
 
     # Select which wavelengths to use
     wgood = bp.wave / 1e4
     w1 = wgood.min()
     w2 = wgood.max()
 
-    # WebbPSF has wavelength limits depending on the channel by default
-    # We don't care about this, so set these to low/high values
-    inst.SHORT_WAVELENGTH_MIN = inst.LONG_WAVELENGTH_MIN = 0
-    inst.SHORT_WAVELENGTH_MAX = inst.LONG_WAVELENGTH_MAX = 10e-6
-
     # Create set of monochromatic PSFs to fit.
     if npsf is None:
         dn = 20 # 20 PSF simulations per um
         npsf = np.ceil(dn * (w2-w1))
     npsf = int(npsf)
-    waves = np.linspace(w1, w2, npsf)
 
-    # How many processors to split into?
-    nproc = nproc_use(fov_pix, oversample, npsf) if poppy.conf.use_multiprocessing else 1
-    _log.debug('nprocessors: %.0f; npsf: %.0f' % (nproc, npsf))
     # Change log levels to WARNING for pyNRC, WebbPSF, and POPPY
+    log_prev = conf.logging_level
     setup_logging('WARN', verbose=False)
     
     t0 = time.time()
-    # Setup the multiprocessing pool and arguments to pass to each pool
-    worker_arguments = [(inst, wlen, fov_pix, oversample) for wlen in waves]
-    if nproc > 1: 
-        pool = mp.Pool(nproc)
-        # Pass arguments to the helper function
-        images = pool.map(_wrap_coeff_for_mp, worker_arguments)
-
-        try:
-            images = pool.map(_wrap_coeff_for_mp, worker_arguments)
-            if images[0] is None:
-                raise RuntimeError('Returned None values. Issue with multiprocess or WebbPSF??')
-               
-        except Exception as e:
-            _log.error('Caught an exception during multiprocess.')
-            _log.error('Closing multiprocess pool.')
-            pool.terminate()
-            pool.close()
-            raise e
-            
+    try:
+        if adaptive:
+            coeff_all, info = _psf_coeff_adaptive(config, w1, w2, fov_pix, oversample, 
+                pupil=pupil, ndeg_max=ndeg, npsf_max=npsf, psf_tol=psf_tol)
         else:
-            _log.debug('Closing multiprocess pool.')
-            pool.close()
-    else:
-        # Pass arguments to the helper function
-        images = map(_wrap_coeff_for_mp, worker_arguments)	
+            waves = np.linspace(w1, w2, npsf)
+
+            # How many processors to split into?
+            nproc = nproc_use(fov_pix, oversample, npsf) if poppy.conf.use_multiprocessing else 1
+            _log.debug('nprocessors: %.0f; npsf: %.0f' % (nproc, npsf))
+
+            images = _psf_images(config, waves, fov_pix, oversample, nproc=nproc)
+
+            # Stretch grism PSFs in the dispersion direction
+            if grism_obs:
+                images = _psf_grism_stretch(images, pupil)
+    
+            # Simultaneous polynomial fits to all pixels using linear least squares
+            # 7th-degree polynomial seems to do the trick
+            coeff_all = jl_poly_fit(waves, images, ndeg)
+            info = {'waves':waves, 'ndeg':ndeg, 
+                    'test_waves':np.array([]), 'resid':np.array([])}
+    finally:
+        # Reset to original log levels
+        setup_logging(log_prev, verbose=False)
     t1 = time.time()
-    
-    # Reset to original log levels
-    setup_logging(log_prev, verbose=False)
     _log.debug('Took %.2f seconds to generate WebbPSF images' % (t1-t0))
 
-    # Take into account reduced beam factor for grism data
-    # Account for the circular pupil that does not allow all grism grooves to have their 
-    # full length illuminated (Erickson & Rabanus 2000), effectively broadening the FWHM.
-    # It's actually a hexagonal pupil, so the factor is 1.07, not 1.15.
-    wfact = 1.07
-    # We want to stretch the PSF in the dispersion direction
-    if grism_obs:
-        scale = (1,wfact) if 'GRISM0' in pupil else (wfact,1)
-        for i,im in enumerate(images):
-            im_scale = frebin(im, scale=scale)
-            images[i] = pad_or_cut_to_size(im_scale, im.shape)
-    
-    # Turn results into an numpy array (npsf,nx,ny)
-    #   Or is it (npsf,ny,nx)? Depends on WebbPSF's coord system...
-    images = np.array(images)
-
-###     # Simultaneous polynomial fits to all pixels using linear least squares
-###     # 7th-degree polynomial seems to do the trick
-###     #ndeg = 8 # 7+1
-###     x = waves
-###     #a = np.vstack((np.ones(npsf), x, x**2, x**3, x**4, x**5, x**6, x**7)).T
-###     a = np.array([x**num for num in range(ndeg+1)]).T
-###     #b = images.reshape([-1,npsf]).T
-###     b = images.reshape([npsf,-1])
-###     coeff_all, _, _, _ = np.linalg.lstsq(a, b)
-### 
-###     # The number of pixels to span spatially
-###     fov_pix_over = fov_pix * oversample	
-###     coeff_all = coeff_all.reshape([ndeg+1,fov_pix_over,fov_pix_over])
-    
-    # Simultaneous polynomial fits to all pixels using linear least squares
-    # 7th-degree polynomial seems to do the trick
-    coeff_all = jl_poly_fit(waves, images, ndeg)
-
     if save:
-        np.save(save_name, coeff_all)
+        coeff_all = cache.put(cache_name, coeff_all)
+        cache.put(cache_name + '_waves', info['waves'])
+        cache.put(cache_name + '_resid', np.array([info['test_waves'], info['resid']]))
 
+    if return_info:
+        return coeff_all, info
     return coeff_all
 
 
+# Cache of grism dispersion operators (see _grism_disperse_op)
+_grism_op_cache = OrderedDict()
+_grism_op_ncache = 8
+def _grism_disperse_op(wgood, dw, fov_pix, oversample, npix_spec, detector_sampling=False):
+    """
+    Sparse operator that places each monochromatic PSF at its dispersed
+    location in a grism spectral image.
+
+    Each PSF is shifted by oversample*(w-w1)/dw oversampled pixels, where the
+    fractional part of the shift is applied with linear interpolation 
+    (the same as im*(1-fracx) + np.roll(im,1,axis=1)*fracx). If 
+    detector_sampling=True, output columns are summed directly into 
+    detector pixels rather than oversampled pixels.
+
+    Operators are cached by their inputs. Returns (rows, cols, vals, ncols), 
+    where rows index the flattened [nwave, fov_pix_over] PSF columns.
+    """
+
+    key = cache_key(wgood, dw, fov_pix, oversample, npix_spec, detector_sampling)
+    try:
+        res = _grism_op_cache.pop(key)
+        _grism_op_cache[key] = res
+        return res
+    except KeyError:
+        pass
+
+    nw = len(wgood)
+    fov_pix_over = int(fov_pix * oversample)
+    ncols = int(npix_spec * oversample)
+
+    # Separate shift into an integer and fractional shift
+    delx = oversample * (wgood-wgood.min()) / dw # Number of oversampled pixels to shift
+    intx = np.floor(delx).astype(int)
+    fracx = delx - intx
+
+    # Input PSF column index for each (wavelength, column) row
+    jj = np.tile(np.arange(fov_pix_over), nw)
+    ii = np.repeat(np.arange(nw), fov_pix_over)
+    rows = ii*fov_pix_over + jj
+
+    # Integer shift and the wrapped neighbor (np.roll) for the fractional part
+    cols1 = intx[ii] + jj
+    cols2 = intx[ii] + (jj+1) % fov_pix_over
+    rows = np.concatenate([rows, rows])
+    cols = np.concatenate([cols1, cols2])
+    vals = np.concatenate([1.-fracx[ii], fracx[ii]])
+
+    ind = (cols < ncols) & (vals != 0)
+    rows, cols, vals = (rows[ind], cols[ind], vals[ind])
+
+    if detector_sampling:
+        cols = cols // oversample
+        ncols = npix_spec
+
+    res = (rows, cols, vals, ncols)
+    _grism_op_cache[key] = res
+    while len(_grism_op_cache) > _grism_op_ncache:
+        _grism_op_cache.popitem(last=False)
+
+    return res
+
+def _grism_disperse(psf_cube, binflux, wgood, dw, fov_pix, oversample, npix_spec, 
+    detector_sampling=False):
+    """
+    Disperse a cube of monochromatic PSFs for many spectra at once.
+
+    Parameters
+    ==========
+    psf_cube : PSFs evaluated at wgood [ny_over, nx_over, nwave]. 
+               Dispersion is along the x-axis.
+    binflux  : Binned count rates for each spectrum [nspec, nwave].
+
+    Returns
+    =======
+    Spectral images [nspec, ny, nx]. These are oversampled unless 
+    detector_sampling=True, in which case the PSFs are binned in y 
+    and the shifts are summed directly into detector columns.
+    """
+    from scipy.sparse import coo_matrix
+
+    binflux = np.atleast_2d(binflux)
+    nspec, nw = binflux.shape
+    fov_pix_over = int(fov_pix * oversample)
+
+    rows, cols, vals, ncols = _grism_disperse_op(wgood, dw, fov_pix, oversample, 
+                                                 npix_spec, detector_sampling)
+
+    # Spectra are stacked along the output columns, each weighting the rows
+    # of the operator by the flux at that row's wavelength.
+    iw = rows // fov_pix_over
+    rows_all = np.tile(rows, nspec)
+    cols_all = (cols + ncols*np.arange(nspec).reshape([-1,1])).ravel()
+    vals_all = (vals * binflux[:,iw]).ravel()
+    op = coo_matrix((vals_all, (rows_all, cols_all)), 
+                    shape=(nw*fov_pix_over, nspec*ncols)).tocsc()
+
+    # Flatten PSFs to [ny, (nwave, nx)]
+    if detector_sampling:
+        psf_cube = psf_cube.reshape([fov_pix, oversample, fov_pix_over, nw]).sum(axis=1)
+    ny = psf_cube.shape[0]
+    psf_flat = psf_cube.transpose([0,2,1]).reshape([ny,-1])
+
+    spec = op.T.dot(psf_flat.T) # [nspec*ncols, ny]
+    return spec.reshape([nspec, ncols, ny]).transpose([0,2,1])
+
+
+def _image_binflux(bp, sp_norm=None, npix=0):
+    """
+    Wavelengths (um) and binned count rates [nspec, nwave] used to weight
+    the monochromatic PSFs in gen_image_coeff(). npix is the size of the
+    coefficient cube, which sets how coarsely the bandpass is sampled.
+    """
+    waveset = np.copy(bp.wave)
+    # For generating the PSF, let's save some time and memory by not using
+    # ever single wavelength in the bandpass. Instead, cut by 1/3
+    if npix>2000:
+        binsize = 7
+    elif npix>1000:
+        binsize = 5
+    elif npix>700:
+        binsize = 3
+
+    if npix>700:
+        excess = waveset.size % binsize
+        waveset = waveset[:waveset.size-excess]
+        waveset = waveset.reshape(-1,binsize) # Reshape
+        waveset = waveset[:,binsize//2] # Use the middle values
+        waveset = np.concatenate(([bp.wave[0]],waveset,[bp.wave[-1]]))
+
+    wgood = waveset / 1e4
+    w1 = wgood.min(); w2 = wgood.max()
+    wrange = w2 - w1
+
+    # Flat spectrum with equal photon flux in each spectal bin
+    if sp_norm is None:
+        sp_flat = S.ArraySpectrum(waveset, 0*waveset + 10.)
+        sp_flat.name = 'Flat spectrum in photlam'
+
+        # Bandpass unit response is the flux (in flam) of a star that 
+        # produces a response of one count per second in that bandpass
+        sp_norm = sp_flat.renorm(bp.unit_response(), 'flam', bp)
+    
+
+    #elif isinstance(sp_norm, dict): # dictionary with position offsets?
+    # TODO: Want to deal with possibility of multiple spectra passed through as
+    # a dictionary???
+
+    # Make sp_norm a list of spectral objects if it already isn't
+    if not isinstance(sp_norm, list): sp_norm = [sp_norm]
+
+    # Set up an observation of the spectrum using the specified bandpass
+    # Use the bandpass wavelength set to bin the fluxes
+    obs_list = [S.Observation(sp, bp, binset=waveset) for sp in sp_norm]
+    for obs in obs_list: obs.convert('counts')
+
+    # Binned e/sec at each wavelength for all spectra [nspec, nwave]
+    binflux = np.array([obs.binflux for obs in obs_list])
+
+    return wgood, w1, wrange, binflux
+
+def spec_coeff_weights(bp, sp_norm=None, ncoeff=8, npix=0):
+    """
+    Weights that convert a cube of PSF coefficients into the image of each
+    spectrum in sp_norm (see gen_image_coeff):
+    
+        image[s] = np.tensordot(wts[s], coeff, axes=(0,0))
+
+    Summing the monochromatic PSFs weighted by each spectrum is 
+        sum_k flux[s,k] * sum_d coeff[d] * w_k**d = sum_d wts[s,d] * coeff[d]
+    so the returned array has shape [nspec, ncoeff]. The weights only
+    depend on the spectra and bandpass, so they can be shared by any
+    number of coefficient cubes (e.g., at different field positions).
+
+    Parameters
+    ==========
+    bp      : Pysynphot bandpass.
+    sp_norm : Normalized spectrum or list of spectra (default: flat in photlam).
+    ncoeff  : Number of polynomial coefficients (ndeg+1).
+    npix    : Size of the coefficient cube's last axis.
+    """
+    wgood, w1, wrange, binflux = _image_binflux(bp, sp_norm, npix)
+    xfan = wgood**np.arange(ncoeff).reshape([-1,1]) # [ncoeff, nwave]
+    return np.dot(binflux, xfan.T)
+
 def gen_image_coeff(filter_or_bp, pupil=None, mask=None, module='A', 
     sp_norm=None, coeff=None, fov_pix=11, oversample=4, 
-    return_oversample=False, **kwargs):
+    return_oversample=False, detector_sampling=False, **kwargs):
     """
     Create an image (direct, coronagraphic, grism, or DHS) based on a set of
     instrument parameters and PSF coefficients. The image is noiseless and
@@ -944,7 +1481,10 @@ def gen_image_coeff(filter_or_bp, pupil=None, mask=None, module='A',
     The result is effectively an idealized slope image.
 
     If no spectral dispersers (grisms or DHS), then this returns a single
-    image or list of images if sp_norm is a list of spectra.
+    image or list of images if sp_norm is a list of spectra. Many spectra
+    can be passed at once; images are generated with a single matrix product
+    of the binned fluxes and the PSF coefficients, so memory usage doesn't 
+    scale with the number of wavelength bins.
 
     Parameters
     -------------------
@@ -968,6 +1508,10 @@ def gen_image_coeff(filter_or_bp, pupil=None, mask=None, module='A',
     oversample : Factor of oversampling of detector pixels.
 
     return_oversample: If True, then also returns the oversampled version of the PSF
+    detector_sampling: For grism observations, disperse the PSFs directly into
+        detector pixels rather than building the oversampled spectral image.
+        Negative values are then clipped after (rather than before) binning.
+        Ignored if return_oversample=True.
 
     Keyword Args
     -------------------
@@ -987,57 +1531,8 @@ def gen_image_coeff(filter_or_bp, pupil=None, mask=None, module='A',
     if coeff is None:
         coeff = psf_coeff(bp, pupil, mask, module, fov_pix=fov_pix, oversample=oversample, **kwargs)
     
-    waveset = np.copy(bp.wave)
-    # For generating the PSF, let's save some time and memory by not using
-    # ever single wavelength in the bandpass. Instead, cut by 1/3
-    if coeff.shape[-1]>2000:
-        binsize = 7
-    elif coeff.shape[-1]>1000:
-        binsize = 5
-    elif coeff.shape[-1]>700:
-        binsize = 3
-
-    if coeff.shape[-1]>700:
-        excess = waveset.size % binsize
-        waveset = waveset[:waveset.size-excess]
-        waveset = waveset.reshape(-1,binsize) # Reshape
-        waveset = waveset[:,binsize//2] # Use the middle values
-        waveset = np.concatenate(([bp.wave[0]],waveset,[bp.wave[-1]]))
-
-    wgood = waveset / 1e4
-    w1 = wgood.min(); w2 = wgood.max()
-    wrange = w2 - w1
-
-    # Flat spectrum with equal photon flux in each spectal bin
-    if sp_norm is None:
-        sp_flat = S.ArraySpectrum(waveset, 0*waveset + 10.)
-        sp_flat.name = 'Flat spectrum in photlam'
-
-        # Bandpass unit response is the flux (in flam) of a star that 
-        # produces a response of one count per second in that bandpass
-        sp_norm = sp_flat.renorm(bp.unit_response(), 'flam', bp)
-    
-
-    #elif isinstance(sp_norm, dict): # dictionary with position offsets?
-    # TODO: Want to deal with possibility of multiple spectra passed through as
-    # a dictionary???
-
-    # Make sp_norm a list of spectral objects if it already isn't
-    if not isinstance(sp_norm, list): sp_norm = [sp_norm]
-    nspec = len(sp_norm)
-
-    # Set up an observation of the spectrum using the specified bandpass
-    # Use the bandpass wavelength set to bin the fluxes
-    obs_list = [S.Observation(sp, bp, binset=waveset) for sp in sp_norm]
-    for obs in obs_list: obs.convert('counts')
-
-    # Create a PSF for each wgood wavelength
-    psf_fit = jl_poly(wgood, coeff, dim_reorder=True)
-
-    # Multiply each monochromatic PSFs by the binned e/sec at each wavelength
-    # Array broadcasting: [nx,ny,nwave] x [0,0,nwave]
-    # Do this for each spectrum/observation
-    psf_list = [psf_fit*obs.binflux for obs in obs_list]
+    wgood, w1, wrange, binflux = _image_binflux(bp, sp_norm, coeff.shape[-1])
+    nspec = binflux.shape[0]
 
     # The number of pixels to span spatially
     fov_pix = int(fov_pix)
@@ -1054,32 +1549,25 @@ def gen_image_coeff(filter_or_bp, pupil=None, mask=None, module='A',
         npix_spec = int(wrange // dw + 1 + fov_pix)
         npix_spec_over = int(npix_spec * oversample)
 
-        spec_list = []
-        for psf_fit in psf_list:  
-            # If GRISM90 (along columns) rotate by 90 deg CW (270 deg CCW)
-            if 'GRISM90' in pupil:
-                psf_fit = np.rot90(psf_fit, k=3) # Rotate PSFs by 3*90 deg CCW
-
-            # Create oversampled spectral image
-            spec_over = np.zeros([fov_pix_over, npix_spec_over])
-            # Place each PSF at its dispersed location
-            for i, w in enumerate(wgood):
-                # Separate shift into an integer and fractional shift
-                delx = oversample * (w-w1) / dw # Number of oversampled pixels to shift
-                intx = int(delx)
-                fracx = delx - intx
-                if fracx < 0:
-                    fracx = fracx + 1
-                    intx = intx - 1
-
-                #spec_over[:,intx:intx+fov_pix_over] += fshift(psf_fit[:,:,i], fracx)
-                im = psf_fit[:,:,i]
-                spec_over[:,intx:intx+fov_pix_over] += im*(1.-fracx) + np.roll(im,1,axis=1)*fracx
-            
-            spec_over[spec_over<__epsilon] = 0 #__epsilon
+        # If GRISM90 (along columns) rotate by 90 deg CW (270 deg CCW)
+        if 'GRISM90' in pupil:
+            coeff = np.rot90(coeff, k=3, axes=(1,2)) # Rotate PSFs by 3*90 deg CCW
+
+        # Create a PSF for each wgood wavelength
+        psf_fit = jl_poly(wgood, coeff, dim_reorder=True)
 
-            # Rebin ovesampled spectral image to real pixels
-            spec_list.append(poppy.utils.krebin(spec_over, (fov_pix,npix_spec)))
+        # Place each PSF at its dispersed location for all spectra at once
+        detector_sampling = detector_sampling and (not return_oversample)
+        spec_all = _grism_disperse(psf_fit, binflux, wgood, dw, fov_pix, oversample, 
+                                   npix_spec, detector_sampling=detector_sampling)
+        spec_all[spec_all<__epsilon] = 0 #__epsilon
+
+        if detector_sampling:
+            spec_list = list(spec_all)
+        else:
+            # Rebin ovesampled spectral images to real pixels
+            spec_list = [poppy.utils.krebin(im, (fov_pix,npix_spec)) for im in spec_all]
+            spec_over = spec_all[-1]
 
         # Wavelength solutions
         dw_over = dw/oversample
@@ -1101,11 +1589,18 @@ def gen_image_coeff(filter_or_bp, pupil=None, mask=None, module='A',
 
     # Imaging
     else:
-        # Create source image slopes (no noise)
+        # Create source image slopes (no noise) for all spectra at once.
+        # Summing the monochromatic PSFs weighted by each spectrum is 
+        #   sum_k flux[s,k] * sum_d coeff[d] * w_k**d = sum_d wts[s,d] * coeff[d]
+        # so contract the fluxes with the polynomial terms first and never 
+        # build the [ny,nx,nwave] PSF cube.
+        xfan = wgood**np.arange(coeff.shape[0]).reshape([-1,1]) # [ndeg+1, nwave]
+        wts = np.dot(binflux, xfan.T)                           # [nspec, ndeg+1]
+        data_over_all = np.tensordot(wts, coeff, axes=(1,0))    # [nspec, ny, nx]
+        data_over_all[data_over_all<__epsilon] = 0
+
         data_list = []
-        for psf_fit in psf_list:
-            data_over = psf_fit.sum(axis=2)
-            data_over[data_over<__epsilon] = 0
+        for data_over in data_over_all:
             data_list.append(poppy.utils.krebin(data_over, (fov_pix,fov_pix)))
         
         if nspec == 1: data_list = data_list[0]
@@ -1170,6 +1665,18 @@ def get_SNR(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=None,
         coeff=coeff, fov_pix=fov_pix, oversample=oversample, \
         quiet=quiet, forwardSNR=True, **kwargs)
 
+def _ramp_kwargs_nd(kwargs, ndim):
+    """
+    Reshape array-valued ramp settings (ngroup, nf, nd2, tf) so that they
+    broadcast along a new leading axis against images with ndim dimensions
+    inside pix_noise(). Scalar values are left alone.
+    """
+    kwargs = kwargs.copy()
+    for k in ['ngroup', 'nf', 'nd2', 'tf']:
+        if (k in kwargs) and (np.size(kwargs[k]) > 1):
+            kwargs[k] = np.reshape(kwargs[k], [-1]+[1]*ndim)
+    return kwargs
+
 def _mlim_helper(sub_im, mag_norm=10, mag_arr=np.arange(5,35,1), 
     nsig=5, nint=1, snr_fact=1, forwardSNR=False, **kwargs):
     """
@@ -1179,24 +1686,91 @@ def _mlim_helper(sub_im, mag_norm=10, mag_arr=np.arange(5,35,1),
     sub_im_sum = sub_im.sum()
 
     # Just return the SNR for the input sub image
+    # (or an array of SNRs if ramp settings are arrays)
     if forwardSNR:
-        im_var = pix_noise(fsrc=sub_im, **kwargs)**2
-        ns_sum = np.sqrt(np.sum(im_var) / nint)
+        im_var = pix_noise(fsrc=sub_im, **_ramp_kwargs_nd(kwargs, 2))**2
+        ns_sum = np.sqrt(im_var.reshape(im_var.shape[:-2]+(-1,)).sum(axis=-1) / nint)
         return snr_fact * sub_im_sum / ns_sum
 
+    # Evaluate all trial magnitudes at once
     fact_arr = 10**((mag_arr-mag_norm)/2.5)
-    snr_arr = []
+    im = sub_im[np.newaxis,:,:] / fact_arr.reshape([-1,1,1])
+    im_var = pix_noise(fsrc=im, **kwargs)**2
+    im_sum = sub_im_sum / fact_arr
+    ns_sum = np.sqrt(im_var.reshape([fact_arr.size,-1]).sum(axis=1) / nint)
 
-    for f in fact_arr:
-        im = sub_im / f
-        im_var = pix_noise(fsrc=im, **kwargs)**2
-        im_sum = sub_im_sum / f
-        ns_sum = np.sqrt(np.sum(im_var) / nint)
-
-        snr_arr.append(im_sum / ns_sum)
-    snr_arr = snr_fact*np.asarray(snr_arr)
+    snr_arr = snr_fact * im_sum / ns_sum
     return np.interp(nsig, snr_arr[::-1], mag_arr[::-1])
 
+# Radial bin matrices, keyed by image shape (see _radial_bins)
+_radial_bins_cache = OrderedDict()
+def _radial_bins(shape):
+    """
+    Sparse matrix [npix, nbins] that sums an image into 1-pixel wide
+    annuli about the image center, along with the annuli radii. 
+    Results are cached by image shape, since they are reused for
+    each call to bg_sensitivity().
+    """
+    shape = tuple(shape)
+    try:
+        return _radial_bins_cache[shape]
+    except KeyError:
+        pass
+
+    from scipy.sparse import csr_matrix
+
+    rho_pix = dist_image(np.zeros(shape))
+    bins = np.arange(rho_pix.min(), rho_pix.max() + 1, 1)
+    # Groups indices for each radial bin
+    igroups, _, rad_pix = hist_indices(rho_pix, bins, True)
+
+    ibin = np.concatenate([np.zeros(len(ig), dtype=int)+i for i, ig in enumerate(igroups)])
+    ipix = np.concatenate(igroups)
+    bin_mat = csr_matrix((np.ones(ipix.size), (ipix, ibin)), 
+                         shape=(rho_pix.size, len(igroups)))
+
+    _radial_bins_cache[shape] = (bin_mat, rad_pix)
+    if len(_radial_bins_cache) > 16:
+        _radial_bins_cache.popitem(last=False)
+    return bin_mat, rad_pix
+
+def _interp_rows(x, xp, fp):
+    """
+    Same as np.interp(x, xp, fp[i]) for a scalar x, but for every row of fp.
+    """
+    t = np.interp(x, xp, np.arange(len(xp)))
+    i0 = int(np.floor(t))
+    i1 = np.min([i0+1, len(xp)-1])
+    frac = t - i0
+    return fp[:,i0]*(1-frac) + fp[:,i1]*frac
+
+def _EE_snr(image, fact_arr, rad_EE, nint=1, snr_fact=1, **kwargs):
+    """
+    SNR within an aperture of radius rad_EE (pixels) for image scaled by 
+    1/fact for each value in fact_arr. All scale factors are evaluated at 
+    once with a single broadcasted call to pix_noise(). 
+
+    Alternatively, ramp settings (ngroup, nf, nd2, tf) and snr_fact can be 
+    1D arrays of the same length to get the SNR for each ramp setting.
+    """
+    fact_arr = np.atleast_1d(fact_arr)
+    bin_mat, rad_pix = _radial_bins(image.shape)
+
+    # Encircled energy within each radius
+    EE_flux = np.cumsum(bin_mat.T.dot(image.ravel()))
+
+    ims = image[np.newaxis,:,:] / fact_arr.reshape([-1,1,1])
+    im_var = pix_noise(fsrc=ims, **_ramp_kwargs_nd(kwargs, 2))**2
+    im_var = im_var.reshape([im_var.shape[0],-1])
+
+    # Root squared sum of noise within each radius
+    EE_var = np.cumsum(bin_mat.T.dot(im_var.T).T, axis=1)
+    EE_sig = np.sqrt(EE_var / nint)
+
+    snr_fact = np.reshape(snr_fact, [-1,1])
+    EE_snr = snr_fact * (EE_flux / fact_arr.reshape([-1,1])) / EE_sig
+    return _interp_rows(rad_EE, rad_pix, EE_snr)
+
 def bg_sensitivity(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=None,
     sp=None, units=None, nsig=10, tf=10.737, ngroup=2, nf=1, nd2=0, nint=1,
     coeff=None, fov_pix=11, oversample=4, quiet=True, forwardSNR=False, 
@@ -1249,6 +1823,9 @@ def bg_sensitivity(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=No
     nd2    : Number of dropped frames per group
     nint   : Number of integrations/ramps to consider
 
+    With forwardSNR=True, ngroup, nf, nd2, and tf can also be 1D arrays 
+    (of equal size) to return the SNR for many ramp settings at once.
+
     PSF Information
     -------------------
     coeff : A cube of polynomial coefficients for generating PSFs. This is
@@ -1284,7 +1861,6 @@ def bg_sensitivity(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=No
 
     grism_obs = (pupil is not None) and ('GRISM' in pupil)
     dhs_obs   = (pupil is not None) and ('DHS'   in pupil)
-    coron_obs = (pupil is not None) and ('LYOT'   in pupil)
 
     # Get filter throughput and create bandpass 
     if isinstance(filter_or_bp, six.string_types):
@@ -1313,12 +1889,9 @@ def bg_sensitivity(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=No
         sp_norm.name = sp.name
 
     # Zodiacal Light Stuff
-    sp_zodi = zodi_spec(**kwargs)
-    obs_zodi = S.Observation(sp_zodi, bp, binset=waveset)
-    fzodi_pix = obs_zodi.countrate() * (pix_scale/206265.0)**2  # e-/sec/pixel
     # Collecting area gets reduced for coronagraphic observations
     # This isn't accounted for later, because zodiacal light doesn't use PSF information
-    if coron_obs: fzodi_pix *= 0.19
+    fzodi_pix = zodi_countrate(bp, pix_scale=pix_scale, pupil=pupil, **kwargs)  # e-/sec/pixel
 
     # The number of pixels to span spatially for WebbPSF calculations
     fov_pix = int(fov_pix)
@@ -1475,16 +2048,6 @@ def bg_sensitivity(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=No
         obs = S.Observation(sp_norm, bp, binset=waveset)
         efflam = obs.efflam()*1e-4 # microns
         
-        # Encircled energy
-        rho_pix = dist_image(image)
-        bins = np.arange(rho_pix.min(), rho_pix.max() + 1, 1)
-        # Groups indices for each radial bin
-        igroups, _, rad_pix = hist_indices(rho_pix, bins, True)
-        # Sum of each radial annulus
-        sums = binned_statistic(igroups, image, func=np.sum)
-        # Encircled energy within each radius
-        EE_flux = np.cumsum(sums)
-
         # How many pixels do we want?
         fwhm_pix = 1.2 * efflam * 0.206265 / 6.5 / pix_scale
         if rad_EE is None:
@@ -1499,16 +2062,9 @@ def bg_sensitivity(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=No
         #print(image_ext)
     
         if forwardSNR:
-            im_var = pix_noise(ngroup=ngroup, nf=nf, nd2=nd2, tf=tf, 
-                fzodi=fzodi_pix, fsrc=image, **kwargs)**2
-
-            # root squared sum of noise within each radius
-            sums = binned_statistic(igroups, im_var, func=np.sum)
-            EE_var = np.cumsum(sums)
-            EE_sig = np.sqrt(EE_var / nint)
-
-            EE_snr = snr_fact * EE_flux / EE_sig
-            snr_rad = np.interp(rad_EE, rad_pix, EE_snr)
+            snr_rad = _EE_snr(image, 1, rad_EE, nint=nint, snr_fact=snr_fact,
+                ngroup=ngroup, nf=nf, nd2=nd2, tf=tf, fzodi=fzodi_pix, **kwargs)
+            if snr_rad.size == 1: snr_rad = snr_rad[0]
             flux_val = obs.effstim(units)
             out1 = {'type':'Point Source', 'snr':snr_rad, 'Spectrum':sp.name, 
                 'flux':flux_val, 'flux_units':units}
@@ -1531,28 +2087,14 @@ def bg_sensitivity(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=No
         else:
             # Interpolate over a coarse magnitude grid to get SNR
             # Then again over a finer grid
+            # All magnitudes in each grid are evaluated at once.
             for ii in np.arange(2):
                 if ii==0: mag_arr = np.arange(5,35,1)
                 else: mag_arr = np.arange(mag_lim-1,mag_lim+1,0.05)
         
                 fact_arr = 10**((mag_arr-mag_norm)/2.5)
-                snr_arr = []
-                for f in fact_arr:
-                    #im_var = image/f/tint + var_const
-
-                    im_var = pix_noise(ngroup=ngroup, nf=nf, nd2=nd2, tf=tf, 
-                        fzodi=fzodi_pix, fsrc=image/f, **kwargs)**2
-                        
-                    # root squared sum of noise within each radius
-                    sums = binned_statistic(igroups, im_var, func=np.sum)
-                    EE_var = np.cumsum(sums)
-                    EE_sig = np.sqrt(EE_var / nint)
-
-                    EE_snr = snr_fact * (EE_flux/f) / EE_sig
-                    snr_rad = np.interp(rad_EE, rad_pix, EE_snr)
-                    snr_arr.append(snr_rad)
-
-                snr_arr = np.asarray(snr_arr)
+                snr_arr = _EE_snr(image, fact_arr, rad_EE, nint=nint, snr_fact=snr_fact,
+                    ngroup=ngroup, nf=nf, nd2=nd2, tf=tf, fzodi=fzodi_pix, **kwargs)
                 mag_lim = np.interp(nsig, snr_arr[::-1], mag_arr[::-1])
     
                 _log.debug('Mag Limits [{0:.2f},{1:.2f}]; {2:.0f}-sig: {3:.2f}'.\
@@ -1572,19 +2114,12 @@ def bg_sensitivity(filter_or_bp, pupil=None, mask=None, module='A', pix_scale=No
                 else: mag_arr = np.arange(mag_lim-1,mag_lim+1,0.05)
         
                 fact_arr = 10**((mag_arr-mag_norm)/2.5)
-                snr_arr = []
-                for f in fact_arr:
-                    im_var = pix_noise(ngroup=ngroup, nf=nf, nd2=nd2, tf=tf, 
-                        fzodi=fzodi_pix, fsrc=image_ext/f, **kwargs)**2
-
-                    im_sig = np.sqrt(im_var*npix_EE / nint)
-                    fsum2 = image_ext * npix_EE / f
-                    snr2 = snr_fact * fsum2 / im_sig
-                    #print('{:.5f} {:.5f} {:.2f}'.format(fsum2,im_sig,snr2))
-
-                    snr_arr.append(snr2)
+                im_var = pix_noise(ngroup=ngroup, nf=nf, nd2=nd2, tf=tf, 
+                    fzodi=fzodi_pix, fsrc=image_ext/fact_arr, **kwargs)**2
 
-                snr_arr = np.asarray(snr_arr)
+                im_sig = np.sqrt(im_var*npix_EE / nint)
+                fsum2 = image_ext * npix_EE / fact_arr
+                snr_arr = snr_fact * fsum2 / im_sig
                 mag_lim = np.interp(nsig, snr_arr[::-1], mag_arr[::-1])
     
                 _log.debug('Mag Limits (mag/asec^2) [{0:.2f},{1:.2f}]; {2:.0f}-sig: {3:.2f}'.\
@@ -1730,27 +2265,11 @@ def sat_limit_webbpsf(filter_or_bp, pupil=None, mask=None, module='A',
         _log.debug('Approximate Time to {1:.2f} of Saturation: {0:.1f} sec'.\
             format(sat_time.min(),well_frac))
 
+        # Brightest pixel within each wavelength bin
+        wsat_arr, peak_arr = _grism_peak_bins(bp, wspec, spec, fov_pix)
+
         # Magnitude necessary to saturate a given pixel
-        ratio = int_time/sat_time
-        ratio[ratio < __epsilon] = __epsilon
-        sat_mag = mag_norm + 2.5*np.log10(ratio)
-
-        # Wavelengths to grab saturation values
-        igood2 = bp.throughput > (bp.throughput.max()/4)
-        wgood2 = bp.wave[igood2] / 1e4
-        wsat_arr = np.unique((wgood2*10 + 0.5).astype('int')) / 10
-        wdel = wsat_arr[1] - wsat_arr[0]
-        msat_arr = []
-        for w in wsat_arr:
-            l1 = w-wdel/4
-            l2 = w+wdel/4
-            ind = ((wspec > l1) & (wspec <= l2))
-            msat = sat_mag[fov_pix//2-1:fov_pix//2+2,ind].max()
-            sp_temp = sp.renorm(msat, 'vegamag', bp_lim)
-            obs_temp = S.Observation(sp_temp, bp_lim, binset=bp_lim.wave)
-            msat_arr.append(obs_temp.effstim(units))
-    
-        msat_arr = np.array(msat_arr)
+        msat_arr = _sat_stim(sp_norm, bp_lim, peak_arr*int_time/sat_level, units)
 
         if not quiet:
             if bp_lim.name == bp.name:
@@ -1786,13 +2305,7 @@ def sat_limit_webbpsf(filter_or_bp, pupil=None, mask=None, module='A',
             format(sat_time,well_frac))
 
         # Magnitude necessary to saturate a given pixel
-        ratio = int_time/sat_time
-        sat_mag = mag_norm + 2.5*np.log10(ratio)
-    
-        # Convert to desired unit
-        sp_temp = sp.renorm(sat_mag, 'vegamag', bp_lim)
-        obs_temp = S.Observation(sp_temp, bp_lim, binset=bp_lim.wave)
-        sat_mag = obs_temp.effstim(units)
+        sat_mag = float(_sat_stim(sp_norm, bp_lim, int_time/sat_time, units))
 
         if not quiet:
             if bp_lim.name == bp.name:
@@ -1806,127 +2319,167 @@ def sat_limit_webbpsf(filter_or_bp, pupil=None, mask=None, module='A',
             'bp_lim':bp_lim.name}
 
 
-def pix_noise(ngroup=2, nf=1, nd2=0, tf=10.737, rn=15.0, ktc=29.0, p_excess=(0,0),
-    fsrc=0.0, idark=0.003, fzodi=0, fbg=0, ideal_Poisson=False, **kwargs):
+def _sat_stim(sp_norm, bp_lim, ratio, units='vegamag'):
+    """
+    Brightness in bp_lim of a source with the same spectral shape as sp_norm 
+    that saturates in ratio times the requested integration time (ie., the
+    source is sp_norm scaled by 1/ratio). Since renormalization is simply
+    a scale factor, only a single Observation is needed for any number of
+    ratio values. Magnitude units are offset by 2.5*log10(ratio) and all 
+    other units are divided by ratio.
     """
-    Theoretical noise calculation of a generalized MULTIACCUM ramp in terms of e-/sec.
-    Includes flat field errors from JWST-CALC-003894.
+    ratio = np.asarray(ratio, dtype=float)
+    ratio = np.where(ratio < __epsilon, __epsilon, ratio)
+
+    obs = S.Observation(sp_norm, bp_lim, binset=bp_lim.wave)
+    stim = obs.effstim(units)
+    if units.lower() in ['vegamag', 'abmag', 'stmag', 'obmag']:
+        return stim + 2.5*np.log10(ratio)
+    else:
+        return stim / ratio
+
+
+def _grism_peak_bins(bp, wspec, spec, fov_pix):
+    """
+    Find the brightest pixel in the central three rows of a grism spectral
+    image within 0.1 um wavelength bins (where the throughput is greater 
+    than 25% of its peak). Returns the bin wavelengths and peak values.
+    """
+    # Wavelengths to grab saturation values
+    igood2 = bp.throughput > (bp.throughput.max()/4)
+    wgood2 = bp.wave[igood2] / 1e4
+    wsat_arr = np.unique((wgood2*10 + 0.5).astype('int')) / 10
+    wdel = wsat_arr[1] - wsat_arr[0]
+
+    spec_cen = spec[fov_pix//2-1:fov_pix//2+2].max(axis=0)
+    peak_arr = []
+    for w in wsat_arr:
+        l1 = w-wdel/4
+        l2 = w+wdel/4
+        ind = ((wspec > l1) & (wspec <= l2))
+        peak_arr.append(spec_cen[ind].max())
+
+    return wsat_arr, np.array(peak_arr)
+
+
+def sat_limit_grid(filters, sp_list=None, bp_lim_list=None, pupil=None, mask=None, 
+    module='A', int_time=21.47354, full_well=81e3, well_frac=0.8, units='vegamag',
+    fov_pix=11, oversample=4, offset_r=0, offset_theta=0, **kwargs):
+    """
+    Saturation limits for a grid of filters, spectra, limiting bandpasses,
+    integration times, and well fractions, returned as a single table
+    with one row per combination (and per wavelength bin for grisms).
+
+    The PSF (or spectral image) is generated only once per filter for all 
+    spectra, and the peak pixel count rate for each spectrum is then
+    scaled to every integration time, well fraction, and bp_lim. See 
+    sat_limit_webbpsf() for a description of a single case.
 
     Parameters
-    ===========
-    n (int) : Number of groups in integration ramp
-    m (int) : Number of frames in each group
-    s (int) : Number of dropped frames in each group
-    tf (float) : Frame time
-    rn (float) : Read Noise per pixel
-    ktc (float) : kTC noise only valid for single frame (n=1)
-    p_excess: An array or list of two elements that holding the
-        parameters that describe the excess variance observed in
-        effective noise plots. By default these are both 0.
-        Recommended values are [1.0,5.0] or SW and [1.5,10.0] for LW.
-
-    fsrc  (float) : Flux of source in e-/sec/pix
-    idark (float) : Dark current in e-/sec/pix
-    fzodi (float) : Zodiacal light emission in e-/sec/pix
-    fbg   (float) : Any additional background (telescope emission or scattered light?)
-
-    ideal_Poisson : If set to True, use total signal for noise estimate,
-                    otherwise MULTIACCUM equation is used?
-
-    Various parameters can either be single values or numpy arrays.
-    If multiple inputs are arrays, make sure their array sizes match.
-    Variables that need to have the same array sizes (or a single value):
-        - n, m, s, & tf
-        - rn, idark, ktc, fsrc, fzodi, & fbg
-
-    Array broadcasting also works:
-        For Example
-        n = np.arange(50)+1 # An array of groups to test out
-
-        # Create 2D Gaussian PSF with FWHM = 3 pix
-        npix = 20 # Number of pixels in x and y direction
-        x = np.arange(0, npix, 1, dtype=float)
-        y = x[:,np.newaxis]
-        x0 = y0 = npix // 2 # Center position
-        fwhm = 3.0
-        fsrc = np.exp(-4*np.log(2.) * ((x-x0)**2 + (y-y0)**2) / fwhm**2)
-        fsrc /= fsrc.max()
-        fsrc *= 10 # Total source counts/sec (arbitrarily scaled)
-        fsrc = fsrc.reshape(npix,npix,1) # Necessary for broadcasting
-
-        # Represents pixel array w/ different RN/pix
-        rn = np.ones([npix,npix,1])*15. 
-        # Results is a (20x20)x50 showing the noise in e-/sec/pix at each group
-        noise = pix_noise(ngroup=n, rn=rn, fsrc=fsrc) 
-    """
-
-    n = np.array(ngroup)
-    m = np.array(nf)
-    s = np.array(nd2)
-    tf = np.array(tf)
-    max_size = np.max([n.size,m.size,s.size,tf.size])
-    if n.size  != max_size: n  = n.repeat(max_size)
-    if m.size  != max_size: m  = m.repeat(max_size)
-    if s.size  != max_size: s  = s.repeat(max_size)
-    if tf.size != max_size: tf = tf.repeat(max_size)
-
-    # Total flux (e-/sec/pix)
-    ftot = fsrc + idark + fzodi + fbg
-
-    # Special case if n=1
-    if (n==1).any():
-        # Variance after averaging m frames
-        var = ktc**2 + (rn**2 + ftot*tf) / m
-        noise = np.sqrt(var) 
-        noise /= tf # In terms of e-/sec
-
-        if (n==1).all(): return noise
-        noise_n1 = noise
-
-    ind_n1 = (n==1)
-    temp = np.array(rn+ktc+ftot)
-    temp_bool = np.zeros(temp.shape, dtype=bool)
-    ind_n1_all = (temp_bool | ind_n1)
-
-    # Group time
-    tg = tf * (m + s)
-    # Effective integration time
-    tint = tg * (n - 1)
-
-    # Read noise, group time, and frame time variances
-    # This is the MULTIACCUM eq from Rauscher et al. (2007).
-    # This equation assumes that the slope-fitting routine uses
-    # incorrect covariance matrix that doesn't take into account
-    # the correlated Poisson noise up the ramp.
-    var_rn = rn**2       * 12.               * (n - 1.) / (m * n * (n + 1.))
-    var_gp = ftot * tint * 6. * (n**2. + 1.) / (5 * n * (n + 1.))
-    var_fm = ftot   * tf * 2. * (m**2. - 1.) * (n - 1.) / (m * n * (n + 1.))
-
-    # Functional form for excess variance above theoretical
-    # Empirically measured formulation
-    var_ex = 12. * (n - 1.)/(n + 1.) * p_excess[0]**2 - p_excess[1] / m**0.5
-
-    # Variance of total signal
-    var_poisson = (ftot * tint) if ideal_Poisson else (var_gp - var_fm)
-    
-    # Noise floor
-    var = var_rn + var_poisson + var_ex
-    sig = np.sqrt(var)
-
-    # Noise in e-/sec
-    noise = sig / tint
-    #print(ind_n1_all.shape,noise.shape,noise_n1.shape)
-    if (n==1).any():
-        noise[ind_n1_all] = noise_n1[ind_n1_all]
-
-    # Include flat field noise
-    # JWST-CALC-003894
-    noise_ff = 1E-4 # Uncertainty in the flat field
-    factor = 1 + noise_ff*np.sqrt(ftot)
-    noise *= factor
-
-    return noise
+    ==========
+    filters     : List of filter names or pre-computed Pysynphot bandpasses.
+    sp_list     : List of Pysynphot spectra (default: G2V star).
+    bp_lim_list : List of bandpasses to report magnitudes (default: K-Band).
+    pupil, mask, module : Instrument settings shared by all filters.
+    int_time    : Integration time(s) in seconds.
+    full_well   : Detector well level in electrons.
+    well_frac   : Fraction(s) of full well to consider "saturated."
+    units       : Output units for saturation limits.
 
+    Keyword Args
+    ==========
+    fov_pix, oversample, offset_r, offset_theta, and **kwargs are passed
+    to gen_image_coeff().
+
+    Returns
+    ==========
+    Astropy Table with columns Filter, Spectrum, bp_lim, int_time, 
+    well_frac, and satmag (plus Wave for grisms). The units of satmag 
+    are stored in tbl.meta['units'].
+
+    Example
+    ==========
+    sp_list = [stellar_spectrum(spt) for spt in ['A0V', 'G2V', 'M0V']]
+    tbl = sat_limit_grid(['F200W', 'F444W'], sp_list, int_time=[10.7,21.5,42.9])
+    """
+
+    if isinstance(filters, six.string_types) or isinstance(filters, S.spectrum.SpectralElement):
+        filters = [filters]
+    if sp_list is None:
+        sp_list = [stellar_spectrum('G2V')]
+    elif not isinstance(sp_list, (list, tuple)):
+        sp_list = [sp_list]
+    if bp_lim_list is None:
+        bp_lim = S.ObsBandpass('johnson,k')
+        bp_lim.name = 'K-Band'
+        bp_lim_list = [bp_lim]
+    elif not isinstance(bp_lim_list, (list, tuple)):
+        bp_lim_list = [bp_lim_list]
+
+    # All combinations of integration times and well fractions
+    t_arr, wf_arr = np.meshgrid(np.atleast_1d(int_time), np.atleast_1d(well_frac), indexing='ij')
+    t_arr = t_arr.ravel(); wf_arr = wf_arr.ravel()
+    fact = t_arr / (wf_arr * full_well)
+
+    is_grism = (pupil is not None) and ('GRISM' in pupil)
+    if (pupil is not None) and ('DHS' in pupil):
+        raise NotImplementedError
+
+    mag_norm = 10.0
+    rows = {'Filter':[], 'Spectrum':[], 'bp_lim':[], 'Wave':[], 
+            'int_time':[], 'well_frac':[], 'satmag':[]}
+    for filter_or_bp in filters:
+        if isinstance(filter_or_bp, six.string_types):
+            bp = read_filter(filter_or_bp, pupil=pupil, mask=mask, module=module, **kwargs)
+        else:
+            bp = filter_or_bp
+
+        # Normalize all spectra in the filter bandpass and generate
+        # their images with a single call
+        sp_norm_list = []
+        for sp in sp_list:
+            sp.convert(bp.waveunits)
+            sp_norm = sp.renorm(mag_norm, 'vegamag', bp)
+            sp_norm.name = sp.name
+            sp_norm_list.append(sp_norm)
+        result = gen_image_coeff(bp, pupil, mask, module, sp_norm_list, None, fov_pix, 
+            oversample, offset_r=offset_r, offset_theta=offset_theta, **kwargs)
+
+        if is_grism:
+            wspec, spec_list = result
+            if len(sp_norm_list) == 1: spec_list = [spec_list]
+            peaks = [_grism_peak_bins(bp, wspec, spec, fov_pix) for spec in spec_list]
+        else:
+            im_list = result if len(sp_norm_list) > 1 else [result]
+            peaks = [(np.array([np.nan]), np.array([im.max()])) for im in im_list]
+
+        for sp_norm, (wave, peak) in zip(sp_norm_list, peaks):
+            # [ntime*nwell, nwave]
+            ratio = fact.reshape([-1,1]) * peak.reshape([1,-1])
+            nrow = ratio.size
+            for bp_lim in bp_lim_list:
+                bp_lim.convert(bp.waveunits)
+                satmag = _sat_stim(sp_norm, bp_lim, ratio, units)
+
+                rows['Filter'] += [bp.name] * nrow
+                rows['Spectrum'] += [sp_norm.name] * nrow
+                rows['bp_lim'] += [bp_lim.name] * nrow
+                rows['Wave'].append(np.tile(wave, t_arr.size))
+                rows['int_time'].append(np.repeat(t_arr, wave.size))
+                rows['well_frac'].append(np.repeat(wf_arr, wave.size))
+                rows['satmag'].append(satmag.ravel())
+
+    names = ['Filter', 'Spectrum', 'bp_lim', 'Wave', 'int_time', 'well_frac', 'satmag']
+    if not is_grism: names.remove('Wave')
+    cols = [rows[k] if isinstance(rows[k][0], six.string_types) else np.concatenate(rows[k])
+            for k in names]
+    tbl = Table(cols, names=names)
+    tbl.meta['units'] = units
+
+    for k in ['Wave', 'int_time', 'well_frac', 'satmag']:
+        if k in names: tbl[k].format = '9.2f'
+
+    return tbl
 
 
 ###########################################################################
@@ -1974,7 +2527,8 @@ def bin_spectrum(sp, wave, waveunits='um'):
     return sp2
 
 
-def BOSZ_spectrum(Teff, metallicity, log_g, res=2000, interpolate=True, **kwargs):
+def BOSZ_spectrum(Teff, metallicity, log_g, res=2000, interpolate=True, 
+    model_dir=None, **kwargs):
     """
     Read in a spectrum from the BOSZ stellar atmosphere models database.
     Returns a Pysynphot spectral object. Wavelength values range from 
@@ -1984,24 +2538,21 @@ def BOSZ_spectrum(Teff, metallicity, log_g, res=2000, interpolate=True, **kwargs
     closest in temperature, metallicity, and log g to the desired parameters, 
     then takes the weighted average of these models based on their relative 
     offsets. Can also just read in the closest model by setting interpolate=False.
+
+    If the grid has been converted with spec_grid.build_bosz_grid(), then
+    interpolated spectra come directly from the memory-mapped grid
+    (multilinear interpolation) and no FITS files are opened. The grid is
+    only used if model_dir is not specified.
     
     Different spectral resolutions can also be specified, currently only
     res=200 or res=2000.
 
+    model_dir : Location of the BOSZ models (default PYNRC_PATH/bosz_grids/).
+                If set, spectra are always read from the FITS files in model_dir.
+
     Ref: https://archive.stsci.edu/prepds/bosz/
     """
-    
-    model_dir = '/Volumes/NIRData/bosz_grids/'
-    res_dir = model_dir + 'R{}/'.format(res)
-    if not os.path.isdir(model_dir):
-        raise IOError('BOSZ model directory does not exist: {}'.format(model_dir))
-    if not os.path.isdir(res_dir):
-        raise IOError('Resolution directory does not exist: {}'.format(res_dir))
 
-    # Grid of computed temperature steps
-    teff_grid = range(3500,12000,250) + range(12000,20000,500) + range(20000,36000,1000)
-    teff_grid = np.array(teff_grid)
-    
     # Grid of log g steps for desired Teff
     lg_max = 5
     lg_step = 0.5
@@ -2016,6 +2567,24 @@ def BOSZ_spectrum(Teff, metallicity, log_g, res=2000, interpolate=True, **kwargs
         raise ValueError('log_g must be greater than {}'.format(lg_min))
     if log_g>lg_max:
         raise ValueError('log_g must be less than {}'.format(lg_max))
+
+    grid = get_spec_grid('bosz', res=res) if model_dir is None else None
+    if interpolate and (grid is not None):
+        name = 'BOSZ(Teff={},z={},logG={})'.format(Teff,metallicity,log_g)
+        return grid.spectrum(Teff, metallicity, log_g, name=name)
+    
+    if model_dir is None:
+        model_dir = conf.PYNRC_PATH + 'bosz_grids/'
+    res_dir = model_dir + 'R{}/'.format(res)
+    if not os.path.isdir(model_dir):
+        raise IOError('BOSZ model directory does not exist: {}'.format(model_dir))
+    if not os.path.isdir(res_dir):
+        raise IOError('Resolution directory does not exist: {}'.format(res_dir))
+
+    # Grid of computed temperature steps
+    teff_grid = list(range(3500,12000,250)) + list(range(12000,20000,500)) + \
+                list(range(20000,36000,1000))
+    teff_grid = np.array(teff_grid)
     
     # Grid of log g values
     logg_grid = np.arange(lg_min, lg_max+lg_step, lg_step)
@@ -2066,17 +2635,17 @@ def BOSZ_spectrum(Teff, metallicity, log_g, res=2000, interpolate=True, **kwargs
                 fname = 'a{}cp00op00{}{}v20modrt0{}rs.fits'.format(m,t,l,rstr)
                 fnames.append(fname)
 
-    # Weight by relative distance from desired value
+    # Weight by relative distance from desired value (closer models get more weight)
     weights = []
     teff_diff = np.abs(teff_best - Teff)
     logg_diff = np.abs(logg_best - log_g)
     metal_diff = np.abs(metal_best - metallicity)
     for t in teff_diff:
-        wt = 1 if len(teff_diff)==1 else t / np.sum(teff_diff)
+        wt = 1 if len(teff_diff)==1 else 1 - t / np.sum(teff_diff)
         for l in logg_diff:
-            wl = 1 if len(logg_diff)==1 else l / np.sum(logg_diff)
+            wl = 1 if len(logg_diff)==1 else 1 - l / np.sum(logg_diff)
             for m in metal_diff:
-                wm = 1 if len(metal_diff)==1 else m / np.sum(metal_diff)
+                wm = 1 if len(metal_diff)==1 else 1 - m / np.sum(metal_diff)
                 weights.append(wt*wl*wm)
     weights = np.array(weights)
     weights = weights / np.sum(weights)
@@ -2110,6 +2679,21 @@ def BOSZ_spectrum(Teff, metallicity, log_g, res=2000, interpolate=True, **kwargs
 
     
 
+def _icat_spectrum(catname, Teff, metallicity, log_g):
+    """
+    Same as S.Icat(), but uses the memory-mapped Phoenix grid
+    (see spec_grid.build_phoenix_grid) if it exists.
+    """
+    grid = get_spec_grid('phoenix') if catname.lower()=='phoenix' else None
+    if grid is not None:
+        try:
+            return grid.spectrum(Teff, metallicity, log_g)
+        except ValueError:
+            # Outside of converted grid
+            pass
+    return S.Icat(catname, Teff, metallicity, log_g)
+
+
 def stellar_spectrum(sptype, *renorm_args, **kwargs):
     """
     Get Pysynphot Spectrum object from a user-friendly spectral type string.
@@ -2218,7 +2802,7 @@ def stellar_spectrum(sptype, *renorm_args, **kwargs):
         if 'bosz' in catname.lower():
             sp = BOSZ_spectrum(v0, v1, v2, **kwargs)
         else:
-            sp = S.Icat(catname, v0, v1, v2)
+            sp = _icat_spectrum(catname, v0, v1, v2)
         sp.name = sptype
     else: # Interpolate values for undefined sptype
         # Sort the list and return their rank values
@@ -2238,7 +2822,7 @@ def stellar_spectrum(sptype, *renorm_args, **kwargs):
             sp = BOSZ_spectrum(v0, v1, v2, **kwargs)
         else:
             if ('ck04models' in catname.lower()) and (v0<3500): v0 = 3500
-            sp = S.Icat(catname, v0, v1, v2)
+            sp = _icat_spectrum(catname, v0, v1, v2)
         sp.name = sptype
         
     #print(int(v0),v1,v2)
@@ -2289,105 +2873,139 @@ def zodi_spec(zfact=None, locstr=None, year=None, day=None, **kwargs):
         
     """
 
+    f1, f2 = _zodi_zfact(zfact, locstr=locstr, year=year, day=day, **kwargs)
+    (t1, n1), (t2, n2) = _zodi_components
+
+    sp_zodi = (f1*n1) * S.BlackBody(t1) + (f2*n2) * S.BlackBody(t2)
+    sp_zodi.convert('flam')
+    sp_zodi.name = 'Zodiacal Light'
+
+    return sp_zodi
+
+# Zodiacal light components (temperature, scale factor). These values have 
+# been scaled to match JWST-CALC-003894 values in order to work with 
+# Pysynphot's blackbody function, which is normalized to 1Rsun at 1kpc.
+# T=5300K is solar scattered light and T=282K is thermal dust emission.
+_zodi_components = ((5300.0, 4.0e7), (282.0, 2.0e13))
+
+def _zodi_zfact(zfact=None, locstr=None, year=None, day=None, **kwargs):
+    """
+    Return the multiplicative factors (f1, f2) applied to each of the
+    zodiacal blackbody components. If locstr, year, and day are set, then 
+    the components are rescaled to match the Euclid background model 
+    at 1.0 and 5.5 um (see zodi_spec).
+    """
+
     if zfact is None: zfact = 2.5
-    #_log.debug('zfact:{0:.1f}'.format(zfact))
 
     if isinstance(zfact, (list, tuple, np.ndarray)): 
         f1, f2 = zfact
     else: 
         f1 = f2 = zfact
-    # These values have been scaled to match JWST-CALC-003894 values
-    # in order to work with Pysynphot's blackbody function.
-    # Pysynphot's BB function is normalized to 1Rsun at 1kpc by default.
-    f1 *= 4.0e7
-    f2 *= 2.0e13
-
-    bb1 = f1 * S.BlackBody(5300.0)
-    bb2 = f2 * S.BlackBody(282.0)
-
 
     # Query Euclid Background Model
     if (locstr is not None) and (year is not None) and (day is not None):
 
         # Wavelengths in um and values in MJy
         waves = np.array([1.0,5.5])
-        vals = zodi_euclid(locstr, year, day, waves, **kwargs)		
-    
+        vals = zodi_euclid(locstr, year, day, waves, **kwargs)
+
+        # MJy of each unit component at wavelength locations
+        (t1, n1), (t2, n2) = _zodi_components
+        bb1 = n1 * S.BlackBody(t1)
+        bb2 = n2 * S.BlackBody(t2)
         bb1.convert('Jy')
         bb2.convert('Jy')
-    
-        # MJy at wavelength locations
-        f_bb1 = bb1.sample(waves*1e4) / 1e6
-        f_bb2 = bb2.sample(waves*1e4) / 1e6
-    
-        bb1 *= (vals[0]-f_bb2[0])/f_bb1[0]
-        bb2 *= (vals[1]-f_bb1[1])/f_bb2[1]
+        u_bb1 = bb1.sample(waves*1e4) / 1e6
+        u_bb2 = bb2.sample(waves*1e4) / 1e6
 
-    sp_zodi = bb1 + bb2
-    sp_zodi.convert('flam')
-    sp_zodi.name = 'Zodiacal Light'
+        # Each component is scaled to match the Euclid value
+        # after removing the contribution of the other component
+        f1, f2 = (vals[0]-f2*u_bb2[0])/u_bb1[0], (vals[1]-f1*u_bb1[1])/u_bb2[1]
 
+    return f1, f2
 
-    return sp_zodi
+# Count rates of the unit zodiacal components keyed by (bandpass, pix_scale, Lyot)
+_zodi_rate_cache = {}
 
-def zodi_euclid(locstr, year, day, wavelengths=[1,5.5], ido_viewin=0, **kwargs):
+def _zodi_unit_rates(bp, pix_scale, pupil=None):
     """
-    Queries the IPAC Euclid Background Model at
-    http://irsa.ipac.caltech.edu/applications/BackgroundModel/
-    in order to get date and position-specific zodiacal dust emission.
+    Count rates (e-/sec/pixel) of each unit zodiacal component 
+    through bandpass bp. Results are cached per (bp, pix_scale, pupil).
+    """
+    lyot = (pupil is not None) and ('LYOT' in pupil)
+    key = cache_key(bp.wave, bp.throughput, float(pix_scale), lyot)
+    try:
+        return _zodi_rate_cache[key]
+    except KeyError:
+        pass
 
-    The program relies on urllib2 to download the page in XML format.
-    However, the website only allows single wavelength queries, so
-    this program implements a multithreaded procedure to query
-    multiple wavelengths simultaneously. However, due to the nature
-    of urllib2 library, only so many requests are allowed to go out
-    at a time, so this process can take some time to complete.
-    Testing shows about 500 wavelengths in 10 seconds as a rough
-    ballpark.
+    rates = []
+    for temp, norm in _zodi_components:
+        obs = S.Observation(norm * S.BlackBody(temp), bp, binset=bp.wave)
+        rates.append(obs.countrate())
+    rates = np.array(rates) * (pix_scale/206265.0)**2
 
-    Recommended to grab only a few wavelengths and use for normalization
-    purposes. 
+    # Collecting area gets reduced for coronagraphic observations
+    # (Lyot mask attenuation is not in bandpass throughput)
+    if lyot: rates *= 0.19
+
+    rates.flags.writeable = False
+    _zodi_rate_cache[key] = rates
+    return rates
+
+def zodi_countrate(bp, zfact=None, pix_scale=None, pupil=None, **kwargs):
     """
+    Zodiacal background flux (e-/sec/pixel) through a bandpass.
 
-    from urllib2 import urlopen
-    import xmltodict
-    from multiprocessing.pool import ThreadPool
+    Equivalent to integrating zodi_spec() through bp, but the count rate
+    of each blackbody component is only computed once per bandpass, so
+    any zfact is simply a dot product.
 
-    def fetch_url(url):
-        """
-        Need to add error handling.
-        """
-        response = urlopen(url)
-        response = response.read()
-        d = xmltodict.parse(response, xml_attribs=True)
-        fl_str = d['results']['result']['statistics']['zody']
-        return float(fl_str.split(' ')[0])
+    Parameters
+    ==========
+    bp        : Pysynphot bandpass.
+    zfact     : Zodiacal scale factor (scalar or 2-element array). See zodi_spec.
+    pix_scale : Pixel scale (arcsec/pixel). Defaults to SW or LW value for bp.
+    pupil     : Pupil element. Lyot stops reduce the collecting area.
 
+    **kwargs
+    ==========
+    locstr, year, day : Query the Euclid background model (see zodi_spec).
+    """
+    if pix_scale is None: 
+        pix_scale = channel_select(bp)[0]
+    f = _zodi_zfact(zfact, **kwargs)
+    return np.dot(f, _zodi_unit_rates(bp, pix_scale, pupil))
 
-    #locstr="17:26:44 -73:19:56"
-    locstr = locstr.replace(' ', '+')
-    #year=2019 
-    #day=1
-    #obslocin=0
-    #ido_viewin=1
-    #wavelengths=None
+def zodi_euclid(locstr, year, day, wavelengths=[1,5.5], ido_viewin=0, provider=None, **kwargs):
+    """
+    Date and position-specific zodiacal dust emission (MJy/sr) from the
+    IPAC Euclid Background Model:
+    http://irsa.ipac.caltech.edu/applications/BackgroundModel/
 
-    req_list = []
-    for w in wavelengths:
-        url = 'http://irsa.ipac.caltech.edu/cgi-bin/BackgroundModel/nph-bgmodel?'
-        req = "{}&locstr={}&wavelength={:.2f}&year={}&day={}&obslocin=0&ido_viewin={}"\
-            .format(url, locstr, w, year, day, ido_viewin)
-        req_list.append(req)
+    The values are supplied by a background provider (see bg_provider.py).
+    By default, this is a precomputed local table (PYNRC_PATH/zodi_table.npz)
+    if it exists, otherwise the web service is queried with the responses 
+    cached on disk. locstr, year, and day can be arrays in order to look up 
+    many targets and dates at once, in which case the output has shape 
+    [ntarget, nwave].
 
-    nthread = np.min([50,len(wavelengths)])
-    pool = ThreadPool(nthread)
-    results = pool.imap(fetch_url, req_list)
+    Parameters
+    ==========
+    locstr      : Object name, RA/DEC in decimal degrees or sexigesimal input
+    year        : Year of observation
+    day         : Day of observation
+    wavelengths : Wavelengths (um)
+    ido_viewin  : Web service only. If 1, use the median of the target's
+                  visibility window rather than the specified day.
+    provider    : Background provider instance (default get_bg_provider(ido_viewin)).
+    """
 
-    res = []
-    for r in results: res.append(r)
-    pool.close()
+    if provider is None:
+        provider = get_bg_provider(ido_viewin)
 
-    return np.array(res)
+    return provider.zodi(locstr, year, day, wavelengths)
 
 
 # def _zodi_spec_old(level=2):
@@ -2455,6 +3073,12 @@ class planets_sb12(object):
         entropy: Initial entropy (8.0-13.0) in increments of 0.25
         distance: Assumed distance in pc (default is 10pc)
         base_dir: Location of atmospheric model sub-directories.
+        interpolate: Interpolate the model grid in mass, age, and entropy 
+            rather than selecting the closest model. Requires the binary
+            planet store (see spec_grid.build_sb12_store).
+
+    If the binary planet store exists, models are read from the memory-mapped
+    store instead of scanning and parsing the text files.
     """
 
 	# Define default self.base_dir
@@ -2463,7 +3087,7 @@ class planets_sb12(object):
     def __init__(self, atmo='hy1s', mass=1, age=100, entropy=10.0, 
                  distance=10, base_dir=None, 
                  accr=False, mmdot=None, mdot=None, accr_rin=2.0, truncated=False,
-                 **kwargs):
+                 interpolate=False, **kwargs):
 
         self._atmo = atmo
         self._mass = mass
@@ -2474,8 +3098,14 @@ class planets_sb12(object):
             self.base_dir = base_dir
         self.sub_dir = self.base_dir  + 'SB.' + self.atmo + '/'
 
-        self.get_file()
-        self.read_file()
+        grid = get_planet_grid(self.base_dir)
+        if grid is not None:
+            self.read_store(grid, interpolate=interpolate)
+        elif interpolate:
+            raise IOError('Planet store does not exist. Run spec_grid.build_sb12_store().')
+        else:
+            self.get_file()
+            self.read_file()
         self.distance = distance
         
         self.accr = accr
@@ -2549,6 +3179,23 @@ class planets_sb12(object):
         # Distance (10 pc)
         self._distance = 10
 
+    def read_store(self, grid, interpolate=False):
+        """Get spectrum from the binary planet store (spec_grid.PlanetGrid)."""
+        if interpolate:
+            self.file = None
+            self._flux = grid.interp(self.atmo, self.mass, self.age, self.entropy)
+        else:
+            row = grid.nearest(self.atmo, self.mass, self.age, self.entropy)
+            self.file = grid.file[row]
+            self._flux = np.array(grid.flux[row], dtype='float64')
+        self._fluxunits = 'mJy'
+
+        self._wave = grid.wave
+        self._waveunits = 'um'
+
+        # Distance (10 pc)
+        self._distance = 10
+
     @property
     def mdot(self):
         return self.mmdot / self.mass
@@ -2601,7 +3248,10 @@ class planets_sb12(object):
         
     def export_pysynphot(self, waveout='angstrom', fluxout='flam'):
         w = self.wave; f = self.flux        
-        name = (re.split('[\.]', self.file))[0]#[5:]        
+        if self.file is None:
+            name = 'SB12({},mass={},age={},S={})'.format(self.atmo, self.mass, self.age, self.entropy)
+        else:
+            name = (re.split('[\.]', self.file))[0]#[5:]        
         sp = S.ArraySpectrum(w, f, name=name, waveunits=self.waveunits, fluxunits=self.fluxunits)
         
         sp.convert(waveout)
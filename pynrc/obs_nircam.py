@@ -1,18 +1,96 @@
 from __future__ import division, print_function, unicode_literals
 
-from astropy.convolution import convolve_fft, Gaussian2DKernel
+import numbers
+from collections import OrderedDict
+
 from scipy.ndimage.interpolation import rotate
-from scipy import fftpack
 
 # Import libraries
-from . import *
 from .nrc_utils import *
+from .pynrc_core import NIRCam, planets_sb12
+from .maths.spatial_conv import SpatialConvolver, annulus_edges
+from .psf_library import get_psf_library
 
 import logging
 _log = logging.getLogger('pynrc')
 
 eps = np.finfo(float).eps
 
+
+class SceneCache(object):
+    """
+    Memoized noiseless components of a simulated scene (PSFs, disk and 
+    planet images at each PA, background levels), so that repeated roll 
+    simulations only pay for rotation, noise, and subtraction.
+
+    Entries are keyed by their inputs (e.g., ('disk', PA)). The cache is
+    also tied to a state tuple describing everything the components depend
+    on (see obs_coronagraphy._scene_state). All entries are dropped whenever
+    that state changes. Objects within the state are compared by identity,
+    while strings, numbers, and lists (e.g., planet parameters) are compared 
+    by value.
+
+    Cached arrays are flagged read-only, because the same object is returned
+    to every caller.
+
+    Parameters
+    ==========
+    mem_MB : Memory budget for cached arrays in MB. Least recently used
+             entries are removed first, though the most recent entry is 
+             always kept.
+    """
+
+    def __init__(self, mem_MB=256):
+        self.mem_bytes = int(mem_MB * 1024**2)
+        self._state = None
+        self._data = OrderedDict()
+        self._nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._state = None
+        self._data.clear()
+        self._nbytes = 0
+
+    @staticmethod
+    def _same(v1, v2):
+        if v1 is v2:
+            return True
+        if isinstance(v1, (six.string_types, numbers.Number, list, tuple)):
+            try:
+                return bool(v1 == v2)
+            except Exception:
+                return False
+        return False
+
+    def check_state(self, state):
+        """Clear the cache if state differs from the stored state."""
+        old = self._state
+        if (old is None) or (len(old) != len(state)) or \
+           (not all(self._same(v1, v2) for v1, v2 in zip(old, state))):
+            if len(self._data) > 0:
+                _log.debug('Scene changed; clearing {} cached components'.format(len(self._data)))
+            self._data.clear()
+            self._nbytes = 0
+            self._state = state
+
+    def get(self, key, func, *args, **kwargs):
+        """Return the entry for key, calling func(*args, **kwargs) if not cached."""
+        try:
+            val = self._data.pop(key)
+        except KeyError:
+            val = func(*args, **kwargs)
+            if isinstance(val, np.ndarray):
+                val.flags.writeable = False
+            self._nbytes += np.size(val) * np.asarray(val).itemsize
+        self._data[key] = val
+        while (self._nbytes > self.mem_bytes) and (len(self._data) > 1):
+            _, old = self._data.popitem(last=False)
+            self._nbytes -= np.size(old) * np.asarray(old).itemsize
+        return val
+
 class obs_coronagraphy(NIRCam):
     """
     Subclass of the NIRCam instrument class used to observe stars 
@@ -159,45 +237,37 @@ class obs_coronagraphy(NIRCam):
         
     def _gen_psf_off(self):
         """
-        Create instances of NIRCam observations that are incrementally offset 
-        from coronagraph center to determine maximum value of the detector-
+        Create a library of PSFs that are incrementally offset from
+        coronagraph center to determine maximum value of the detector-
         sampled PSF for determination of contrast. Also saves the list of
-        PSFs for later retrieval.
+        (centered) PSFs at each offset for later retrieval.
         """
         
         # If no mask, then the PSF looks the same at all radii
         if self.mask is None:
             psf = self.gen_psf()
             self.psf_max_vals = ([0,10], [psf.max(),psf.max()]) # radius and psf max
-            self.psf_offsets = [self]
+            self.psf_lib = None
             self.psf_list = [psf]
         else:
-            psf_off = []
-            psf_max = []
-            self.psf_list = []
-            self.psf_offsets = []
-            for offset in self.offset_list:
-            
-                # Full FoV
-                fov_pix = 2 * np.max(self.offset_list) / self.pix_scale
-                # Increase to the next power of 2 and make odd
-                fov_pix = int(2**np.ceil(np.log2(fov_pix)+1))
-                oversample = self.psf_info['oversample']
-            
-                nrc_inst = NIRCam(self.filter, self.pupil, self.mask, \
-                                  fov_pix=fov_pix, oversample=oversample, \
-                                  offset_r=offset)
-                # Append offsets and PSF max values
-                psf = nrc_inst.gen_psf()
-                psf_off.append(offset)                
-                psf_max.append(psf.max())
-                self.psf_offsets.append(nrc_inst)
-
-                # Shift to center
-                offset_pix = -offset / nrc_inst.pix_scale
-                psf = fshift(psf, dely=offset_pix, pad=True)
-                self.psf_list.append(psf)
-
+            # Full FoV
+            fov_pix = 2 * np.max(self.offset_list) / self.pix_scale
+            # Increase to the next power of 2 and make odd
+            fov_pix = int(2**np.ceil(np.log2(fov_pix)+1))
+
+            # Coefficients for all offsets are stored in a single memory-mapped
+            # file, shifted to the center of the FoV.
+            psf_info = self.psf_info
+            self.psf_lib = get_psf_library(self.bandpass, self.pupil, self.mask, 
+                                           self.module, fov_pix=fov_pix, 
+                                           oversample=psf_info['oversample'], 
+                                           radii=self.offset_list, opd=psf_info['opd'],
+                                           tel_pupil=psf_info['tel_pupil'])
+
+            psf_off = list(self.offset_list)
+            self.psf_list = [self.psf_lib.gen_psf(offset_r=offset) for offset in psf_off]
+            # Peak values are measured before the PSFs were centered
+            psf_max = [self.psf_lib.psf_max(offset_r=offset) for offset in psf_off]
                 
             # Add background PSF info (without mask) for large distance
             psf_off.append(np.max([np.max(self.offset_list)+1, 4]))
@@ -369,55 +439,61 @@ class obs_coronagraphy(NIRCam):
             
         image_shape = (self.det_info['ypix'], self.det_info['xpix'])
         image = np.zeros(image_shape)
-        for pl in self.planets:
-            # Choose the PSF closest to the planet position
-            xoff, yoff = pl['xyoff_pix']
-            
-            # Add in PA offset
-            if PA_offset!=0:
-                #r, theta = xy_to_rtheta(xoff, yoff)
-                #xoff, yoff = rtheta_to_xy(r, theta+PA_offset)
-                xoff, yoff = xy_rot(xoff, yoff, PA_offset)
-            
-            xoff_asec, yoff_asec = np.array(pl['xyoff_pix']) * self.pix_scale
-            if len(self.offset_list) > 1:
-                if 'WB' in self.mask: # Bar mask
-                    roff_asec = np.abs(yoff_asec)
-                else: # Circular symmetric
-                    roff_asec = np.sqrt(xoff_asec**2 + yoff_asec**2)
 
-                roff_asec = np.sqrt(xoff_asec**2 + yoff_asec**2)
-                abs_diff = np.abs(np.array(self.offset_list)-roff_asec)
-                ind = np.where(abs_diff == abs_diff.min())[0][0]
-            else:
-                ind = 0
-
-            # Create slope image (postage stamp) of planet
-            if pl.get('sptype') is None:
-                sp = self.planet_spec(**pl)
-            else:
-                sp = stellar_spectrum(pl['sptype'])
-            renorm_args = pl['renorm_args']
-            if (renorm_args is not None) and (len(renorm_args) > 0):
-                sp_norm = sp.renorm(*renorm_args)
-                sp_norm.name = sp.name
-                sp = sp_norm
+        # Pixel offsets of all planets, including the PA offset
+        xyoff = np.array([pl['xyoff_pix'] for pl in self.planets], dtype=float)
+        xoff, yoff = xyoff[:,0], xyoff[:,1]
+        if PA_offset!=0:
+            xoff, yoff = xy_rot(xoff, yoff, PA_offset)
             
-            psf_planet = self.psf_offsets[ind].gen_psf(sp)
-        
-            # This is offset according to offset_list
-            # First, shift to center
-            offset_pix = -self.offset_list[ind] / self.pix_scale
-            psf_planet = fshift(psf_planet, dely=offset_pix, pad=True)
-        
-            # Expand to full size
-            psf_planet = pad_or_cut_to_size(psf_planet, image_shape)
+        # Create slope images (postage stamps) of all planets at once
+        sp_list = self._planet_spectra()
+        if self.psf_lib is None:
+            psf_planets = self.gen_psf(sp_list)
+        else:
+            # Centered PSFs, interpolated between library offsets
+            xoff_asec, yoff_asec = xoff * self.pix_scale, yoff * self.pix_scale
+            if 'WB' in self.mask: # Bar mask
+                roff_asec = np.abs(yoff_asec)
+            else: # Circular symmetric
+                roff_asec = np.sqrt(xoff_asec**2 + yoff_asec**2)
+            psf_planets = self.psf_lib.gen_psfs(sp_list, roff_asec)
         
-            # Shift to final position and add to image
-            #psf_planet = fshift(psf_planet, delx=xpix-xcen, dely=ypix-ycen, pad=True)
-            image += fshift(psf_planet, delx=xoff, dely=yoff, pad=True)
-            
-        return image
+        # Shift to final positions and add to image
+        return add_stamps(image, psf_planets, xoff, yoff)
+
+    def _planet_spectra(self):
+        """
+        List of normalized spectra for each entry in self.planets.
+        Planets with identical parameters (other than position)
+        share the same spectrum object.
+        """
+        sp_list = []
+        params = []
+        for pl in self.planets:
+            d = dict((k, v) for k, v in pl.items() if k != 'xyoff_pix')
+            sp = None
+            for d2, sp2 in params:
+                try:
+                    if d == d2:
+                        sp = sp2
+                        break
+                except ValueError: # e.g., arrays within renorm_args
+                    pass
+
+            if sp is None:
+                if pl.get('sptype') is None:
+                    sp = self.planet_spec(**pl)
+                else:
+                    sp = stellar_spectrum(pl['sptype'])
+                renorm_args = pl['renorm_args']
+                if (renorm_args is not None) and (len(renorm_args) > 0):
+                    sp_norm = sp.renorm(*renorm_args)
+                    sp_norm.name = sp.name
+                    sp = sp_norm
+                params.append((d, sp))
+            sp_list.append(sp)
+        return sp_list
         
     def kill_planets(self):
         self._planets = []
@@ -443,40 +519,26 @@ class obs_coronagraphy(NIRCam):
         if PA_offset!=0: 
             disk_image = rotate(disk_image, -PA_offset, reshape=False)
             
+        # Convolution engine caches the PSF transforms between calls
+        # (e.g., for each roll angle) as long as the PSFs are unchanged
+        if (getattr(self, '_disk_conv_psfs', None) is not self.psf_list):
+            noff = len(self.psf_list)
+            nproc = 1 if noff==1 else nproc_use_convolve(ypix*xpix, 1, noff)
+            self._disk_conv = SpatialConvolver(self.psf_list, nthreads=nproc)
+            self._disk_conv_psfs = self.psf_list
+
         if len(self.offset_list) == 1: # Direct imaging
-            psf = self.psf_list[0]
-            image_conv = convolve_fft(disk_image, psf, fftn=fftpack.fftn, 
-                                      ifftn=fftpack.ifftn, allow_huge=True)
+            image_conv = self._disk_conv.convolve(disk_image)
         else:
-            noff = len(self.offset_list)
-
             if 'WB' in self.mask: # Bar mask
                 ind1, ind2 = np.indices(image_shape)
                 image_rho = np.abs(ind1 - ypix/2)
             else: # Circular symmetric
                 image_rho = dist_image(disk_image, pixscale=header['PIXELSCL'])
-            worker_arguments = [(psf, disk_image, image_rho, self.offset_list, i) 
-                                for i,psf in enumerate(self.psf_list)]
-                                
-            npix = ypix*xpix
-            nproc = nproc_use_convolve(npix, 1, noff)
-            if nproc<=1:
-                imconv_slices = map(_wrap_convolve_for_mp, worker_arguments)
-            else:
-                pool = mp.Pool(nproc)
-                try:
-                    imconv_slices = pool.map(_wrap_convolve_for_mp, worker_arguments)
-                except Exception as e:
-                    print('Caught an exception during multiprocess:')
-                    raise e
-                finally:
-                    pool.close()
-                
-            # Turn into a numpy array of shape (noff,nx,ny)
-            imconv_slices = np.array(imconv_slices)
 
-            # Sum all images together
-            image_conv = imconv_slices.sum(axis=0)
+            # Each annulus is convolved with the PSF at that offset
+            edges = annulus_edges(self.offset_list, image_rho.max())
+            image_conv = self._disk_conv.convolve(disk_image, image_rho, edges)
             
         image_conv[image_conv<0] = 0
         return image_conv
@@ -524,9 +586,10 @@ class obs_coronagraphy(NIRCam):
             radius in arcsec
             n-sigma contrast
             n-sigma magnitude limit (vega mags)        
+
+        See calc_contrast_mc() for contrast curves averaged over many 
+        noise realizations.
         """
-        from astropy.convolution import convolve, Gaussian1DKernel
-        
 
         # If no HDUList is passed, then create one
         if hdu_diff is None:
@@ -536,33 +599,97 @@ class obs_coronagraphy(NIRCam):
                                            exclude_disk=exclude_disk, 
                                            exclude_planets=exclude_planets, **kwargs)
         
-    
         # Radial noise
         data = hdu_diff[0].data
         header = hdu_diff[0].header
-        rho = dist_image(data, pixscale=header['PIXELSCL'])
+        rr, stds = _radial_std(data, header['PIXELSCL'], header['OVERSAMP'])
+
+        return self._std_to_contrast(rr, stds, nsig=nsig)
 
-        # Get radial profiles
-        binsize = header['OVERSAMP'] * header['PIXELSCL']
-        bins = np.arange(rho.min(), rho.max() + binsize, binsize)
-        igroups, _, rr = nrc_utils.hist_indices(rho, bins, True)
-        stds = nrc_utils.binned_statistic(igroups, data, func=np.std)
-        stds = convolve(stds, Gaussian1DKernel(1))
+    def calc_contrast_mc(self, nreal=100, roll_angle=10, nsig=1, 
+        exclude_disk=True, exclude_planets=True, zfact=None, oversample=None, 
+        opt_diff=True, percentiles=[15.87,50,84.13], batch_size=10, 
+        seed=None, nproc=1):
+        """
+        Monte-Carlo version of calc_contrast(). The noiseless science roll(s)
+        and reference images are generated only once. Independent noise
+        realizations are then drawn in vectorized batches, and each realization
+        is roll-subtracted and reduced to a contrast curve as in gen_roll_image()
+        and calc_contrast().
+
+        Parameters
+        ==========
+        nreal       : Number of noise realizations.
+        roll_angle  : Telescope roll angle (deg) between two observations.
+        nsig        : n-sigma contrast curve
+        percentiles : Percentiles of the contrast distribution at each radius.
+        batch_size  : Number of realizations processed at once. Sets the memory
+                      usage (a few images of the subarray size per realization).
+        seed        : Seed for the random number generator. Each batch draws
+                      from its own stream spawned from this seed, so the results
+                      don't depend on nproc. 
+        nproc       : Number of processes to spread the batches across.
+
+        zfact, oversample, opt_diff, exclude_disk and exclude_planets are 
+        the same as in gen_roll_image().
+
+        Returns 4 arrays in a tuple:
+            radius in arcsec
+            mean n-sigma contrast
+            n-sigma magnitude limit (vega mags) of the mean contrast
+            n-sigma contrast at each percentile [npercentile, nradius]
+        """
+
+        PA1 = 0
+        PA2 = None if abs(roll_angle) < eps else roll_angle
+        models = self._roll_models(PA1=PA1, PA2=PA2, zfact=zfact, 
+                                   exclude_disk=exclude_disk, 
+                                   exclude_planets=exclude_planets)
+        if oversample is None: oversample = 1
+
+        # Independent random streams for each batch
+        nbatch = int(np.ceil(nreal / batch_size))
+        seeds = np.random.SeedSequence(seed).spawn(nbatch)
+        sizes = [min(batch_size, nreal - i*batch_size) for i in range(nbatch)]
+        pixscale = self.pix_scale / oversample
+        worker_arguments = [(models, n, ss, oversample, opt_diff, pixscale) 
+                            for n, ss in zip(sizes, seeds)]
+
+        if (nproc is None) or (nproc<=1) or (nbatch==1):
+            res = [_wrap_roll_mc_for_mp(args) for args in worker_arguments]
+        else:
+            pool = mp.Pool(min(nproc, nbatch))
+            try:
+                res = pool.map(_wrap_roll_mc_for_mp, worker_arguments)
+            except Exception as e:
+                print('Caught an exception during multiprocess:')
+                raise e
+            finally:
+                pool.close()
+
+        rr = res[0][0]
+        stds = np.concatenate([r[1] for r in res])
+        _, contrast_all, _ = self._std_to_contrast(rr, stds, nsig=nsig)
+        
+        contrast = np.mean(contrast_all, axis=0)
+        contrast_pct = np.percentile(contrast_all, percentiles, axis=0)
+        sen_mag = self.star_flux('vegamag') - 2.5*np.log10(contrast)
 
-        # Ignore corner regions
-        arr_size = np.min(data.shape) * header['PIXELSCL']
-        mask = rr < (arr_size/2)
-        rr = rr[mask]
-        stds = stds[mask]
+        return (rr, contrast, sen_mag, contrast_pct)
 
+    def _std_to_contrast(self, rr, stds, nsig=1):
+        """
+        Convert radial standard deviations (counts/sec) of roll-subtracted
+        images into n-sigma contrast and magnitude limits.
+        """
         # Normalized PSF radial standard deviation
         # Divide out count rate
         stds = stds / self.star_flux()
     
         # Grab the normalized PSF values generated on init
         psf_off_list, psf_max_list = self.psf_max_vals
-        psf_off_list.append(rr.max())
-        psf_max_list.append(psf_max_list[-1])
+        psf_off_list = list(psf_off_list) + [rr.max()]
+        psf_max_list = list(psf_max_list) + [psf_max_list[-1]]
         # Interpolate at each radial position
         psf_max = np.interp(rr, psf_off_list, psf_max_list)
         # Normalize and multiply by psf max
@@ -576,38 +703,43 @@ class obs_coronagraphy(NIRCam):
 
         return (rr, contrast, sen_mag)
 
-    def gen_roll_image(self, PA1=0, PA2=10, zfact=None, oversample=None, 
-        exclude_disk=False, exclude_planets=False, exclude_noise=False, 
-        opt_diff=True):
+    @property
+    def scene_cache(self):
         """
-        Create a final roll-subtracted slope image based on current observation
-        settings. Coordinate convention is for +V3 up and +V2 to left.
-        
-        Procedure:
-          - Create Roll 1 and Roll 2 slope images (star+exoplanets)
-          - Create Reference Star slope image
-          - Add random Gaussian noise to all images
-          - Subtract ref image from both rolls
-          - De-rotate Roll 2 by roll_angle amplitude
-          - Average Roll 1 and de-rotated Roll 2
-          
-        Parameters
-        ==========
-        PA1 : Position angle of first roll position (clockwise, from East to West)
-        PA2 : Position angle of second roll position (optional)
-              If set equal to PA1 (or to None), then only one roll will be performed.
-              Otherwise, two rolls are performed, each using the specified 
-              MULTIACCUM settings (doubling the effective exposure time).
-        zfact      : Zodiacal background factor (default=2.5)
-        oversample : Set oversampling of final image.
-        
-        exclude_disk  : Ignore disk when subtracted image (for radial contrast),
-                        but still add Poisson noise from disk.
-        exclude_noise : Don't add random Gaussian noise (detector+photon)
-        
-        Returns an HDUList of final image (North rotated upwards).
+        Cache of noiseless scene components used by gen_roll_image().
+        Call self.scene_cache.clear() to force their regeneration.
         """
-    
+        try:
+            return self._scene_cache
+        except AttributeError:
+            self._scene_cache = SceneCache()
+            return self._scene_cache
+
+    def _scene_state(self):
+        """
+        Everything the cached scene components depend on. Filter, pupil, mask, 
+        WFE drift, or detector changes create new bandpass, PSF coefficient, 
+        and detector objects, which are compared by identity.
+        """
+        ref = self.nrc_ref
+        planets = [dict(pl) for pl in self.planets]
+        return (self.filter, self.pupil, self.mask, self.module, self._wfe_drift,
+                self.bandpass, self._psf_coeff, ref._psf_coeff, 
+                self.Detectors[0], ref.Detectors[0], self.sp_sci, self.sp_ref, 
+                self.distance, self.disk_hdulist, self.psf_list, 
+                getattr(self, 'psf_lib', None), planets)
+
+    def _roll_models(self, PA1=0, PA2=10, zfact=None, exclude_disk=False, 
+        exclude_planets=False, exclude_noise=False):
+        """
+        Noiseless images and noise per pixel that go into gen_roll_image().
+        Returns a dictionary that can be passed to _roll_subtract() 
+        along with the number of noise realizations.
+
+        The PSFs, disk and planet images, and background levels are taken
+        from self.scene_cache when the scene hasn't changed.
+        """
+        
         # Final image shape
         xpix, ypix = (self.det_info['xpix'], self.det_info['ypix'])
         image_shape = (ypix, xpix)
@@ -622,142 +754,116 @@ class obs_coronagraphy(NIRCam):
             roll_angle = 0
         else:
             roll_angle = PA2 - PA1
-        if oversample is None: oversample = 1
    
         sci = self
         ref = self.nrc_ref
+        models = {'PA1':PA1, 'roll_angle':roll_angle}
+
+        cache = self.scene_cache
+        cache.check_state(self._scene_state())
+        def gen_psf_full(inst, sp):
+            im = inst.gen_psf(sp, return_oversample=False)
+            return pad_or_cut_to_size(im, image_shape)
         
         # Reference star slope simulation
         # Ideal slope
-        im_ref = ref.gen_psf(sci.sp_ref, return_oversample=False)
-        im_ref = pad_or_cut_to_size(im_ref, image_shape)
+        im_ref = cache.get(('ref_psf',), gen_psf_full, ref, sci.sp_ref)
         im_ref_sub = pad_or_cut_to_size(im_ref, sub_shape)
+        models['ref'] = im_ref
         # Noise per pixel
-        if not exclude_noise:
+        if exclude_noise:
+            models['ref_noise'] = None
+        else:
             det = ref.Detectors[0]
-            fzodi = ref.bg_zodi(zfact)
-            im_noise = det.pixel_noise(fsrc=im_ref, fzodi=fzodi)
-            # Add random noise
-            im_ref += np.random.normal(scale=im_noise)
+            fzodi = cache.get(('ref_zodi', zfact), ref.bg_zodi, zfact)
+            models['ref_noise'] = det.pixel_noise(fsrc=im_ref, fzodi=fzodi)
         
         # Stellar PSF is fixed
-        im_star = sci.gen_psf(sci.sp_sci, return_oversample=False)
-        im_star = pad_or_cut_to_size(im_star, image_shape)
-        
-        # Disk and Planet images
-        im_disk_r1 = sci.gen_disk_image(PA_offset=PA1)
-        im_pl_r1   = sci.gen_planets_image(PA_offset=PA1)
+        im_star = cache.get(('sci_psf',), gen_psf_full, sci, sci.sp_sci)
+
+        rolls = [(1, PA1)]
+        if abs(roll_angle) > eps: rolls.append((2, PA2))
+        for i, PA in rolls:
+            # Disk and Planet images
+            im_disk = cache.get(('disk', PA), sci.gen_disk_image, PA_offset=PA)
+            im_pl   = cache.get(('planets', PA), sci.gen_planets_image, PA_offset=PA)
+            im_roll = im_star + im_disk + im_pl
 
-        # Telescope Roll 1
-        im_roll1 = im_star + im_disk_r1 + im_pl_r1
-        # Noise per pixel
-        if not exclude_noise:
-            det = sci.Detectors[0]
-            fzodi = sci.bg_zodi(zfact)
-            im_noise1 = det.pixel_noise(fsrc=im_roll1, fzodi=fzodi)
-            # Add random noise
-            im_roll1 += np.random.normal(scale=im_noise1)
-            
-        if exclude_disk:
-            im_roll1 -= im_disk_r1
-        if exclude_planets:
-            im_roll1 -= im_pl_r1
-    
-        # Subtract reference star from Roll 1
-        #im_roll1_sub = pad_or_cut_to_size(im_roll1, sub_shape)
-        #scale1 = scale_ref_image(im_roll1_sub, im_ref_sub)
-        im_star_sub = pad_or_cut_to_size(im_star+im_pl_r1, sub_shape)
-        scale1 = scale_ref_image(im_star_sub, im_ref_sub)
-        _log.debug('scale1: {0:.3f}'.format(scale1))
-        #scale1 = im_roll1.max() / im_ref.max()
-        if oversample != 1:
-            im_ref_rebin = frebin(im_ref, scale=oversample)
-            im_roll1     = frebin(im_roll1, scale=oversample)
-        else:
-            im_ref_rebin = im_ref
-        
-        # Telescope Roll 2
-        if abs(roll_angle) > eps:
-            # Subtraction with and without scaling
-            im_diff1_r1 = im_roll1 - im_ref_rebin
-            im_diff2_r1 = im_roll1 - im_ref_rebin * scale1
-            #im_diff_r1 = optimal_difference(im_roll1, im_ref_rebin, scale1)
-
-            im_disk_r2 = sci.gen_disk_image(PA_offset=PA2)
-            im_pl_r2   = sci.gen_planets_image(PA_offset=PA2)
-            im_roll2   = im_star + im_disk_r2 + im_pl_r2
             # Noise per pixel
-            if not exclude_noise:
+            if exclude_noise:
+                models['noise{}'.format(i)] = None
+            else:
                 det = sci.Detectors[0]
-                fzodi = sci.bg_zodi(zfact)
-                im_noise2 = det.pixel_noise(fsrc=im_roll2, fzodi=fzodi)
-                # Add random noise
-                im_roll2 += np.random.normal(scale=im_noise2)
+                fzodi = cache.get(('sci_zodi', zfact), sci.bg_zodi, zfact)
+                models['noise{}'.format(i)] = det.pixel_noise(fsrc=im_roll, fzodi=fzodi)
 
             if exclude_disk:
-                im_roll2 -= im_disk_r2
+                im_roll = im_roll - im_disk
             if exclude_planets:
-                im_roll2 -= im_pl_r2
-
-            # Subtract reference star from Roll 2
-            #im_roll2_sub = pad_or_cut_to_size(im_roll2, sub_shape)
-            #scale2 = scale_ref_image(im_roll2_sub, im_ref_sub)
-            im_star_sub = pad_or_cut_to_size(im_star+im_pl_r2, sub_shape)
-            scale2 = scale_ref_image(im_star_sub, im_ref_sub)
-            _log.debug('scale2: {0:.3f}'.format(scale2))
-            #scale2 = im_roll2.max() / im_ref.max()
-            if oversample != 1:
-                im_roll2 = frebin(im_roll2, scale=oversample)
-            # Subtraction with and without scaling
-            im_diff1_r2 = im_roll2 - im_ref_rebin
-            im_diff2_r2 = im_roll2 - im_ref_rebin * scale2
-            #im_diff_r2 = optimal_difference(im_roll2, im_ref_rebin, scale2)
-
-            # De-rotate Roll 2 onto Roll 1
-            # Convention for rotate() is opposite PA_offset
-            im_diff1_r2_rot = rotate(im_diff1_r2, roll_angle, reshape=False, cval=np.nan)
-            im_diff2_r2_rot = rotate(im_diff2_r2, roll_angle, reshape=False, cval=np.nan)
-            final1 = (im_diff1_r1 + im_diff1_r2_rot) // 2
-            final2 = (im_diff2_r1 + im_diff2_r2_rot) // 2
-            
-            # Replace NaNs with values from im_diff_r1
-            nan_mask1 = np.isnan(final1)
-            nan_mask2 = np.isnan(final2)
-            final1[nan_mask1] = im_diff1_r1[nan_mask1]
-            final2[nan_mask2] = im_diff2_r1[nan_mask2]
-            
-            # final1 has better noise in outer regions (background)
-            # final2 has better noise in inner regions (PSF removal)
-            if opt_diff:
-                rho = dist_image(final1)
-                binsize = 1
-                bins = np.arange(rho.min(), rho.max() + binsize, binsize)
-                igroups = hist_indices(rho, bins)
-
-                std1 = binned_statistic(igroups, final1, func=np.std)
-                std2 = binned_statistic(igroups, final2, func=np.std)
-                
-                ibin_better = np.where(std1 < std2)[0]
-                for ibin in ibin_better:
-                    final2.ravel()[igroups[ibin]] = final1.ravel()[igroups[ibin]]
-                    
-            final = final2
+                im_roll = im_roll - im_pl
+            models['roll{}'.format(i)] = im_roll
 
-        else:
-            # Optimal differencing (with scaling only on the inner regions)
-            if opt_diff:
-                final = optimal_difference(im_roll1, im_ref_rebin, scale1)
-            else:
-                final = im_roll1 - im_ref_rebin * scale1
-            
-        # De-rotate PA1 to North
-        if abs(PA1) > eps:
-            final = rotate(final, PA1, reshape=False)
+            # Scale factor for reference star subtraction
+            im_star_sub = pad_or_cut_to_size(im_star+im_pl, sub_shape)
+            scale = scale_ref_image(im_star_sub, im_ref_sub)
+            _log.debug('scale{0}: {1:.3f}'.format(i, scale))
+            models['scale{}'.format(i)] = scale
+
+        return models
+
+    def gen_roll_image(self, PA1=0, PA2=10, zfact=None, oversample=None, 
+        exclude_disk=False, exclude_planets=False, exclude_noise=False, 
+        opt_diff=True):
+        """
+        Create a final roll-subtracted slope image based on current observation
+        settings. Coordinate convention is for +V3 up and +V2 to left.
+        
+        Procedure:
+          - Create Roll 1 and Roll 2 slope images (star+exoplanets)
+          - Create Reference Star slope image
+          - Add random Gaussian noise to all images
+          - Subtract ref image from both rolls
+          - De-rotate Roll 2 by roll_angle amplitude
+          - Average Roll 1 and de-rotated Roll 2
+          
+        Parameters
+        ==========
+        PA1 : Position angle of first roll position (clockwise, from East to West)
+        PA2 : Position angle of second roll position (optional)
+              If set equal to PA1 (or to None), then only one roll will be performed.
+              Otherwise, two rolls are performed, each using the specified 
+              MULTIACCUM settings (doubling the effective exposure time).
+        zfact      : Zodiacal background factor (default=2.5)
+        oversample : Set oversampling of final image.
+        
+        exclude_disk  : Ignore disk when subtracted image (for radial contrast),
+                        but still add Poisson noise from disk.
+        exclude_noise : Don't add random Gaussian noise (detector+photon)
+        
+        Noiseless components (PSFs, disk and planet images at each PA, and
+        background levels) are reused from self.scene_cache between calls,
+        so scanning roll angles or zfact only regenerates what changed.
+
+        The two rolls are averaged with true division (older versions used
+        floor division) and the reference scale factors are measured on 
+        the noiseless images, so final images differ from those of older
+        versions even for the same random seed.
+        
+        Returns an HDUList of final image (North rotated upwards).
+        """
+    
+        if oversample is None: oversample = 1
+
+        models = self._roll_models(PA1=PA1, PA2=PA2, zfact=zfact, 
+                                   exclude_disk=exclude_disk, 
+                                   exclude_planets=exclude_planets,
+                                   exclude_noise=exclude_noise)
+        final = _roll_subtract(models, 1, oversample=oversample, opt_diff=opt_diff)[0]
         
         hdu = fits.PrimaryHDU(final)
         hdu.header['EXTNAME'] = ('ROLL_SUB')
         hdu.header['OVERSAMP'] = oversample
-        hdu.header['PIXELSCL'] = sci.pix_scale / hdu.header['OVERSAMP']
+        hdu.header['PIXELSCL'] = self.pix_scale / hdu.header['OVERSAMP']
         hdulist = fits.HDUList([hdu])
 
         return hdulist
@@ -1764,51 +1870,137 @@ def model_to_hdulist(args_model, sp_star, filter, pupil=None, mask=None):
 ###                         xpix=xpix, ypix=ypix, **kwargs)
 
 
-def _wrap_convolve_for_mp(args):
+def _roll_subtract(models, nreal=1, rng=None, oversample=1, opt_diff=True):
     """
-    Internal helper routine for parallelizing computations across multiple processors.
+    Roll-subtracted images for nreal noise realizations at once.
 
-    Create a list of arguments to pass to this function:
-        worker_arguments = [(inst, image, rho, offset_list, i) for i,inst in enumerate(nrc_star_list)]
+    Parameters
+    ==========
+    models     : Dictionary from obs_coronagraphy._roll_models().
+    nreal      : Number of noise realizations.
+    rng        : Random number generator (np.random.Generator or RandomState).
+                 Default is the global numpy random state.
+    oversample : Oversampling of final images.
+    opt_diff   : Choose between scaled and unscaled reference subtraction
+                 at each radius, whichever has the lower noise.
+
+    Returns an array of final images [nreal, ny, nx] (North rotated upwards).
+    """
+    if rng is None: rng = np.random
 
-    Then create a theadpool:
-        pool = mp.Pool(nproc)
-        images = pool.map(_wrap_coeff_for_mp, worker_arguments)
-        pool.close()
-        images = np.array(images)
+    def add_noise(im, im_noise):
+        im = np.repeat(np.reshape(im, (1,)+np.shape(im)), nreal, axis=0)
+        if im_noise is not None:
+            im += rng.normal(scale=im_noise, size=im.shape)
+        if oversample != 1:
+            im = np.array([frebin(a, scale=oversample) for a in im])
+        return im
+
+    # Rotation of each image in the (y,x) plane
+    def rotate_all(im, angle, **kwargs):
+        return rotate(im, angle, axes=(2,1), reshape=False, **kwargs)
+
+    PA1 = models['PA1']
+    roll_angle = models['roll_angle']
+    scale1 = models['scale1']
+
+    im_ref = add_noise(models['ref'], models['ref_noise'])
+    im_roll1 = add_noise(models['roll1'], models['noise1'])
+
+    # Telescope Roll 2
+    if abs(roll_angle) > eps:
+        im_roll2 = add_noise(models['roll2'], models['noise2'])
+        scale2 = models['scale2']
+
+        # Subtraction with and without scaling
+        im_diff1_r1 = im_roll1 - im_ref
+        im_diff2_r1 = im_roll1 - im_ref * scale1
+        im_diff1_r2 = im_roll2 - im_ref
+        im_diff2_r2 = im_roll2 - im_ref * scale2
+
+        # De-rotate Roll 2 onto Roll 1
+        # Convention for rotate() is opposite PA_offset
+        im_diff1_r2_rot = rotate_all(im_diff1_r2, roll_angle, cval=np.nan)
+        im_diff2_r2_rot = rotate_all(im_diff2_r2, roll_angle, cval=np.nan)
+        final1 = (im_diff1_r1 + im_diff1_r2_rot) / 2
+        final2 = (im_diff2_r1 + im_diff2_r2_rot) / 2
+        
+        # Replace NaNs with values from im_diff_r1
+        final1 = np.where(np.isnan(final1), im_diff1_r1, final1)
+        final2 = np.where(np.isnan(final2), im_diff2_r1, final2)
+            
+        # final1 has better noise in outer regions (background)
+        # final2 has better noise in inner regions (PSF removal)
+        if opt_diff:
+            rho = dist_image(final1[0])
+            binsize = 1
+            bins = np.arange(rho.min(), rho.max() + binsize, binsize)
+            igroups = hist_indices(rho, bins)
+
+            std1 = binned_std(igroups, final1)
+            std2 = binned_std(igroups, final2)
+
+            # Pixels in bins where final1 is better
+            labels = bin_labels(igroups, rho.size).reshape(rho.shape)
+            better = np.concatenate((std1 < std2, np.zeros([nreal,1], dtype=bool)), axis=1)
+            final = np.where(better[:,labels], final1, final2)
+        else:
+            final = final2
+
+    else:
+        # Optimal differencing (with scaling only on the inner regions)
+        if opt_diff:
+            final = np.array([optimal_difference(r1, ref, scale1) 
+                              for r1, ref in zip(im_roll1, im_ref)])
+        else:
+            final = im_roll1 - im_ref * scale1
+            
+    # De-rotate PA1 to North
+    if abs(PA1) > eps:
+        final = rotate_all(final, PA1)
+
+    return final
 
-    For single processing, just use:
-        images = map(_wrap_convolve_for_mp, worker_arguments)
-        images = np.array(images)
 
-    For multiprocessing:
+def _radial_std(data, pixscale, oversample=1):
     """
+    Smoothed radial standard deviation of roll-subtracted image(s), 
+    excluding the corner regions.
 
-    psf, model, rho, offset_list, i = args
-
-    noff = len(offset_list)
-    if noff==1:
-        r1 = 0; r2 = rho.max()+1	
-    elif i==0:
-        r1 = offset_list[i]
-        r2 = (offset_list[i] + offset_list[i+1])/2
-    elif i==noff-1:
-        r1 = (offset_list[i] + offset_list[i-1])/2
-        r2 = rho.max()+1.
+    Returns radius (arcsec) and standard deviations ([nimage, nradius] 
+    if data is a cube of images).
+    """
+    from astropy.convolution import convolve, Gaussian1DKernel
+    
+    shape = np.shape(data)[-2:]
+    rho = dist_image(np.zeros(shape), pixscale=pixscale)
+
+    # Get radial profiles
+    binsize = oversample * pixscale
+    bins = np.arange(rho.min(), rho.max() + binsize, binsize)
+    igroups, _, rr = hist_indices(rho, bins, True)
+    stds = binned_std(igroups, data)
+    kernel = Gaussian1DKernel(1)
+    if stds.ndim == 1:
+        stds = convolve(stds, kernel)
     else:
-        r1 = (offset_list[i] + offset_list[i-1])/2
-        r2 = (offset_list[i] + offset_list[i+1])/2
+        stds = np.array([convolve(s, kernel) for s in stds])
+
+    # Ignore corner regions
+    arr_size = np.min(shape) * pixscale
+    mask = rr < (arr_size/2)
 
-    #r1 = offset_list[i]
-    #r2 = offset_list[i+1] if i<(noff-1) else rho.max()
+    return rr[mask], stds[...,mask]
 
 
-    ind = (rho>=r1) & (rho<r2)
-    im_temp = model.copy()
-    im_temp[~ind] = 0
+def _wrap_roll_mc_for_mp(args):
+    """
+    Internal helper routine for obs_coronagraphy.calc_contrast_mc().
+    Generates a batch of noise realizations from its own random stream
+    and returns their radial standard deviations.
+    """
+    models, nreal, seed_seq, oversample, opt_diff, pixscale = args
 
-    # Generate psf and convolve with temp image
-    #_, psf_over = nrc_object.gen_psf(return_oversample=True)
-    #offset_pix = -offset_list[i] / pixscale_over
-    #psf_over = fshift(psf_over, dely=offset_pix, pad=True)
-    return convolve_fft(im_temp, psf, fftn=fftpack.fftn, ifftn=fftpack.ifftn, allow_huge=True)
+    rng = np.random.default_rng(seed_seq)
+    final = _roll_subtract(models, nreal, rng=rng, oversample=oversample, opt_diff=opt_diff)
+    return _radial_std(final, pixscale, oversample)
@@ -0,0 +1,265 @@
+"""
+Content-addressed cache for PSF coefficients
+
+PSF coefficient cubes generated by psf_coeff() are expensive to create
+(dozens of monochromatic WebbPSF calculations), so they are stored both
+in memory and on disk. Entries are keyed by a SHA1 hash of every input
+that affects the result (bandpass throughput, pupil, mask, module, FoV,
+oversampling, npsf, ndeg, source offset, telescope pupil, and OPD data).
+
+The disk tier lives in PYNRC_PATH/psf_coeffs/ and is bounded by
+conf.psf_cache_disk_GB. When the budget is exceeded, the least recently
+used files are deleted. Files are written to a temporary file and then
+renamed, so concurrent workers never read a partially written cube.
+The memory tier is bounded by conf.psf_cache_mem_MB.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+import os, hashlib, tempfile
+
+from collections import OrderedDict
+from astropy.io import fits
+
+from . import conf
+
+import logging
+_log = logging.getLogger('pynrc')
+
+# os.replace is atomic on all platforms, but only exists in Python 3.
+# os.rename is atomic on POSIX systems.
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _update_hash(hsh, val):
+    """
+    Recursively feed an arbitrary value into a hashlib object.
+
+    Handles None, strings, numbers, numpy arrays, HDUs and HDULists,
+    and (nested) lists, tuples and dicts. Type names are included
+    so that, for instance, 1 and '1' produce different hashes.
+    """
+
+    if isinstance(val, fits.HDUList):
+        hsh.update(b'HDUList')
+        for hdu in val:
+            _update_hash(hsh, hdu)
+    elif isinstance(val, (fits.PrimaryHDU, fits.ImageHDU)):
+        # Header keywords (e.g., PIXELSCL) can change the optical calculation
+        hsh.update(b'HDU')
+        _update_hash(hsh, val.header.tostring())
+        _update_hash(hsh, val.data)
+    elif isinstance(val, np.ndarray):
+        arr = np.ascontiguousarray(val)
+        hsh.update('ndarray{}{}'.format(arr.dtype.str, arr.shape).encode('utf-8'))
+        hsh.update(arr.tobytes())
+    elif isinstance(val, (list, tuple)):
+        hsh.update('{}{}'.format(type(val).__name__, len(val)).encode('utf-8'))
+        for v in val:
+            _update_hash(hsh, v)
+    elif isinstance(val, dict):
+        hsh.update('dict{}'.format(len(val)).encode('utf-8'))
+        for k in sorted(val.keys()):
+            _update_hash(hsh, k)
+            _update_hash(hsh, val[k])
+    elif isinstance(val, (float, np.floating)):
+        # repr gives the shortest string that round-trips
+        hsh.update('float{!r}'.format(float(val)).encode('utf-8'))
+    else:
+        hsh.update('{}{}'.format(type(val).__name__, val).encode('utf-8'))
+
+
+def cache_key(*args, **kwargs):
+    """
+    Return a SHA1 hex digest for an arbitrary set of arguments.
+
+    Keyword order does not matter. See _update_hash() for the
+    supported value types.
+    """
+    hsh = hashlib.sha1()
+    _update_hash(hsh, args)
+    _update_hash(hsh, kwargs)
+    return hsh.hexdigest()
+
+
+class PSFCoeffCache(object):
+    """
+    Two-tier (memory + disk) LRU cache of numpy arrays.
+
+    Arrays handed out by the cache are flagged read-only, because the same
+    object is returned to every caller that requests that key.
+
+    Parameters
+    ==========
+    cache_dir : Directory for the disk tier. Default is PYNRC_PATH/psf_coeffs/.
+    disk_GB   : Size budget for the disk tier in GB. Default is conf.psf_cache_disk_GB.
+                Set to 0 or a negative number for an unlimited disk tier.
+    mem_MB    : Size budget for the memory tier in MB. Default is conf.psf_cache_mem_MB.
+                Set to 0 to disable the memory tier.
+    """
+
+    _prefix = 'psfcf_'
+    _suffix = '.npy'
+
+    def __init__(self, cache_dir=None, disk_GB=None, mem_MB=None):
+
+        if cache_dir is None:
+            cache_dir = conf.PYNRC_PATH + 'psf_coeffs/'
+        if disk_GB is None:
+            disk_GB = conf.psf_cache_disk_GB
+        if mem_MB is None:
+            mem_MB = conf.psf_cache_mem_MB
+
+        self.cache_dir = cache_dir
+        self.disk_bytes = int(disk_GB * 1024**3)
+        self.mem_bytes = int(mem_MB * 1024**2)
+
+        self._mem = OrderedDict()
+        self._mem_total = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, self._prefix + key + self._suffix)
+
+    def _mem_put(self, key, arr):
+        if arr.nbytes > self.mem_bytes:
+            return
+        if key in self._mem:
+            self._mem_total -= self._mem.pop(key).nbytes
+        self._mem[key] = arr
+        self._mem_total += arr.nbytes
+        # Drop least recently used entries
+        while self._mem_total > self.mem_bytes:
+            _, old = self._mem.popitem(last=False)
+            self._mem_total -= old.nbytes
+
+    def get(self, key, disk=True):
+        """
+        Return the cached array for key, or None if it does not exist.
+        Set disk=False to only search the memory tier.
+        """
+        # Memory tier
+        arr = self._mem.get(key)
+        if arr is not None:
+            # Move to most recently used position
+            self._mem[key] = self._mem.pop(key)
+            return arr
+
+        if not disk:
+            return None
+
+        # Disk tier
+        path = self._path(key)
+        try:
+            arr = np.load(path)
+        except (IOError, OSError, ValueError):
+            # Missing, evicted by another process, or corrupted
+            return None
+
+        # Bump modification time for LRU bookkeeping.
+        # (Access times are unreliable on noatime mounts.)
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        arr.flags.writeable = False
+        self._mem_put(key, arr)
+        return arr
+
+    def put(self, key, arr, disk=True):
+        """
+        Store array in the cache and return the (read-only) cached version.
+        Set disk=False to only store in the memory tier.
+        """
+        arr = np.array(arr)
+        arr.flags.writeable = False
+        self._mem_put(key, arr)
+
+        if disk:
+            if not os.path.isdir(self.cache_dir):
+                try:
+                    os.makedirs(self.cache_dir)
+                except OSError:
+                    # Another process may have just created it
+                    if not os.path.isdir(self.cache_dir): raise
+
+            # Atomic write: save to temporary file in the same directory, then rename
+            fd, tmp_name = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, arr)
+                # mkstemp creates owner-only files; cache may be shared
+                os.chmod(tmp_name, 0o644)
+                _replace(tmp_name, self._path(key))
+            except Exception:
+                if os.path.exists(tmp_name): os.remove(tmp_name)
+                raise
+
+            self.evict()
+
+        return arr
+
+    def disk_usage(self):
+        """
+        Return a list of (mtime, nbytes, path) for every file in the
+        disk tier, sorted from least to most recently used.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+
+        out = []
+        for fname in os.listdir(self.cache_dir):
+            if not (fname.startswith(self._prefix) and fname.endswith(self._suffix)):
+                continue
+            path = os.path.join(self.cache_dir, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((st.st_mtime, st.st_size, path))
+        out.sort()
+        return out
+
+    def evict(self, disk_bytes=None):
+        """
+        Delete least recently used disk entries until the total size
+        is below disk_bytes (default self.disk_bytes).
+        """
+        if disk_bytes is None:
+            disk_bytes = self.disk_bytes
+        if disk_bytes <= 0:
+            return
+
+        files = self.disk_usage()
+        total = sum(f[1] for f in files)
+        for mtime, nbytes, path in files:
+            if total <= disk_bytes:
+                break
+            try:
+                os.remove(path)
+                _log.debug('Evicted {} from PSF cache'.format(os.path.basename(path)))
+            except OSError:
+                # Already removed by another process
+                pass
+            total -= nbytes
+
+    def clear(self, disk=True):
+        """Empty the memory tier and (optionally) the disk tier."""
+        self._mem.clear()
+        self._mem_total = 0
+        if disk:
+            for _, _, path in self.disk_usage():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+_psf_cache = None
+def get_psf_cache():
+    """Return the process-wide PSF coefficient cache."""
+    global _psf_cache
+    if _psf_cache is None:
+        _psf_cache = PSFCoeffCache()
+    return _psf_cache
@@ -0,0 +1,327 @@
+"""
+Library of field-dependent PSF coefficients
+
+Coronagraphic PSFs depend on the source position relative to the mask.
+Rather than creating a NIRCam instance (and PSF coefficients) for every
+offset position of a scene, PSFLibrary precomputes the coefficient cubes
+on a grid of (radius, theta) offsets for a single (bandpass, pupil, mask,
+module, fov_pix, oversample, OPD) configuration.
+
+Each cube is shifted so that the PSF is centered in the FoV, which allows
+PSFs at arbitrary offsets to be linearly interpolated between grid nodes.
+The peak pixel value of each node PSF is measured before shifting (see
+PSFLibrary.psf_max). All cubes are saved to a single .npy file in 
+PYNRC_PATH/psf_library/ and memory-mapped when loaded, so processes working on the same configuration
+share one copy through the OS page cache. The coefficients are kept in
+float64, since the wavelength polynomials are not well conditioned in
+single precision.
+
+Example
+==========
+lib = get_psf_library(bp, 'CIRCLYOT', 'MASK430R', 'A', fov_pix=128,
+                      oversample=2, radii=[0, 0.1, 0.2, 0.5, 1.0, 2.0])
+psf = lib.gen_psf(sp, offset_r=0.35)    # Centered PSF at 0.35"
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+import os, tempfile
+
+from . import conf
+from .psf_cache import cache_key, _replace
+from .nrc_utils import psf_coeff, psf_offset_used, gen_image_coeff, channel_select
+from .nrc_utils import spec_coeff_weights
+from .maths.image_manip import fshift
+from .maths.coords import rtheta_to_xy
+
+import logging
+_log = logging.getLogger('pynrc')
+
+
+class PSFLibrary(object):
+    """
+    PSF coefficient cubes on a grid of source offsets.
+
+    Parameters
+    ==========
+    bp         : Pysynphot bandpass (see read_filter).
+    pupil      : NIRCam pupil element.
+    mask       : Coronagraphic occulter.
+    module     : 'A' or 'B'
+    fov_pix    : Size of the FoV in detector pixels.
+    oversample : Oversampling of the coefficient cubes.
+    radii      : Grid of radial offsets (arcsec).
+    thetas     : Grid of position angles (deg CCW from +Y). Only used for
+                 the bar masks; round masks are symmetric.
+    lib_dir    : Directory for library files. Default is PYNRC_PATH/psf_library/.
+
+    **kwargs
+    ==========
+    Passed to psf_coeff(): npsf, ndeg, opd, tel_pupil, etc.
+    """
+
+    def __init__(self, bp, pupil=None, mask=None, module='A', fov_pix=11, oversample=2,
+                 radii=[0], thetas=[0], lib_dir=None, **kwargs):
+
+        if lib_dir is None:
+            lib_dir = conf.PYNRC_PATH + 'psf_library/'
+
+        self.bandpass = bp
+        self.pupil = pupil
+        self.mask = mask
+        self.module = module
+        self.fov_pix = fov_pix
+        self.oversample = oversample
+        self.kwargs = kwargs
+
+        # Only grid points that psf_coeff actually distinguishes
+        self.radii = np.unique(np.asarray(radii, dtype=float))
+        thetas = [psf_offset_used(mask, 1, t)[1] for t in thetas]
+        self.thetas = np.unique(np.asarray(thetas, dtype=float))
+        if np.all(np.array(psf_offset_used(mask, 1, 0)) == 0):
+            # PSF doesn't depend on position
+            self.radii = np.array([0.])
+
+        self.pix_scale = channel_select(bp)[0]
+
+        key = cache_key('psf_library', bp.name, bp.wave, bp.throughput, pupil, mask,
+                        module, fov_pix, oversample, self.radii, self.thetas, kwargs)
+        self.file_path = os.path.join(lib_dir, 'psflib_' + key + '.npy')
+        self.peak_path = os.path.join(lib_dir, 'psflib_' + key + '_peak.npy')
+
+        self._coeffs = None
+        self._peaks = None
+
+    @property
+    def coeffs(self):
+        """Memory-mapped cube of shape [nradii, nthetas, ncoeff, ny, nx]."""
+        if self._coeffs is None:
+            self._load()
+        return self._coeffs
+
+    @property
+    def peaks(self):
+        """Peak values of the unshifted node PSFs [nradii, nthetas]."""
+        if self._peaks is None:
+            self._load()
+        return self._peaks
+
+    def _load(self):
+        try:
+            self._peaks = np.load(self.peak_path)
+            self._coeffs = np.load(self.file_path, mmap_mode='r')
+            return
+        except (IOError, OSError, ValueError):
+            pass
+        self.build()
+        self._peaks = np.load(self.peak_path)
+        self._coeffs = np.load(self.file_path, mmap_mode='r')
+
+    def build(self):
+        """Generate all coefficient cubes and save them to disk."""
+
+        _log.info('Building PSF library ({} radii x {} thetas)'
+                  .format(len(self.radii), len(self.thetas)))
+
+        pixscale_over = self.pix_scale / self.oversample
+        out = None
+        peaks = np.zeros((len(self.radii), len(self.thetas)))
+        for i, r in enumerate(self.radii):
+            for j, t in enumerate(self.thetas):
+                cf = psf_coeff(self.bandpass, self.pupil, self.mask, self.module,
+                               fov_pix=self.fov_pix, oversample=self.oversample,
+                               offset_r=r, offset_theta=t, **self.kwargs)
+                if out is None:
+                    out = np.zeros((len(self.radii), len(self.thetas)) + cf.shape)
+
+                # Peak of the detector-sampled PSF at its true position
+                psf = gen_image_coeff(self.bandpass, pupil=self.pupil, mask=self.mask,
+                                      module=self.module, coeff=cf, fov_pix=self.fov_pix,
+                                      oversample=self.oversample)
+                peaks[i,j] = psf.max()
+
+                # Shift PSF to center of FoV
+                rtemp, ttemp = psf_offset_used(self.mask, r, t)
+                xoff, yoff = rtheta_to_xy(rtemp / pixscale_over, ttemp)
+                if (xoff != 0) or (yoff != 0):
+                    cf = np.array([fshift(im, delx=-xoff, dely=-yoff, pad=True) for im in cf])
+                out[i,j] = cf
+
+        lib_dir = os.path.dirname(self.file_path)
+        if not os.path.isdir(lib_dir):
+            try:
+                os.makedirs(lib_dir)
+            except OSError:
+                # Another process may have just created it
+                if not os.path.isdir(lib_dir): raise
+
+        # Peaks first, since a complete coefficient file marks a finished build
+        self._save(peaks, self.peak_path)
+        self._save(out, self.file_path)
+
+    @staticmethod
+    def _save(arr, file_path):
+        """Atomic write so that other processes never map a partial file."""
+        fd, tmp_name = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(file_path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, arr)
+            os.chmod(tmp_name, 0o644)
+            _replace(tmp_name, file_path)
+        except Exception:
+            if os.path.exists(tmp_name): os.remove(tmp_name)
+            raise
+
+    @staticmethod
+    def _weights(grid, val, periodic=False):
+        """Indices and linear interpolation weights of val within grid."""
+        n = len(grid)
+        if n == 1:
+            return [0], [1.0]
+        if periodic:
+            val = grid[0] + (val - grid[0]) % 360
+            if val > grid[-1]:
+                # Wrap between last and first grid points
+                dx = grid[0] + 360 - grid[-1]
+                w = (val - grid[-1]) / dx
+                return [n-1, 0], [1-w, w]
+        val = np.clip(val, grid[0], grid[-1])
+        i = int(np.clip(np.searchsorted(grid, val) - 1, 0, n-2))
+        w = (val - grid[i]) / (grid[i+1] - grid[i])
+        return [i, i+1], [1-w, w]
+
+    def coeff(self, offset_r=0, offset_theta=0):
+        """
+        Coefficient cube of the centered PSF at an arbitrary offset,
+        linearly interpolated between grid nodes (clipped to the grid).
+        """
+        rtemp, ttemp = psf_offset_used(self.mask, offset_r, offset_theta)
+        ir, wr = self._weights(self.radii, rtemp)
+        it, wt = self._weights(self.thetas, ttemp, periodic=True)
+
+        coeffs = self.coeffs
+        res = 0
+        for i, w1 in zip(ir, wr):
+            for j, w2 in zip(it, wt):
+                if w1*w2 == 0: continue
+                res = res + (w1*w2) * coeffs[i,j]
+        return res
+
+    def psf_max(self, offset_r=0, offset_theta=0):
+        """
+        Peak pixel value of the detector-sampled PSF (sp=None) at an offset,
+        measured at its true position rather than after centering, and 
+        linearly interpolated between grid nodes.
+        """
+        rtemp, ttemp = psf_offset_used(self.mask, offset_r, offset_theta)
+        ir, wr = self._weights(self.radii, rtemp)
+        it, wt = self._weights(self.thetas, ttemp, periodic=True)
+
+        peaks = self.peaks
+        res = 0
+        for i, w1 in zip(ir, wr):
+            for j, w2 in zip(it, wt):
+                res = res + (w1*w2) * peaks[i,j]
+        return res
+
+    def gen_psf(self, sp=None, offset_r=0, offset_theta=0, return_oversample=False, **kwargs):
+        """
+        Centered PSF image (counts/sec) for a source at an offset position.
+        See NIRCam.gen_psf() for details on sp and return_oversample.
+        """
+        return gen_image_coeff(self.bandpass, sp_norm=sp, pupil=self.pupil,
+            mask=self.mask, module=self.module, coeff=self.coeff(offset_r, offset_theta),
+            fov_pix=self.fov_pix, oversample=self.oversample,
+            return_oversample=return_oversample, **kwargs)
+
+    def gen_psfs(self, sp_list, offset_r, offset_theta=0, fov_pix=None, chunk_MB=256):
+        """
+        Centered, detector-sampled PSFs for many sources at once.
+
+        All spectra are binned in a single call, and the PSFs are created with
+        one matrix product of the (spectral x offset) weights and the stacked
+        coefficient cubes of the grid nodes, rather than one gen_image_coeff()
+        call per source. This gives the same result as 
+
+            [self.gen_psf(sp, r, th) for sp, r, th in zip(sp_list, offset_r, offset_theta)]
+
+        Parameters
+        ==========
+        sp_list      : List of normalized spectra (one per source).
+        offset_r     : Radial offset(s) of each source (arcsec).
+        offset_theta : Position angle(s) of each source (deg CCW from +Y).
+        fov_pix      : Postage stamp size in detector pixels (centered cutout
+                       of the library FoV). Default is the full FoV.
+        chunk_MB     : Approximate memory limit for oversampled images in each pass.
+
+        Returns
+        ==========
+        Array of PSF images [nsource, fov_pix, fov_pix].
+        """
+        if not isinstance(sp_list, list): sp_list = [sp_list]
+        nsrc = len(sp_list)
+        offset_r = np.broadcast_to(np.asarray(offset_r, dtype=float), nsrc)
+        offset_theta = np.broadcast_to(np.asarray(offset_theta, dtype=float), nsrc)
+
+        coeffs = self.coeffs
+        nr, nth, ncf, ny_over, nx_over = coeffs.shape
+        osamp = self.oversample
+
+        # Centered cutout along both oversampled axes
+        if (fov_pix is None) or (fov_pix >= self.fov_pix):
+            fov_pix = self.fov_pix
+        i0 = ((self.fov_pix - fov_pix) // 2) * osamp
+        npix_over = fov_pix * osamp
+        sl = slice(i0, i0 + npix_over)
+
+        # Spectral weights [nsrc, ncf]
+        wts = spec_coeff_weights(self.bandpass, sp_list, ncoeff=ncf, npix=nx_over)
+
+        # Weights of each grid node for each source [nsrc, nr*nth]
+        wnode = np.zeros((nsrc, nr, nth))
+        for k in range(nsrc):
+            rtemp, ttemp = psf_offset_used(self.mask, offset_r[k], offset_theta[k])
+            ir, wr = self._weights(self.radii, rtemp)
+            it, wt = self._weights(self.thetas, ttemp, periodic=True)
+            for i, w1 in zip(ir, wr):
+                for j, w2 in zip(it, wt):
+                    wnode[k,i,j] += w1*w2
+        wnode = wnode.reshape((nsrc, -1))
+
+        # Only load the nodes that are actually used
+        inode = np.where(wnode.any(axis=0))[0]
+        cf_all = coeffs.reshape((nr*nth, ncf, ny_over, nx_over))
+        cf_used = np.array([cf_all[n][:, sl, sl] for n in inode])
+        cf_used = cf_used.reshape((len(inode)*ncf, -1))
+
+        # Combined weights [nsrc, nnode*ncf]
+        wts_all = (wnode[:,inode].reshape((nsrc,-1,1)) * wts.reshape((nsrc,1,-1)))
+        wts_all = wts_all.reshape((nsrc,-1))
+
+        eps = np.finfo(float).eps
+        nchunk = max(int(chunk_MB * 2**20 / (8*cf_used.shape[1])), 1)
+        out = np.zeros((nsrc, fov_pix, fov_pix))
+        for i1 in range(0, nsrc, nchunk):
+            i2 = min(i1+nchunk, nsrc)
+            data_over = np.dot(wts_all[i1:i2], cf_used)
+            data_over[data_over<eps] = 0
+            # Sum oversampled pixels into detector pixels
+            data_over = data_over.reshape((i2-i1, fov_pix, osamp, fov_pix, osamp))
+            out[i1:i2] = data_over.sum(axis=(2,4))
+
+        return out
+
+
+# Libraries already opened by this process
+_psf_libraries = {}
+def get_psf_library(bp, pupil=None, mask=None, module='A', fov_pix=11, oversample=2,
+                    radii=[0], thetas=[0], **kwargs):
+    """
+    Return the PSF library for a configuration, building it if necessary.
+    See PSFLibrary for a description of the parameters.
+    """
+    lib = PSFLibrary(bp, pupil, mask, module, fov_pix, oversample, radii, thetas, **kwargs)
+    if lib.file_path not in _psf_libraries:
+        _psf_libraries[lib.file_path] = lib
+    return _psf_libraries[lib.file_path]
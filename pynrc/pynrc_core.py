@@ -63,16 +63,18 @@ class multiaccum(object):
       DEEP8     8  12
     """
 
+
+    # Pre-defined patterns: (nf, nd2, ngroup_max)
+    # Max ngroup currently ignored, because not valid for TSO
+    _pattern_settings = {'RAPID':(1,0,10), 'BRIGHT1':(1,1,10), 'BRIGHT2':(2,0,10), 
+                         'SHALLOW2':(2,3,10), 'SHALLOW4':(4,1,10), 'MEDIUM2':(2,8,10), 
+                         'MEDIUM8':(8,2,10), 'DEEP2':(2,18,20), 'DEEP8':(8,12,20)}
+
     def __init__(self, read_mode='RAPID', nint=1, ngroup=1, nf=1, nd1=0, nd2=0, nd3=0, 
                  **kwargs):
 
-
-        # Pre-defined patterns
-        patterns = ['RAPID', 'BRIGHT1', 'BRIGHT2', 'SHALLOW2', 'SHALLOW4', 'MEDIUM2', 'MEDIUM8', 'DEEP2', 'DEEP8']
-        nf_arr   = [1,1,2,2,4,2,8, 2, 8]
-        nd2_arr  = [0,1,0,3,1,8,2,18,12]
-        ng_max   = [10,10,10,10,10,10,10,20,20]  # Currently ignored, because not valid for TSO
-        self._pattern_settings = dict(zip(patterns, zip(nf_arr, nd2_arr, ng_max)))
+        # Incremented whenever a ramp setting changes (see DetectorOps.timing)
+        self._version = 0
 
         #self.nexp = nexp # Don't need multiple exposures. Just increase nint
         self.nint = nint
@@ -87,6 +89,13 @@ class multiaccum(object):
         # Now set read mode to specified mode, which may modify nf, nd1, nd2, and nd3
         self.read_mode = read_mode
 
+    # Attributes that set the ramp timing
+    _timing_attrs = ('_nint', '_ngroup', '_nf', '_nd1', '_nd2', '_nd3', '_read_mode')
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._timing_attrs:
+            object.__setattr__(self, '_version', self._version + 1)
+
 #     @property
 #     def nexp(self):
 #         """Number of exposures in an obervation."""
@@ -227,6 +236,200 @@ class multiaccum(object):
             raise ValueError("Value {} must be an integer >={}.".format(val,minval))
 
     
+# Memo table of RampTiming instances
+_ramp_timing_cache = OrderedDict()
+_ramp_timing_ncache = 4096
+
+class RampTiming(object):
+    """
+    Lightweight, immutable timing model for a detector readout and MULTIACCUM
+    ramp. All times are computed once when the instance is created, and
+    instances are memoized, so calling RampTiming() again with the same
+    settings returns the existing object. This avoids the overhead of
+    creating DetectorOps instances when only the ramp times are needed.
+
+    Parameters
+    ----------------
+    detector (int or str) : NIRCam detector/SCA ID (only used as a label).
+    wind_mode (str)       : Window mode type 'FULL', 'STRIPE', 'WINDOW'.
+    xpix, ypix (int)      : Size of window in pixels for frame time calculation.
+    read_mode (string)    : NIRCam Ramp Readout mode such as 'RAPID', 'BRIGHT1', etc.
+    ngroup, nint (int)    : Number of groups per integration and number of integrations.
+    nf, nd1, nd2, nd3 (int) : Only used if read_mode='CUSTOM'.
+
+    Example
+    ----------------
+        t = RampTiming(485, 'FULL', 2048, 2048, 'MEDIUM8', ngroup=10, nint=5)
+        t.time_total
+
+        # Vectorized times for many ngroup and nint values
+        ng = np.arange(2,11)
+        times = t.times(ng, 1)
+        times['t_acq']
+    """
+
+    __slots__ = ('detector', 'wind_mode', 'xpix', 'ypix', 'read_mode',
+                 'ngroup', 'nint', 'nf', 'nd1', 'nd2', 'nd3',
+                 'extra_lines', 'frame_overhead_pix', 'exp_delay',
+                 'time_row_reset', 'time_frame', 'time_group', 'time_int',
+                 'time_exp', 'time_total_int', 'time_total')
+
+    # Pixel Rate in Hz
+    _pixel_rate = 1e5
+    # Number of extra clock ticks per line
+    _line_overhead = 12
+
+    def __new__(cls, detector=481, wind_mode='FULL', xpix=2048, ypix=2048,
+                read_mode='RAPID', ngroup=1, nint=1, nf=1, nd1=0, nd2=0, nd3=0):
+
+        wind_mode = wind_mode.upper()
+        read_mode = 'CUSTOM' if read_mode is None else read_mode.upper()
+        if read_mode != 'CUSTOM':
+            check_list(read_mode, list(multiaccum._pattern_settings.keys()), var_name='read_mode')
+            nf, nd2, _ = multiaccum._pattern_settings.get(read_mode)
+            nd1 = nd3 = 0
+
+        key = (detector, wind_mode, int(xpix), int(ypix), read_mode,
+               int(ngroup), int(nint), int(nf), int(nd1), int(nd2), int(nd3))
+        try:
+            self = _ramp_timing_cache.pop(key)
+            _ramp_timing_cache[key] = self
+            return self
+        except KeyError:
+            pass
+
+        self = object.__new__(cls)
+        for k, v in zip(cls.__slots__, key):
+            object.__setattr__(self, k, v)
+        self._calc_times()
+
+        _ramp_timing_cache[key] = self
+        while len(_ramp_timing_cache) > _ramp_timing_ncache:
+            _ramp_timing_cache.popitem(last=False)
+
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RampTiming instances are immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError("RampTiming instances are immutable.")
+
+    def __reduce__(self):
+        # Rebuild through the memo table when unpickled
+        return (self.__class__, self._key)
+
+    def __repr__(self):
+        return "RampTiming({})".format(', '.join(repr(v) for v in self._key))
+
+    @property
+    def _key(self):
+        return tuple(getattr(self, k) for k in self.__slots__[0:11])
+
+    def _calc_times(self):
+        """Compute all ramp times. Only called once per instance."""
+
+        xpix = self.xpix; ypix = self.ypix
+        nout = 1 if self.wind_mode == 'WINDOW' else 4
+        chsize = xpix / nout                  # Number of x-pixels within a channel
+        xticks = chsize + self._line_overhead # Clock ticks per line
+
+        # Extra lines/rows added to a given frame
+        if nout == 1:
+            extra_lines = 2 if xpix>10 else 3
+        else:
+            extra_lines = 1
+
+        # Full and Stripe mode frames have an additional pixel at the end.
+        pix_offset = 0 if nout==1 else 1
+
+        # Additional overhead time at the end of an exposure due to transition to idle.
+        if nout == 1:
+            if   xpix>150: xtra_lines = 0
+            elif xpix>64:  xtra_lines = 1
+            elif xpix>16:  xtra_lines = 2
+            elif xpix>8:   xtra_lines = 4
+            else:          xtra_lines = 5
+        else:
+            xtra_lines = 1
+        exp_delay = xticks * xtra_lines / self._pixel_rate
+
+        # NFF Row Resets time
+        if nout == 1:
+            if   ypix>256: nff = 2048
+            elif ypix>64:  nff = 512
+            elif ypix>16:  nff = 256
+            elif ypix>8:   nff = 64
+            else:          nff = 16
+        else:
+            if   ypix==2048: nff = 0
+            elif ypix>=256:  nff = 2048
+            else:            nff = 512
+        time_row_reset = xticks * int(nff / chsize) / self._pixel_rate
+
+        # Frame time: total number of clock ticks per frame (reset, read, and drops)
+        # end_delay used for syncing each frame w/ FPE bg activity. Not currently used.
+        end_delay = 0
+        flines = ypix + extra_lines
+        fticks = xticks*flines + pix_offset + end_delay
+        time_frame = fticks / self._pixel_rate
+
+        setattr_ = object.__setattr__
+        setattr_(self, 'extra_lines', extra_lines)
+        setattr_(self, 'frame_overhead_pix', pix_offset)
+        setattr_(self, 'exp_delay', exp_delay)
+        setattr_(self, 'time_row_reset', time_row_reset)
+        setattr_(self, 'time_frame', time_frame)
+
+        times = self.times()
+        setattr_(self, 'time_group', times['t_group'])
+        setattr_(self, 'time_int', times['t_int'])
+        setattr_(self, 'time_exp', times['t_exp'])
+        setattr_(self, 'time_total_int', times['t_int_tot'])
+        setattr_(self, 'time_total', times['t_acq'])
+
+    def times(self, ngroup=None, nint=None):
+        """
+        Ramp times for arbitrary values of ngroup and nint (default to the
+        instance settings). Inputs can be scalars or arrays, which follow
+        normal numpy broadcasting rules. Returns a dictionary with the same
+        keys as DetectorOps.times_to_dict().
+        """
+        ngroup = self.ngroup if ngroup is None else np.asarray(ngroup)
+        nint   = self.nint   if nint   is None else np.asarray(nint)
+
+        nf = self.nf; nd1 = self.nd1; nd2 = self.nd2; nd3 = self.nd3
+        tf = self.time_frame
+        nr = 1
+
+        # Photon collection time for a single ramp.
+        # Exclude nd3 (drops that add nothing)
+        t_int = (nd1 + ngroup*nf + (ngroup-1)*nd2) * tf
+        # Total time for all frames in a ramp, including resets and excess drops
+        nframes = nr + nd1 + ngroup*nf + (ngroup-1)*nd2 + nd3
+        t_int_tot = nframes * tf + self.time_row_reset
+
+        t_exp = nint * t_int
+        t_acq = nint * t_int_tot + self.exp_delay
+
+        t_frame = tf
+        t_group = tf * (nf + nd2)
+        if np.ndim(t_exp) > 0 or np.ndim(t_acq) > 0:
+            shape = np.broadcast(t_exp, t_acq).shape
+            t_frame, t_group, t_int, t_int_tot = \
+                [np.broadcast_to(v, shape) for v in (t_frame, t_group, t_int, t_int_tot)]
+
+        return {'t_frame':t_frame, 't_group':t_group, 't_int':t_int,
+                't_exp':t_exp, 't_acq':t_acq, 't_int_tot':t_int_tot}
+
+    def to_dict(self, verbose=False):
+        """Export ramp times as dictionary with option to print output to terminal."""
+        times = [('t_frame',self.time_frame), ('t_group',self.time_group), \
+                 ('t_int',self.time_int), ('t_exp',self.time_exp), \
+                 ('t_acq',self.time_total), ('t_int_tot',self.time_total_int)]
+        return tuples_to_dict(times, verbose)
+
+
 class DetectorOps(object):
     """ 
     Class to hold detector operations information. Includes SCA attributes such as
@@ -293,9 +496,9 @@ class DetectorOps(object):
         self._validate_pixel_settings()
 
         # Pixel Rate in Hz
-        self._pixel_rate = 1e5
+        self._pixel_rate = RampTiming._pixel_rate
         # Number of extra clock ticks per line
-        self._line_overhead = 12
+        self._line_overhead = RampTiming._line_overhead
 
         _log.info('Initializing SCA {}/{}'.format(self.scaid,self.detid))
         self.multiaccum = multiaccum(**kwargs)
@@ -443,15 +646,30 @@ class DetectorOps(object):
         self.xpix = xpix; self.x0 = x0
         self.ypix = ypix; self.y0 = y0
 
+    # Attributes that set the ramp timing; changing any of them clears self._timing
+    _timing_attrs = ('_scaid', 'wind_mode', 'xpix', 'ypix', 'multiaccum')
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._timing_attrs:
+            object.__setattr__(self, '_timing', None)
+
+    @property
+    def timing(self):
+        """Cached RampTiming instance for the current detector and ramp settings."""
+        ma = self.multiaccum
+        timing = self.__dict__.get('_timing')
+        # Ramp settings are modified in place through the multiaccum setters
+        if (timing is None) or (self._timing_version != ma._version):
+            timing = RampTiming(self.scaid, self.wind_mode, self.xpix, self.ypix, 
+                ma.read_mode, ma.ngroup, ma.nint, ma.nf, ma.nd1, ma.nd2, ma.nd3)
+            object.__setattr__(self, '_timing', timing)
+            object.__setattr__(self, '_timing_version', ma._version)
+        return timing
+
     @property
     def _extra_lines(self):
         """Determine how many extra lines/rows are added to a to a given frame"""
-        if self.nout == 1:
-            xtra_lines = 2 if self.xpix>10 else 3
-        elif self.nout == 4:
-            xtra_lines = 1
-            
-        return xtra_lines
+        return self.timing.extra_lines
         
     @property
     def _exp_delay(self):
@@ -460,102 +678,44 @@ class DetectorOps(object):
         This does not add any more photon flux to a pixel.
         Due to transition to idle.
         """
-
-        # Window Mode        
-        if self.nout == 1:
-            if   self.xpix>150: xtra_lines = 0
-            elif self.xpix>64:  xtra_lines = 1
-            elif self.xpix>16:  xtra_lines = 2
-            elif self.xpix>8:   xtra_lines = 4
-            else:               xtra_lines = 5
-        # Full and Stripe
-        else: xtra_lines = 1
-        
-        # Clock ticks per line
-        xticks = self.chsize + self._line_overhead  
-        return xticks * xtra_lines / self._pixel_rate
-
+        return self.timing.exp_delay
 
     @property
     def _frame_overhead_pix(self):
         """
         Full and Stripe mode frames have an additional pixel at the end.
         """
-        
-        pix_offset = 0 if self.nout==1 else 1
-        return pix_offset
+        return self.timing.frame_overhead_pix
         
     @property
     def time_row_reset(self):
         """NFF Row Resets time"""
-        
-        # Window Mode        
-        if self.nout == 1:
-            if   self.ypix>256: nff = 2048
-            elif self.ypix>64:  nff = 512
-            elif self.ypix>16:  nff = 256
-            elif self.ypix>8:   nff = 64
-            else:               nff = 16
-        # Full and Stripe
-        else: 
-            if   self.ypix==2048: nff = 0
-            elif self.ypix>=256:  nff = 2048
-            else:                 nff = 512
-            
-        xtra_lines = int(nff / (self.chsize))
-        
-        # Clock ticks per line
-        xticks = self.chsize + self._line_overhead  
-        return xticks * xtra_lines / self._pixel_rate
+        return self.timing.time_row_reset
         
     @property
     def time_frame(self):
         """Determine frame times based on xpix, ypix, and wind_mode."""
-
-        chsize = self.chsize                        # Number of x-pixels within a channel
-        xticks = self.chsize + self._line_overhead  # Clock ticks per line
-        flines = self.ypix + self._extra_lines      # Lines per frame
-
-        # Add a single pix offset for full frame and stripe.
-        pix_offset = self._frame_overhead_pix
-        end_delay = 0 # Used for syncing each frame w/ FPE bg activity. Not currently used.
-
-        # Total number of clock ticks per frame (reset, read, and drops)
-        fticks = xticks*flines + pix_offset + end_delay
-
-        # Return frame time
-        return fticks / self._pixel_rate
+        return self.timing.time_frame
 
     @property
     def time_group(self):
         """Time per group based on time_frame, nf, and nd2."""
-        return self.time_frame * (self.multiaccum.nf + self.multiaccum.nd2)
+        return self.timing.time_group
 
     @property
     def time_ramp(self):
         """Photon collection time for a single ramp."""
-
-        # How many total frames (incl. dropped and all) per ramp?
-        # Exclude nd3 (drops that add nothing)
-        ma = self.multiaccum
-        nf = ma.nf; nd1 = ma.nd1; nd2 = ma.nd2
-        ngroup = ma.ngroup
-
-        tint = (nd1 + ngroup*nf + (ngroup-1)*nd2) * self.time_frame
-        #if tint > 1200:
-        #    _log.warning('Ramp time of %.2f is long. Is this intentional?' % tint)
-
-        return tint
+        return self.timing.time_int
 
     @property
     def time_int(self):
         """Same as time_ramp, except that time_int follows the JWST nomenclature"""
-        return self.time_ramp
+        return self.timing.time_int
 
     @property
     def time_exp(self):
         """Total photon collection time for all ramps."""
-        return self.multiaccum.nint * self.time_ramp
+        return self.timing.time_exp
 
     @property
     def time_total_int(self):
@@ -563,19 +723,12 @@ class DetectorOps(object):
         Total time for all frames in a ramp.
         Includes resets and excess drops, as well as NFF Rows Reset.
         """
-
-        ma = self.multiaccum
-        nf = ma.nf; nd1 = ma.nd1; nd2 = ma.nd2; nd3 = ma.nd3
-        ngroup = ma.ngroup
-        nr = 1
-
-        nframes = nr + nd1 + ngroup*nf + (ngroup-1)*nd2 + nd3        
-        return nframes * self.time_frame + self.time_row_reset
+        return self.timing.time_total_int
 
     @property
     def time_total(self):
         """Total exposure acquisition time"""
-        return self.multiaccum.nint * self.time_total_int + self._exp_delay
+        return self.timing.time_total
 
     def to_dict(self, verbose=False):
         """Export detector settings to a dictionary."""
@@ -586,11 +739,7 @@ class DetectorOps(object):
 
     def times_to_dict(self, verbose=False):
         """Export ramp times as dictionary with option to print output to terminal."""
-
-        times = [('t_frame',self.time_frame), ('t_group',self.time_group), \
-                 ('t_int',self.time_int), ('t_exp',self.time_exp), \
-                 ('t_acq',self.time_total), ('t_int_tot',self.time_total_int)]
-        return tuples_to_dict(times, verbose)
+        return self.timing.to_dict(verbose)
 
     def pixel_noise(self, fsrc=0.0, fzodi=0.0, fbg=0.0, verbose=False, **kwargs):
         """
@@ -1299,6 +1448,10 @@ class NIRCam(object):
         ideal_Poisson : If set to True, use total signal for noise estimate,
                         otherwise MULTIACCUM equation is used.
 
+        ngroup, nf, nd2, nint : Override the current ramp settings without updating
+                        the detectors. With forwardSNR=True, ngroup, nf, and nd2 
+                        may be equal-sized arrays to get the SNR for each setting.
+
         rad_EE  : Extraction aperture radius (in pixels) for imaging mode.
         dw_bin  : Delta wavelength to calculate spectral sensitivities (grisms & DHS).
         ap_spec : Instead of dw_bin, specify the spectral extraction aperture in pixels.
@@ -1325,10 +1478,11 @@ class NIRCam(object):
         p_excess = self.Detectors[0].p_excess
 
 
+        # User-supplied ramp settings take priority over the current multiaccum
         kw1 = self.multiaccum.to_dict()
         kw2 = self._psf_info_bg
         kw3 = {'rn':rn, 'ktc':ktc, 'idark':idark, 'p_excess':p_excess}
-        kwargs = merge_dicts(kwargs,kw1,kw2,kw3)
+        kwargs = merge_dicts(kw1,kwargs,kw2,kw3)
         if 'ideal_Poisson' not in kwargs.keys():
             kwargs['ideal_Poisson'] = True
 
@@ -1362,28 +1516,17 @@ class NIRCam(object):
         if ('FLAT' in self.pupil):
             return 0
 
+        # Includes Lyot mask attenuation (not in bandpass throughput)
         bp = self.bandpass
-        waveset   = bp.wave
-        sp_zodi   = zodi_spec(zfact, **kwargs)
-        obs_zodi  = S.Observation(sp_zodi, bp, waveset)
-        fzodi_pix = obs_zodi.countrate() * (self.pix_scale/206265.0)**2
+        fzodi_pix = zodi_countrate(bp, zfact, self.pix_scale, self.pupil, **kwargs)
         
         # Recommend a zfact value if locstr, year, and day specified
         if 'locstr' in kwargs.keys():
-            sp_zodi_temp   = zodi_spec(zfact=1)
-            obs_zodi_temp  = S.Observation(sp_zodi_temp, bp, waveset)
-            fzodi_pix_temp = obs_zodi_temp.countrate() * (self.pix_scale/206265.0)**2
+            fzodi_pix_temp = zodi_countrate(bp, 1, self.pix_scale, self.pupil)
             zf_rec = fzodi_pix / fzodi_pix_temp
-            str1 = 'Using locstr,year,day keywords can be very slow. \n'
-            str2 = 'For your specified loc and date, we recommend using zfact={:.1f}'\
+            str1 = 'For your specified loc and date, we recommend using zfact={:.1f}'\
                 .format(zf_rec)
             _log.warning(str1)
-            _log.warning(str2)
-            
-
-        # Don't forget about Lyot mask attenuation (not in bandpass throughput)
-        if ('LYOT' in self.pupil):
-            fzodi_pix *= 0.19
 
         return fzodi_pix
         
@@ -1587,6 +1730,8 @@ class NIRCam(object):
         This function quickly runs through each detector readout pattern and 
         calculates the acquisition time and SNR for all possible settings of NINT
         and NGROUP that fulfill the SNR requirement (and other constraints). 
+        All settings are evaluated at once as arrays, so the detector 
+        configuration is never modified. 
 
         The final output table is then filtered, removing those exposure settings
         that have the same exact acquisition times but worse SNR. Further "obvious"
@@ -1628,9 +1773,9 @@ class NIRCam(object):
         ==========
         zfact           : Factor to scale Zodiacal spectrum (default 2.5)
         locstr,year,day : Another option for specifying zodiacal emisison.
-            These are not recommended for use given the amount of time it
-            takes to query the Euclid web server. Instead, use NIRCam.bg_zodi()
-            to match a zfact estimate.
+            Values come from the background provider (see bg_provider.py), 
+            which can be slow if it has to query the Euclid web server. 
+            Alternatively, use NIRCam.bg_zodi() to match a zfact estimate.
             locstr - Object name, RA/DEC in decimal degrees or sexigesimal input
             year   - Year of observation
             day    - Day of observation
@@ -1645,21 +1790,11 @@ class NIRCam(object):
 
         """
 
-        def parse_snr(snr, grism_obs, ind_snr):
-            if grism_obs:
-                res = snr['snr']
-                return np.median(res)
-            else:
-                return snr[ind_snr]['snr']            
-
-
         pupil = self.pupil
         grism_obs = (pupil is not None) and ('GRISM' in pupil)
         dhs_obs   = (pupil is not None) and ('DHS'   in pupil)
         coron_obs = (pupil is not None) and ('LYOT'  in pupil)
 
-        det_params_orig = self.det_info.copy()
-
         if dhs_obs:
             raise NotImplementedError('DHS has yet to be fully included.')
         if grism_obs and is_extended:
@@ -1712,138 +1847,118 @@ class NIRCam(object):
     
         patterns.sort()
 
+        # Build the full grid of (pattern, ngroup) settings
+        # and the ramp timing of each for NINT=1
+        det = self.Detectors[0]
+        patt_grid = []; ng_grid = []; nf_grid = []; nd2_grid = []
+        t_int = []; t_int_tot = []
+        for read_mode in patterns:
+            nf, nd2, ngroup_max = pattern_settings.get(read_mode)
+            if ng_max is not None:
+                ngroup_max = ng_max
+            ng_all = np.arange(ng_min,ngroup_max+1)
+
+            timing = RampTiming(det.scaid, det.wind_mode, det.xpix, det.ypix, read_mode)
+            times = timing.times(ng_all, 1)
+
+            patt_grid += [read_mode]*ng_all.size
+            ng_grid   += ng_all.tolist()
+            nf_grid   += [nf]*ng_all.size
+            nd2_grid  += [nd2]*ng_all.size
+            t_int     += times['t_int'].tolist()
+            t_int_tot += times['t_int_tot'].tolist()
+        patt_grid = np.array(patt_grid)
+        ng_grid   = np.array(ng_grid)
+        nf_grid   = np.array(nf_grid)
+        nd2_grid  = np.array(nd2_grid)
+        t_int     = np.array(t_int)
+        t_int_tot = np.array(t_int_tot)
+        exp_delay = det._exp_delay
+
+        # Get saturation level of observation
+        # If above well_frac_max, then the setting is invalid
+        well_frac = pix_count_rate * t_int / self.well_level
+        igood = np.where(well_frac <= well_frac_max)[0]
+
+        # SNR of all valid settings for NINT=1 in a single call.
+        # SNR scales as sqrt(NINT), so other NINT values follow directly.
+        snr1 = np.zeros(ng_grid.size)
+        if igood.size > 0:
+            sen = self.sensitivity(sp=sp, forwardSNR=True, image=image, 
+                ngroup=ng_grid[igood], nf=nf_grid[igood], nd2=nd2_grid[igood], 
+                nint=1, **kwargs)
+            if grism_obs:
+                snr1[igood] = np.median(np.reshape(sen['snr'], [-1,igood.size]), axis=0)
+            else:
+                snr1[igood] = sen[ind_snr]['snr']
+
+        def nint_snr(snr, snr_targ):
+            """Minimum NINT such that snr*sqrt(NINT) >= snr_targ"""
+            n = int(np.ceil((snr_targ / snr)**2))
+            # Guard against round-off in the analytic solution
+            while (n > 1) and (snr*np.sqrt(n-1) >= snr_targ): n -= 1
+            while snr*np.sqrt(n) < snr_targ: n += 1
+            return n
+
+        def add_row(i, nint):
+            snr = snr1[i] * np.sqrt(nint)
+            t_acq = nint * t_int_tot[i] + exp_delay
+            rows.append((patt_grid[i], ng_grid[i], nint, t_int[i], nint*t_int[i], \
+                t_acq, snr, well_frac[i]))
+
         rows = []
         if tacq_max is not None:
-            snr_goal_list = []
-            # Cycle through each readout pattern
-            for read_mode in patterns:
-                if verbose: print(read_mode)
-
-                # Maximum allowed groups for given readout pattern
-                _,_,ngroup_max = pattern_settings.get(read_mode)
-                if ng_max is not None:
-                    ngroup_max = ng_max
-                nng = ngroup_max - ng_min + 1
-                if nng>30:
-                    _log.warning('Cycling through {} NGRPs. This may take a while!'\
-                        .format(nng))
-                for ng in range(ng_min,ngroup_max+1):
-                    self.update_detectors(read_mode=read_mode, ngroup=ng, nint=1)
-                    mtimes = self.multiaccum_times
-
-                    # Get saturation level of observation
-                    # Total time spent integrating minus the reset frame
-                    int_time = mtimes['t_int']
-
-                    well_frac = pix_count_rate * int_time / self.well_level
-                    # If above well_frac_max, then this setting is invalid
-                    if well_frac > well_frac_max:
-                        continue
-            
-                    # Approximate integrations needed to obtain required t_acq
-                    nint1 = int(((1-tacq_frac)*tacq_max) / mtimes['t_acq'])
-                    nint2 = int(((1+tacq_frac)*tacq_max) / mtimes['t_acq'] + 0.5)
+            for i in igood:
+                # Approximate integrations needed to obtain required t_acq
+                t_acq1 = t_int_tot[i] + exp_delay
+                nint1 = int(((1-tacq_frac)*tacq_max) / t_acq1)
+                nint2 = int(((1+tacq_frac)*tacq_max) / t_acq1 + 0.5)
             
-                    nint1 = np.max([nint1,nint_min])
-                    nint2 = np.min([nint2,nint_max])
+                nint1 = np.max([nint1,nint_min])
+                nint2 = np.min([nint2,nint_max])
             
-                    nint_all = range(nint1, nint2+1)
+                nint_all = range(nint1, nint2+1)
                     
-                    narr = len(nint_all)
-                    # Sometimes there are a lot of nint values to check
-                    # Let's pair down to <5 per ng
-                    if narr>5:
-                        i1 = int(narr/2-2)
-                        i2 = i1 + 5
-                        nint_all = nint_all[i1:i2]
+                narr = len(nint_all)
+                # Sometimes there are a lot of nint values to check
+                # Let's pair down to <5 per ng
+                if narr>5:
+                    i1 = int(narr/2-2)
+                    i2 = i1 + 5
+                    nint_all = nint_all[i1:i2]
                 
-            
-                    #print(len(nint_all))
-                    for nint in nint_all:
-                        if nint > nint_max: break
-                        self.update_detectors(nint=nint)
-                        mtimes = self.multiaccum_times
-                        sen = self.sensitivity(sp=sp, forwardSNR=True, image=image, **kwargs)
-                        snr = parse_snr(sen, grism_obs, ind_snr)
-                
-                        rows.append((read_mode, ng, nint, mtimes['t_int'], mtimes['t_exp'], \
-                            mtimes['t_acq'], snr, well_frac))
+                for nint in nint_all:
+                    add_row(i, nint)
 
         elif snr_goal is not None:
-            for i,read_mode in enumerate(patterns):
-                if verbose: print(read_mode)
-
-                # Maximum allowed groups for given readout pattern
-                _,_,ngroup_max = pattern_settings.get(read_mode)
-                if ng_max is not None:
-                    ngroup_max = ng_max #np.min([ng_max,ngroup_max])
-                nng = ngroup_max - ng_min + 1
-                if nng>20:
-                    _log.warning('Cycling through {} NGRPs. This may take a while!'\
-                        .format(nng))
-                        
-                ng_saved = False
-                for ng in range(ng_min,ngroup_max+1):
-                    self.update_detectors(read_mode=read_mode, ngroup=ng, nint=1)
-                    mtimes = self.multiaccum_times
-
-                    # Get saturation level of observation
-                    int_time = mtimes['t_int']
-                    well_frac = pix_count_rate * int_time / self.well_level
-                    # If above well_frac_max, then this setting is invalid
-                    if well_frac > well_frac_max:
-                        continue
-
-                    # Get SNR (assumes no saturation)
-                    sen = self.sensitivity(sp=sp, forwardSNR=True, image=image, **kwargs)
-                    snr = parse_snr(sen, grism_obs, ind_snr)
-
-                    # Approximate integrations needed to get to required SNR
-                    nint = int((snr_goal / snr)**2)
-                    nint = np.max([nint_min,nint])
-                    if nint>nint_max:
-                        continue
-    
-                    # Find NINT with SNR > 0.95 snr_goal
-                    self.update_detectors(nint=nint)
-                    mtimes = self.multiaccum_times
-                    sen = self.sensitivity(sp=sp, forwardSNR=True, image=image, **kwargs)
-                    snr = parse_snr(sen, grism_obs, ind_snr)
-                    while (snr<((1-snr_frac)*snr_goal)) and (nint<=nint_max):
-                        nint += 1
-                        self.update_detectors(nint=nint)
-                        mtimes = self.multiaccum_times
-                        sen = self.sensitivity(sp=sp, forwardSNR=True, image=image, **kwargs)
-                        snr = parse_snr(sen, grism_obs, ind_snr)
-                
-                    # Skip if NINT
-                    if (nint > nint_max):# or :
-                        continue
-                        
-                    # We want to make sure that at least one NINT setting is saved
-                    # if the resulting SNR is higher than our stated goal.
-                    if (snr > ((1+snr_frac)*snr_goal)) and ng_saved:
-                        continue
-
-                    rows.append((read_mode, ng, nint, mtimes['t_int'], mtimes['t_exp'], \
-                        mtimes['t_acq'], snr, well_frac))
-                    ng_saved = True
-                    
-    
-                    # Increment NINT until SNR > 1.05 snr_goal
-                    # Add each NINT to table output
-                    while (snr < ((1+snr_frac)*snr_goal)) and (nint<=nint_max):
-                        nint += 1
-                        if (nint > nint_max): break # double-check
-                        self.update_detectors(nint=nint)
-                        sen = self.sensitivity(sp=sp, forwardSNR=True, image=image, **kwargs)
-                        snr = parse_snr(sen, grism_obs, ind_snr)
-                        mtimes = self.multiaccum_times
-                        rows.append((read_mode, ng, nint, mtimes['t_int'], mtimes['t_exp'], \
-                            mtimes['t_acq'], snr, well_frac))
-                
-        # Return to detector mode to original parameters
-        self.update_detectors(**det_params_orig)
+            ng_saved = {}
+            for i in igood:
+                read_mode = patt_grid[i]
+                snr = snr1[i]
+                if not (snr > 0): continue
+
+                # Approximate integrations needed to get to required SNR
+                nint = int((snr_goal / snr)**2)
+                nint = np.max([nint_min,nint])
+                if nint>nint_max:
+                    continue
+
+                # Find NINT with SNR > (1-snr_frac)*snr_goal
+                nint = np.max([nint, nint_snr(snr, (1-snr_frac)*snr_goal)])
+                if (nint > nint_max):
+                    continue
+
+                # We want to make sure that at least one NINT setting is saved
+                # if the resulting SNR is higher than our stated goal.
+                if (snr*np.sqrt(nint) > ((1+snr_frac)*snr_goal)) and ng_saved.get(read_mode, False):
+                    continue
+
+                # Add each NINT until SNR > (1+snr_frac)*snr_goal
+                nint2 = np.max([nint, nint_snr(snr, (1+snr_frac)*snr_goal)])
+                nint2 = np.min([nint2, nint_max])
+                for n in range(nint, nint2+1):
+                    add_row(i, n)
+                ng_saved[read_mode] = True
 
         names = ('Pattern', 'NGRP', 'NINT', 't_int', 't_exp', 't_acq', 'SNR', 'Well')
         if len(rows)==0:
@@ -260,24 +260,15 @@ class NRC_refs(object):
 
         # Supermean
         # the average of the average is the DC level of the output channel
-        smean = robust.mean(refs_all) if supermean else 0.0
-    
+        if supermean:
+            refs_all = [r for r in (self.refs_bot, self.refs_top) if r is not None]
+            smean = robust.mean(np.hstack(refs_all))
+        else:
+            smean = 0.0
+
+        # In-place subtraction of channel averages
         nchans = self.detector.nout
-        chsize = self.detector.chsize
-        nz, ny, nx = self.data.shape
-        for ch in range(nchans):
-            # Channel indices
-            ich1 = ch*chsize
-            ich2 = ich1 + chsize
-        
-            # In-place subtraction of channel averages
-            if self.altcol:
-                for i in range(nz):
-                    self.data[i,:,ich1:ich2-1:2] -= self.refs_amps_avg[0][ch,i]
-                    self.data[i,:,ich1+1:ich2:2] -= self.refs_amps_avg[1][ch,i]
-            else:
-                for i in range(nz):
-                    self.data[i,:,ich1:ich2] -= self.refs_amps_avg[ch,i]
+        _subtract_amp_offsets(self.data, self.refs_amps_avg, nchans, self.altcol)
 
         # Add back supermean
         if supermean: self.data += smean
@@ -308,7 +299,7 @@ class NRC_refs(object):
         self.refs_side_avg = calc_avg_cols(rl, rr, avg_type)
                     
 
-    def calc_col_smooth(self, perint=False, edge_wrap=False):
+    def calc_col_smooth(self, perint=False, edge_wrap=False, workers=None):
         """
         Geneated smoothed version of column reference values.
         Smooths calc_col_refs() to determine approx 1/f noise in data.
@@ -316,6 +307,7 @@ class NRC_refs(object):
         perint    (bool) : Smooth side reference pixel per int, otherwise per frame.
         edge_wrap (bool) : Add a partial frames to the beginning and end of each averaged
                            time series pixels in order to get rid of edge effects.          
+        workers    (int) : Number of threads for scipy.fft.
         """
         
         refvals = self.refs_side_avg
@@ -332,7 +324,7 @@ class NRC_refs(object):
         
         # Save smoothed values
         self.refs_side_smth = calc_col_smooth(refvals, self.data.shape, \
-                                              perint, edge_wrap, delt)
+                                              perint, edge_wrap, delt, workers)
 
     def correct_col_refs(self):
         """
@@ -445,8 +437,6 @@ def reffix_amps(cube, nchans=4, in_place=True, altcol=True, supermean=False,
         raise ValueError('Input data can only have 2 or 3 dimensions. \
                           Found {} dimensions.'.format(ndim))        
 
-    chsize = int(nx / nchans)
-
     # Number of reference rows to use
     # Set nt or nb equal to 0 if we don't want to use either
     nt = ntop if top_ref else 0
@@ -473,21 +463,10 @@ def reffix_amps(cube, nchans=4, in_place=True, altcol=True, supermean=False,
     smean = robust.mean(refs_all) if supermean else 0.0
     
     # Calculate avg reference values for each frame and channel
-    refs_amps_avg = calc_avg_amps(refs_all, cube.shape, nchans=4, altcol=True)
-        
-    for ch in range(nchans):
-        # Channel indices
-        ich1 = ch*chsize
-        ich2 = ich1 + chsize
+    refs_amps_avg = calc_avg_amps(refs_all, cube.shape, nchans=nchans, altcol=altcol)
 
-        # In-place subtraction of channel medians
-        if altcol:
-            for i in range(nz):
-                cube[i,:,ich1:ich2-1:2] -= refs_amps_avg[0][ch,i]
-                cube[i,:,ich1+1:ich2:2] -= refs_amps_avg[1][ch,i]
-        else:
-            for i in range(nz):
-                cube[i,:,ich1:ich2] -= refs_amps_avg[ch,i]
+    # In-place subtraction of channel averages
+    _subtract_amp_offsets(cube, refs_amps_avg, nchans, altcol)
 
     # Add back supermean
     if supermean: cube += smean
@@ -497,7 +476,7 @@ def reffix_amps(cube, nchans=4, in_place=True, altcol=True, supermean=False,
 
 
 def ref_filter(cube, nchans=4, in_place=True, avg_type='frame', perint=False, edge_wrap=False,
-               left_ref=True, right_ref=True, nleft=4, nright=4, **kwargs):
+               left_ref=True, right_ref=True, nleft=4, nright=4, workers=None, **kwargs):
     """
     Performs an optimal filtering of the vertical reference pixel to 
     reduce 1/f noise (horizontal stripes).
@@ -518,6 +497,7 @@ def ref_filter(cube, nchans=4, in_place=True, avg_type='frame', perint=False, ed
     right_ref (bool) : Include right reference cols when correcting 1/f noise.
     nleft      (int) : Specify the number of left reference columns.
     nright     (int) : Specify the number of right reference columns.
+    workers    (int) : Number of threads for scipy.fft.
     """               
            
     if not in_place:
@@ -555,7 +535,7 @@ def ref_filter(cube, nchans=4, in_place=True, avg_type='frame', perint=False, ed
     # The delta time does't seem to make any difference in the final data product
     # Just for vizualization purposes...
     delt = 10E-6 * (nx/nchans + 12.)
-    refvals_smoothed = calc_col_smooth(refvals, cube.shape, perint, edge_wrap, delt)
+    refvals_smoothed = calc_col_smooth(refvals, cube.shape, perint, edge_wrap, delt, workers)
     
     # Final correction
     #for i,im in enumerate(cube): im -= refvals_smoothed[i].reshape([ny,1])
@@ -572,48 +552,66 @@ def calc_avg_amps(refs_all, data_shape, nchans=4, altcol=True):
     so we save two arrays: self.refs_amps_avg1 and self.refs_amps_avg2. Each array
     has a size of (namp, ngroup).
 
+    The resistant means of all channels, column parities, and frames
+    are computed at once.
+
     top_ref   (bool) : Include top reference rows when correcting channel offsets.
     bot_ref   (bool) : Include bottom reference rows when correcting channel offsets.
     """
         
     nz, ny, nx = data_shape
     chsize = int(nx / nchans)
-    
+    nref = refs_all.shape[1]
+    refs = refs_all[:,:,:nchans*chsize].reshape((nz,nref,nchans,chsize))
+
     if altcol:
-        refs_amps_avg1 = []
-        refs_amps_avg2 = []
-        for ch in range(nchans):
-            # Channel indices
-            ich1 = ch*chsize
-            ich2 = ich1 + chsize
-
-            # Slice out alternating columns
-            refs_ch1 = refs_all[:,:,ich1:ich2-1:2].reshape((nz,-1))
-            refs_ch2 = refs_all[:,:,ich1+1:ich2:2].reshape((nz,-1))
-
-            # Take the resistant mean
-            chavg1 = robust.mean(refs_ch1,axis=1)
-            chavg2 = robust.mean(refs_ch2,axis=1)
-    
-            refs_amps_avg1.append(chavg1)
-            refs_amps_avg2.append(chavg2)
+        # Split into even and odd columns (excludes the last column if chsize is odd)
+        ncol = chsize // 2
+        refs = refs[:,:,:,:2*ncol].reshape((nz,nref,nchans,ncol,2))
+        # [parity, channel, frame, pixel]
+        refs = refs.transpose((4,2,0,1,3)).reshape((2,nchans,nz,-1))
+
+        # Take the resistant mean
+        refs_amps_avg = robust.mean(refs, axis=-1)
+        return (refs_amps_avg[0], refs_amps_avg[1])
+    else:
+        # [channel, frame, pixel]
+        refs = refs.transpose((2,0,1,3)).reshape((nchans,nz,-1))
+
+        # Take the resistant mean and reshape for broadcasting
+        refs_amps_avg = robust.mean(refs, axis=-1)
+        return refs_amps_avg.reshape((nchans,nz,1,1))
+
 
-        return (np.array(refs_amps_avg1), np.array(refs_amps_avg2))
+def _subtract_amp_offsets(cube, refs_amps_avg, nchans=4, altcol=True):
+    """
+    In-place subtraction of the amplifier offsets returned by calc_avg_amps()
+    from a cube of shape (nz,ny,nx). The offsets are expanded into a single
+    row per frame, which is then subtracted from all frames at once.
+    Offsets are computed in float64. For float cubes they are cast to the
+    cube's dtype before the subtraction; for integer cubes the difference 
+    is computed in float64 and truncated back to the cube's dtype.
+    """
+    nz, ny, nx = cube.shape
+    chsize = int(nx / nchans)
+
+    offsets = np.zeros((nz,nx), dtype=np.float64)
+    for ch in range(nchans):
+        # Channel indices
+        ich1 = ch*chsize
+        ich2 = ich1 + chsize
+
+        if altcol:
+            offsets[:,ich1:ich2-1:2] = refs_amps_avg[0][ch].reshape((nz,1))
+            offsets[:,ich1+1:ich2:2] = refs_amps_avg[1][ch].reshape((nz,1))
+        else:
+            offsets[:,ich1:ich2] = refs_amps_avg[ch].reshape((nz,1))
+
+    offsets = offsets.reshape((nz,1,nx))
+    if np.issubdtype(cube.dtype, np.floating):
+        cube -= offsets.astype(cube.dtype)
     else:
-        refs_amps_avg = []
-        for ch in range(nchans):
-            # Channel indices
-            ich1 = ch*chsize
-            ich2 = ich1 + chsize
-
-            # Slice out alternating columns
-            refs_ch = refs_all[:,:,ich1:ich2].reshape((nz,-1))
-
-            # Take the resistant mean and reshape for broadcasting
-            chavg = robust.mean(refs_ch,axis=1).reshape(-1,1,1)
-            refs_amps_avg.append(chavg)
-            
-        return np.array(refs_amps_avg)
+        np.subtract(cube, offsets, out=cube, casting='unsafe')
         
         
 def calc_avg_cols(refs_left=None, refs_right=None, avg_type='frame'):
@@ -675,7 +673,7 @@ def calc_avg_cols(refs_left=None, refs_right=None, avg_type='frame'):
 
 
 
-def calc_col_smooth(refvals, data_shape, perint=False, edge_wrap=False, delt=5.24E-4):
+def calc_col_smooth(refvals, data_shape, perint=False, edge_wrap=False, delt=5.24E-4, workers=None):
     """
     Geneated smoothed version of column reference values.
     Smooths values from calc_col_refs() via FFT.
@@ -683,6 +681,8 @@ def calc_col_smooth(refvals, data_shape, perint=False, edge_wrap=False, delt=5.2
     perint    (bool) : Smooth side reference pixel per int, otherwise per frame.
     edge_wrap (bool) : Add a partial frames to the beginning and end of each averaged
                        time seires pixels in order to get rid of edge effects.          
+    workers    (int) : Number of threads for scipy.fft (frame-by-frame smoothing 
+                       filters all frames in a single batched FFT).
     """
     
     nz,ny,nx = data_shape
@@ -693,26 +693,57 @@ def calc_col_smooth(refvals, data_shape, perint=False, edge_wrap=False, delt=5.2
     if perint:
         if edge_wrap: # Wrap around to avoid edge effects
             refvals2 = np.vstack((refvals[0][::-1], refvals, refvals[-1][::-1]))
-            refvals_smoothed2 = smooth_fft(refvals2, delt)
+            refvals_smoothed2 = smooth_fft(refvals2, delt, workers=workers)
             refvals_smoothed = refvals_smoothed2[ny:-ny].reshape(refvals.shape)
         else:
-            refvals_smoothed = smooth_fft(refvals, delt).reshape(refvals.shape)
+            refvals_smoothed = smooth_fft(refvals, delt, workers=workers).reshape(refvals.shape)
     else:
         if edge_wrap: # Wrap around to avoid edge effects
-            refvals_smoothed = []
-            for ref in refvals:
-                ref2 = np.concatenate((ref[:ny/2][::-1], ref, ref[ny/2:][::-1]))
-                ref_smth = smooth_fft(ref2, delt)
-                refvals_smoothed.append(ref_smth[ny/2:ny/2+ny])
-            refvals_smoothed = np.array(refvals_smoothed)
+            ny2 = ny // 2
+            refvals2 = np.hstack((refvals[:,:ny2][:,::-1], refvals, refvals[:,ny2:][:,::-1]))
+            refvals_smoothed2 = smooth_fft(refvals2, delt, batch=True, workers=workers)
+            refvals_smoothed = refvals_smoothed2[:,ny2:ny2+ny]
         else:
-            refvals_smoothed = np.array([smooth_fft(ref, delt) for ref in refvals])
+            refvals_smoothed = smooth_fft(refvals, delt, batch=True, workers=workers)
     
     return refvals_smoothed
 
 
-    
-def smooth_fft(data, delt, first_deriv=False, second_deriv=False):
+# Per-length sample times and derivative factors for smooth_fft().
+# FFT plans themselves are cached by scipy.fft / numpy.fft.
+_smooth_fft_cache = {}
+
+def _smooth_fft_setup(N, delt):
+    key = (N, delt)
+    try:
+        return _smooth_fft_cache[key]
+    except KeyError:
+        pass
+
+    Pi2 = 2*np.pi
+    OMEGA = Pi2 / (N*delt)
+    X = np.arange(N) * delt
+    # Differentiation in frequency domain (excludes the mean)
+    W = (np.arange(1, N//2+1) * OMEGA * 1j)
+
+    if len(_smooth_fft_cache) > 32:
+        _smooth_fft_cache.clear()
+    _smooth_fft_cache[key] = (X, W)
+    return X, W
+
+def _fft_funcs(workers=None):
+    """rfft and irfft functions with keywords for threading (if available)."""
+    try:
+        from scipy import fft
+        kwargs = {} if workers is None else {'workers': workers}
+    except ImportError:
+        fft = np.fft
+        kwargs = {}
+    rfft  = lambda x, n=None: fft.rfft(x, n=n, axis=-1, **kwargs)
+    irfft = lambda x, n=None: fft.irfft(x, n=n, axis=-1, **kwargs)
+    return rfft, irfft
+
+def smooth_fft(data, delt, first_deriv=False, second_deriv=False, batch=False, workers=None):
     """
     Smoothing algorithm to perform optimal filtering of the 
     vertical reference pixel to reduce 1/f noise (horizontal stripes),
@@ -726,34 +757,38 @@ def smooth_fft(data, delt, first_deriv=False, second_deriv=False):
 
     first_deriv  (bool) : Return the first derivative.    
     second_deriv (bool) : Return the second derivative (along with first).
+    batch        (bool) : If True, each row of a 2D array is filtered as an
+                          independent time series (with its own filter), 
+                          all in a single FFT. Otherwise, data is flattened.
+    workers       (int) : Number of threads to use for scipy.fft.
 
     If first_deriv is set, then returns two results
     if second_deriv is set, then returns three results.
     """
 
-    Dat = data.flatten()
-    N = Dat.size
-    Pi2 = 2*np.pi
-    OMEGA = Pi2 / (N*delt)
-    X = np.arange(N) * delt
+    if batch:
+        Dat = np.asarray(data, dtype=float)
+        if Dat.ndim != 2:
+            raise ValueError('Batch input must have 2 dimensions. Found {}.'.format(Dat.ndim))
+    else:
+        Dat = np.asarray(data, dtype=float).reshape([1,-1])
+    nb, N = Dat.shape
+    X, W = _smooth_fft_setup(N, delt)
+    rfft, irfft = _fft_funcs(workers)
 
     ##------------------------------------------------
     ## Center and Baselinefit of the data
     ##------------------------------------------------
-    Dat_m = Dat - np.mean(Dat)
-    SLOPE = (Dat_m[-1] - Dat_m[0]) / (N-2)
-    Dat_b = Dat_m - Dat_m[0] - SLOPE * X / delt
+    Dat_m = Dat - np.mean(Dat, axis=-1, keepdims=True)
+    SLOPE = (Dat_m[:,-1:] - Dat_m[:,0:1]) / (N-2)
+    Dat_b = Dat_m - Dat_m[:,0:1] - SLOPE * X / delt
 
     ##------------------------------------------------
     ## Compute fft- / power- spectrum
     ##------------------------------------------------
-    Dat_F = np.fft.rfft(Dat_b) #/ N
+    Dat_F = rfft(Dat_b) #/ N
     Dat_P = np.abs(Dat_F)**2
-
-    # Frequency for abscissa axis
-    # F = [0.0, 1.0/(N*delt), ... , 1.0/(2.0*delt)]:
-    #F = np.arange(N/2+1) / (N*delt)
-    #F = np.fft.fftfreq(Dat_F.size, delt)
+    nP = Dat_P.shape[-1]
 
     ##------------------------------------------------
     ## Noise spectrum from 'half' to 'full'
@@ -761,50 +796,53 @@ def smooth_fft(data, delt, first_deriv=False, second_deriv=False):
     ##------------------------------------------------
     i1 = int((N-1) / 4)
     i2 = int((N-1) / 2) + 1
-    Sigma = np.sum(Dat_P[i1:i2])
-    Noise = Sigma / ((N-1)/2 - (N-1)/4)
+    Sigma = np.sum(Dat_P[:,i1:i2], axis=-1)
+    Noise = (Sigma / ((N-1)/2 - (N-1)/4)).reshape([-1,1])
 
     ##------------------------------------------------
     ## Get Filtercoeff. according to Kosarev/Pantos
     ## Find the J0, start search at i=1 (i=0 is the mean)
+    ## J0 is the first i where P[i] and any of P[i+1:i+4] are below the noise
     ##------------------------------------------------
-    J0 = 2
-    for i in np.arange(1, int(N/4)+1):
-        sig0, sig1, sig2, sig3 = Dat_P[i:i+4]
-        if (sig0<Noise) and ((sig1<Noise) or (sig2<Noise) or (sig3<Noise)):
-            J0 = i
-            break
+    imax = min(int(N/4), nP-4)
+    below = Dat_P < Noise
+    if imax >= 1:
+        ind = np.arange(1, imax+1)
+        cond = below[:,ind] & (below[:,ind+1] | below[:,ind+2] | below[:,ind+3])
+        J0 = np.where(cond.any(axis=-1), np.argmax(cond, axis=-1) + 1, 2)
+    else:
+        J0 = np.full(nb, 2)
 
     ##------------------------------------------------
     ## Compute straight line extrapolation to log(Dat_P)
     ##------------------------------------------------
-    ii = np.arange(1,J0+1)
-    logvals = np.log(Dat_P[1:J0+1])
-    XY = np.sum(ii * logvals)
-    XX = np.sum(ii**2)
-    S  = np.sum(logvals)
+    J0max = J0.max()
+    with np.errstate(divide='ignore'):
+        logvals = np.log(Dat_P[:,1:J0max+1])
+    ii = np.arange(1, J0max+1)
+    XY = np.cumsum(ii * logvals, axis=-1)[np.arange(nb), J0-1]
+    S  = np.cumsum(logvals, axis=-1)[np.arange(nb), J0-1]
+    XX = J0 * (J0+1) * (2*J0+1) / 6
     # Find parameters A1, B1
     XM = (2. + J0) / 2
     YM = S / J0
-    A1 = (XY - J0*XM*YM) / (XX - J0*XM*XM)
-    B1 = YM - A1 * XM
+    A1 = ((XY - J0*XM*YM) / (XX - J0*XM*XM)).reshape([-1,1])
+    B1 = (YM - A1[:,0] * XM).reshape([-1,1])
 
     # Compute J1, the frequency for which straight
     # line extrapolation drops 20dB below noise
-    J1 = int(np.ceil((np.log(0.01*Noise) - B1) / A1 ))
-    if J1<J0:
-        J1 = J0+1
-
+    J1 = np.ceil((np.log(0.01*Noise) - B1) / A1).astype(int)
+    J1 = np.where(J1 < J0.reshape([-1,1]), J0.reshape([-1,1])+1, J1)
 
     ##------------------------------------------------
     ## Compute the Kosarev-Pantos filter windows
     ## Frequency-ranges: 0 -- J0 | J0+1 -- J1 | J1+1 -- N2
     ##------------------------------------------------
-    nvals = int((N-1)/2 + 1)
-    LOPT = np.zeros_like(Dat_P)
-    LOPT[0:J0+1] = Dat_P[0:J0+1] / (Dat_P[0:J0+1] + Noise)
-    i_arr = np.arange(J1-J0) + J0+1
-    LOPT[J0+1:J1+1] = np.exp(A1*i_arr+B1) / (np.exp(A1*i_arr+B1) + Noise)
+    i_arr = np.arange(nP).reshape([1,-1])
+    with np.errstate(over='ignore', invalid='ignore'):
+        Pext = np.exp(A1*i_arr+B1)
+        LOPT = np.where(i_arr <= J0.reshape([-1,1]), Dat_P / (Dat_P + Noise),
+                        np.where(i_arr <= J1, Pext / (Pext + Noise), 0.0))
 
     ##--------------------------------------------------------------------
     ## De-noise the Spectrum with the filter
@@ -821,33 +859,31 @@ def smooth_fft(data, delt, first_deriv=False, second_deriv=False):
     else:
         ndiff = 1
 
+    # All filtered spectra are inverse transformed together
+    Fltr_Spectrum = np.zeros((ndiff,nb,nP), dtype=complex)
     for diff in range(ndiff):
-        #Fltr_Spectrum = np.zeros(N,dtype=np.complex)
-        Fltr_Spectrum = np.zeros_like(Dat_P,dtype=np.complex)
-        # make the filter complex
-        i1 = 1; n2 = int((N-1)/2)+1; i2 = i1+n2 
-        FltrCoef = LOPT[i1:].astype(np.complex)
-        # differentitation in frequency domain
-        iW = ((np.arange(n2)+i1)*OMEGA*1j)**diff
         # multiply spectrum with filter coefficient
-        Fltr_Spectrum[i1:] = Dat_F[i1:] * FltrCoef * iW
+        Fltr_Spectrum[diff,:,1:] = Dat_F[:,1:] * LOPT[:,1:] * W**diff
 
         # Fltr_Spectrum[0] values
         # The derivatives of Fltr_Spectrum[0] are 0
         # Mean if diff = 0
-        Fltr_Spectrum[0] = 0 if diff>0 else Dat_F[0]
-    
-        # Inverse fourier transform back in time domain
-        Dat_T = np.fft.irfft(Fltr_Spectrum)
-        #Dat_T[-1] = np.real(Dat_T[0]) + 1j*np.imag(Dat_T[-1])
-
-        # This ist the smoothed time series (baseline added)
-        if diff==0:
-            Smoothed_Data = np.real(Dat_T) + Dat[0] + SLOPE * X / delt
-        elif diff==1:
-            First_Diff = np.real(Dat_T) + SLOPE / delt
-        elif diff==2:
-            Secnd_Diff = np.real(Dat_T)
+        Fltr_Spectrum[diff,:,0] = 0 if diff>0 else Dat_F[:,0]
+
+    # Inverse fourier transform back in time domain
+    Dat_T = irfft(Fltr_Spectrum, n=N)
+
+    # This ist the smoothed time series (baseline added)
+    Smoothed_Data = Dat_T[0] + Dat[:,0:1] + SLOPE * X / delt
+    if ndiff > 1:
+        First_Diff = Dat_T[1] + SLOPE / delt
+    if ndiff > 2:
+        Secnd_Diff = Dat_T[2]
+
+    if not batch:
+        Smoothed_Data = Smoothed_Data[0]
+        if ndiff > 1: First_Diff = First_Diff[0]
+        if ndiff > 2: Secnd_Diff = Secnd_Diff[0]
     
     if second_deriv:
         return Smoothed_Data, First_Diff, Secnd_Diff
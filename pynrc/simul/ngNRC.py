@@ -30,7 +30,6 @@ from . import nghxrg as ng
 from pynrc.nrc_utils import nrc_header
 
 #import pdb
-from copy import deepcopy
 
 from pynrc import DetectorOps
 from pynrc import conf
@@ -50,58 +49,12 @@ from pynrc import conf
 import logging
 _log = logging.getLogger('pynrc')
 
-def SCAnoise(det=None, scaid=None, params=None, caldir=None, file_out=None, 
-    dark=True, bias=True, out_ADU=False, verbose=False, use_fftw=False, ncores=None,
-    **kwargs):
+def _SCAnoise_setup(det=None, scaid=None, params=None, caldir=None, 
+    dark=True, bias=True, verbose=False, use_fftw=False, ncores=None):
     """
-    Create a data cube consisting of realistic NIRCam detector noise.
-
-    This is essentially a wrapper for nghxrg.py that selects appropriate values
-    for a specified SCA in order to reproduce realistic noise properties similiar
-    to those measured during ISIM CV3.
-
-    Parameters
-    ----------
-    det    : Option to specify already existing NIRCam detector object class
-             Otherwise, use scaid and params
-    scaid  : NIRCam SCA number (481, 482, ..., 490)
-    params : A set of MULTIACCUM parameters such as:
-        params = {'ngroup': 2, 'wind_mode': 'FULL', 
-                'xpix': 2048, 'ypix': 2048, 'x0':0, 'y0':0}
-        wind_mode can be FULL, STRIPE, or WINDOW
-    file_out : Folder name and destination to place optional FITS output. 
-        A timestamp will be appended to the end of the file name (and before .fits').
-    caldir : Directory location housing the super bias and super darks for each SCA.
-    dark : Use super dark? If True, then reads in super dark slope image.
-    bias : Use super bias? If True, then reads in super bias image.
-    out_ADU : Noise values are calculated in terms of equivalent electrons. This
-        gives the option of converting to ADU (True) or keeping in term of e- (False).
-        ADU values are converted to 16-bit UINT. Keep in e- if applying to a ramp
-        observation then convert combined data to ADU later.
-
-    Returns 
-    ----------
-    Primary HDU with noise ramp in hud.data and header info in hdu.header.
-
-    Examples 
-    ----------
-    import ngNRC
-    params = {'ngroup': 108, 'wind_mode': 'FULL', 
-            'xpix': 2048, 'ypix': 2048, 'x0':0, 'y0':0}
-    
-    # Output to a file
-    scaid = 481
-    caldir = '/data/darks_sim/nghxrg/sca_images/'
-    file_out = '/data/darks_sim/dark_sim_481.fits'
-    hdu = ngNRC.SCAnoise(scaid, params, file_out=file_out, caldir=caldir, \
-        dark=True, bias=True, out_ADU=True, use_fftw=False, ncores=None, verbose=False)
-
-    # Don't save file, but keep hdu in e- for adding to simulated observation ramp
-    scaid = 481
-    caldir = '/data/darks_sim/nghxrg/sca_images/'
-    hdu = ngNRC.SCAnoise(scaid, params, file_out=None, caldir=caldir, \
-        dark=True, bias=True, out_ADU=False, use_fftw=False, ncores=None, verbose=False)
-
+    Create the HXRGNoise object and noise keywords for a specified SCA.
+    Returns the detector object, the noise generator, and a dictionary of
+    keywords to pass to HXRGNoise.mknoise() or HXRGNoise.mknoise_iter().
     """
 
     # Extensive testing on both Python 2 & 3 shows that 4 cores is optimal for FFTW
@@ -229,12 +182,76 @@ def SCAnoise(det=None, scaid=None, params=None, caldir=None, file_out=None,
         ref_f2f_ucorr = ref_f2f_ucorr[0]
         aco_a = aco_a[0]; aco_b = aco_b[0]
 
+    kwargs = {'gain':gn, 'rd_noise':rd_noise, 'c_pink':c_pink, 'u_pink':u_pink, 
+              'reference_pixel_noise_ratio':ref_rat, 'ktc_noise':ktc_noise,
+              'bias_off_avg':bias_off_avg, 'bias_off_sig':bias_off_sig, 
+              'bias_amp':bias_amp, 'ch_off':ch_off, 'ref_f2f_corr':ref_f2f_corr, 
+              'ref_f2f_ucorr':ref_f2f_ucorr, 'aco_a':aco_a, 'aco_b':aco_b, 
+              'ref_inst':ref_inst}
+
+    return det, ng_h2rg, kwargs
+
+
+def SCAnoise(det=None, scaid=None, params=None, caldir=None, file_out=None, 
+    dark=True, bias=True, out_ADU=False, verbose=False, use_fftw=False, ncores=None,
+    **kwargs):
+    """
+    Create a data cube consisting of realistic NIRCam detector noise.
+
+    This is essentially a wrapper for nghxrg.py that selects appropriate values
+    for a specified SCA in order to reproduce realistic noise properties similiar
+    to those measured during ISIM CV3.
+
+    Parameters
+    ----------
+    det    : Option to specify already existing NIRCam detector object class
+             Otherwise, use scaid and params
+    scaid  : NIRCam SCA number (481, 482, ..., 490)
+    params : A set of MULTIACCUM parameters such as:
+        params = {'ngroup': 2, 'wind_mode': 'FULL', 
+                'xpix': 2048, 'ypix': 2048, 'x0':0, 'y0':0}
+        wind_mode can be FULL, STRIPE, or WINDOW
+    file_out : Folder name and destination to place optional FITS output. 
+        A timestamp will be appended to the end of the file name (and before .fits').
+    caldir : Directory location housing the super bias and super darks for each SCA.
+    dark : Use super dark? If True, then reads in super dark slope image.
+    bias : Use super bias? If True, then reads in super bias image.
+    out_ADU : Noise values are calculated in terms of equivalent electrons. This
+        gives the option of converting to ADU (True) or keeping in term of e- (False).
+        ADU values are converted to 16-bit UINT. Keep in e- if applying to a ramp
+        observation then convert combined data to ADU later.
+
+    Returns 
+    ----------
+    Primary HDU with noise ramp in hud.data and header info in hdu.header.
+
+    Examples 
+    ----------
+    import ngNRC
+    params = {'ngroup': 108, 'wind_mode': 'FULL', 
+            'xpix': 2048, 'ypix': 2048, 'x0':0, 'y0':0}
+    
+    # Output to a file
+    scaid = 481
+    caldir = '/data/darks_sim/nghxrg/sca_images/'
+    file_out = '/data/darks_sim/dark_sim_481.fits'
+    hdu = ngNRC.SCAnoise(scaid, params, file_out=file_out, caldir=caldir, \
+        dark=True, bias=True, out_ADU=True, use_fftw=False, ncores=None, verbose=False)
+
+    # Don't save file, but keep hdu in e- for adding to simulated observation ramp
+    scaid = 481
+    caldir = '/data/darks_sim/nghxrg/sca_images/'
+    hdu = ngNRC.SCAnoise(scaid, params, file_out=None, caldir=caldir, \
+        dark=True, bias=True, out_ADU=False, use_fftw=False, ncores=None, verbose=False)
+
+    """
+
+    det, ng_h2rg, ng_kwargs = _SCAnoise_setup(det=det, scaid=scaid, params=params, 
+        caldir=caldir, dark=dark, bias=bias, verbose=verbose, use_fftw=use_fftw, 
+        ncores=ncores)
+
     # Run noise generator
-    hdu = ng_h2rg.mknoise(None, gain=gn, rd_noise=rd_noise, c_pink=c_pink, u_pink=u_pink, 
-            reference_pixel_noise_ratio=ref_rat, ktc_noise=ktc_noise,
-            bias_off_avg=bias_off_avg, bias_off_sig=bias_off_sig, bias_amp=bias_amp,
-            ch_off=ch_off, ref_f2f_corr=ref_f2f_corr, ref_f2f_ucorr=ref_f2f_ucorr, 
-            aco_a=aco_a, aco_b=aco_b, ref_inst=ref_inst, out_ADU=out_ADU)
+    hdu = ng_h2rg.mknoise(None, out_ADU=out_ADU, **ng_kwargs)
 
     hdu.header = nrc_header(det)#, header=hdu.header)
     hdu.header['UNITS'] = 'ADU' if out_ADU else 'e-'
@@ -259,9 +276,215 @@ def SCAnoise(det=None, scaid=None, params=None, caldir=None, file_out=None,
 
     return hdu
 
+def SCAnoise_iter(det=None, scaid=None, params=None, caldir=None, 
+    dark=True, bias=True, out_ADU=False, verbose=False):
+    """
+    Generator version of SCAnoise() that yields the noise ramp one frame
+    at a time (see HXRGNoise.mknoise_iter()). Memory usage is independent 
+    of the number of frames in the ramp. Parameters are the same as SCAnoise().
+
+    Examples 
+    ----------
+    for frame in ngNRC.SCAnoise_iter(det):
+        ...
+    """
+
+    det, ng_h2rg, ng_kwargs = _SCAnoise_setup(det=det, scaid=scaid, params=params, 
+        caldir=caldir, dark=dark, bias=bias, verbose=verbose)
+
+    return ng_h2rg.mknoise_iter(out_ADU=out_ADU, **ng_kwargs)
+
+
+def _ref_pixels_zero(det, im_slope):
+    """Set reference pixels' slopes equal to 0 (in place)."""
+    w = det.ref_info
+    if w[0] > 0: # lower
+        im_slope[:w[0],:] = 0
+    if w[1] > 0: # upper
+        im_slope[-w[1]:,:] = 0
+    if w[2] > 0: # left
+        im_slope[:,:w[2]] = 0
+    if w[3] > 0: # right
+        im_slope[:,-w[3]:] = 0
+    return im_slope
+
+def slope_to_ramp_iter(det, im_slope=None, out_ADU=False, dark=True, bias=True,
+                       noise=None, stream_noise=False):
+    """
+    Generator version of slope_to_ramp() that builds the ramp one frame at 
+    a time. Poisson noise is accumulated frame-by-frame, drops (nd1 and nd2) 
+    are skipped, and the nf frames of each group are averaged on the fly. 
+    With stream_noise=True, only a few frames are held in memory, 
+    regardless of ngroup. 
+
+    The first item yielded is the ZERO frame (first read frame of the ramp),
+    followed by each of the ngroup groups as a (ypix, xpix) array.
+
+    The Poisson draws for each frame come after the detector noise cube 
+    (or are interleaved with the noise frames if stream_noise=True), so for
+    a given random seed the ramps differ from those of the previous (full 
+    cube) implementation, which drew all Poisson frames before the 
+    detector noise.
+
+    Parameters
+    ===========
+    det      : Detector operations object
+    im_slope : Idealized slope image
+    out_ADU  : If true, divide by gain and convert to 16-bit UINT.
+               Groups with nf>1 are averages of the UINT frames.
+    dark     : Use super dark for the detector noise?
+    bias     : Use super bias for the detector noise?
+    noise    : Dark ramp (e-) to use instead of calling SCAnoise().
+               Can be any iterable that returns one frame at a time.
+    stream_noise : By default, the dark ramp is the full cube from SCAnoise(),
+               which uses the exact FFT-based 1/f noise of HXRGNoise.mknoise().
+               Set to True to generate it frame by frame with SCAnoise_iter(),
+               so that memory usage doesn't depend on the number of frames.
+               Its 1/f noise is an approximation (see HXRGNoise.mknoise_iter()).
+    """
+
+    # MULTIACCUM ramp information
+    ma  = det.multiaccum
+
+    nd1     = ma.nd1
+    nd2     = ma.nd2
+    nf      = ma.nf
+    ngroup  = ma.ngroup
+    t_frame = det.time_frame
+
+    # Number of total frames up the ramp (including drops)
+    naxis3 = nd1 + ngroup*nf + (ngroup-1)*nd2
+
+    if im_slope is not None:
+        # Count accumulation for a single frame
+        frame = _ref_pixels_zero(det, im_slope) * t_frame
+        accum = np.zeros(frame.shape, dtype=np.int64)
+
+    # Create dark ramp with read noise and 1/f noise
+    if (noise is None) and stream_noise:
+        noise = SCAnoise_iter(det=det, dark=dark, bias=bias)
+    elif noise is None:
+        noise = SCAnoise(det=det, dark=dark, bias=bias).data
+    # Single frame ramps are returned as 2D images
+    if isinstance(noise, np.ndarray) and (noise.ndim == 2):
+        noise = noise.reshape((1,) + noise.shape)
+
+    def conv_ADU(data):
+        data /= det.gain
+        data[data < 0] = 0
+        data[data >= 2**16] = 2**16 - 1
+        return data.astype('uint16')
+
+    gsum = None
+    for z, noise_frame in enumerate(noise):
+        if z >= naxis3: break
+
+        # Add Poisson noise at each frame step (always draw, even for drops)
+        data = np.array(noise_frame, dtype=np.float32)
+        if im_slope is not None:
+            accum += np.random.poisson(lam=frame)
+            data += accum
+
+        # Get rid of any drops at the beginning (nd1)
+        if z < nd1: continue
+        # Position within group; skip the dropped frames (nd2)
+        k = (z - nd1) % (nf + nd2)
+        if k >= nf: continue
+
+        #### Add in IPC (TBI) ####
+
+        # Convert to ADU (16-bit UINT)
+        if out_ADU: data = conv_ADU(data)
+
+        # Save the first frame (so-called ZERO frame) for the zero frame extension
+        if z == nd1: yield data.copy()
+
+        # Average the frames within groups
+        # In reality, the 16-bit data is bit-shifted
+        if nf == 1:
+            yield data
+        else:
+            gsum = data.astype(np.float64) if k == 0 else gsum + data
+            if k == nf-1:
+                gavg = gsum / nf
+                yield gavg if out_ADU else gavg.astype(np.float32)
+
+def _stream_header(header, shape, dtype, extname=None):
+    """
+    FITS header with the mandatory keywords for an image of given shape 
+    and dtype, which can be used with fits.StreamingHDU.
+    """
+    dummy = np.zeros([1]*len(shape), dtype=dtype)
+    if extname is None:
+        hdr = fits.PrimaryHDU(data=dummy, header=header).header
+    else:
+        hdr = fits.ImageHDU(data=dummy, header=header, name=extname).header
+    for i, n in enumerate(shape[::-1]):
+        hdr['NAXIS{}'.format(i+1)] = n
+
+    # Unsigned ints are stored as signed with an offset
+    if dtype.kind == 'u':
+        hdr['BSCALE'] = (1, 'scale factor for array value to physical value')
+        hdr['BZERO']  = (32768, 'physical value for an array value of zero')
+    else:
+        hdr.remove('BSCALE', ignore_missing=True)
+        hdr.remove('BZERO', ignore_missing=True)
+    return hdr
+
+def _stream_write(shdu, data):
+    """Write an array to a StreamingHDU, accounting for unsigned ints."""
+    if data.dtype.kind == 'u':
+        data = (data.astype(np.int32) - 32768).astype(np.int16)
+    shdu.write(data)
+
+def _stream_ramp(file_out, header, zeroData, groups, shape, DMS=True):
+    """
+    Write each group produced by slope_to_ramp_iter() to file_out as it 
+    is generated. Only a single group is held in memory at a time.
+    """
+    from itertools import chain
+
+    # Need the first group to know the output data type
+    first = next(groups)
+    dtype = first.dtype
+
+    if DMS == True:
+        primHDU = fits.PrimaryHDU(header=header)
+        primHDU.writeto(file_out, clobber='True')
+
+        hdr = _stream_header(fits.Header(), shape, dtype, extname='SCI')
+        hdr.comments['NAXIS1'] = 'length of first data axis (#columns)'
+        hdr.comments['NAXIS2'] = 'length of second data axis (#rows)'
+        if hdr['NAXIS'] > 2:
+            hdr.comments['NAXIS3'] = 'length of third data axis (#groups/integration '
+        hdr['BUNIT'] = ('DN', 'physical units of the data array values')
+    else:
+        # StreamingHDU appends an extension if the file already exists
+        if os.path.exists(file_out): os.remove(file_out)
+        hdr = _stream_header(header, shape, dtype)
+
+    shdu = fits.StreamingHDU(file_out, hdr)
+    try:
+        for group in chain([first], groups):
+            _stream_write(shdu, group)
+    finally:
+        shdu.close()
+
+    if DMS == True:
+        zerHDU = fits.ImageHDU(data=zeroData)
+        zerHDU.name = 'ZEROFRAME'
+        zerHDU.header.comments['NAXIS1'] = 'length of first data axis (#columns)'
+        zerHDU.header.comments['NAXIS2'] = 'length of second data axis (#rows)'
+        hdul = fits.open(file_out, mode='append')
+        try:
+            hdul.append(zerHDU)
+        finally:
+            hdul.close()
+
 def slope_to_ramp(det, im_slope=None, out_ADU=False, file_out=None, 
                   filter=None, pupil=None, obs_time=None, targ_name=None,
-                  DMS=True, dark=True, bias=True, return_results=True):
+                  DMS=True, dark=True, bias=True, return_results=True, stream=False,
+                  stream_noise=False):
     """
     For a given detector operations class and slope image, create a
     ramp integration using Poisson noise and detector noise. 
@@ -294,98 +517,53 @@ def slope_to_ramp(det, im_slope=None, out_ADU=False, file_out=None,
         Target name (optional)
     DMS : bool
         Package the data in the format used by DMS?
+    stream : bool
+        Write each group to file_out as soon as it is generated rather
+        than building the full ramp in memory. If return_results=True,
+        the file is read back in and returned.
+        See slope_to_ramp_iter() to send groups to other destinations.
+    stream_noise : bool
+        Generate the detector noise frame by frame (SCAnoise_iter) instead
+        of as a full cube (SCAnoise). Together with stream=True, memory
+        usage is then independent of the number of groups. The 1/f noise
+        of the streaming generator approximates that of SCAnoise; frame 
+        and CDS noise agree to about 1% (benchmarks/check_noise_stream.py).
     """
 
-    #import ngNRC
-    # MULTIACCUM ramp information
     ma  = det.multiaccum
 
     xpix = det.xpix
     ypix = det.ypix
+    ngroup = ma.ngroup
 
-    nd1     = ma.nd1
-    nd2     = ma.nd2
-    nf      = ma.nf
-    ngroup  = ma.ngroup
-    t_frame = det.time_frame
-
-    # Number of total frames up the ramp (including drops)
-    naxis3 = nd1 + ngroup*nf + (ngroup-1)*nd2
-
-    if im_slope is not None:
-        # Set reference pixels' slopes equal to 0
-        w = det.ref_info
-        if w[0] > 0: # lower
-            im_slope[:w[0],:] = 0
-        if w[1] > 0: # upper
-            im_slope[-w[1]:,:] = 0
-        if w[2] > 0: # left
-            im_slope[:,:w[2]] = 0
-        if w[3] > 0: # right
-            im_slope[:,-w[3]:] = 0
-
-        # Count accumulation for a single frame
-        frame = im_slope * t_frame
-        # Add Poisson noise at each frame step
-        sh0, sh1 = im_slope.shape
-        new_shape = (naxis3, sh0,sh1)
-        ramp = np.random.poisson(lam=frame, size=new_shape)#.astype(np.float64)
-        # Perform cumulative sum in place
-        np.cumsum(ramp, axis=0, out=ramp)
-    else:
-        ramp = 0
-
-    # Create dark ramp with read noise and 1/f noise
-    hdu = SCAnoise(det=det, dark=dark, bias=bias)
     # Update header information
-    hdu.header = det.make_header(filter, pupil, obs_time,targ_name=targ_name,DMS=DMS)
-    hdu.data += ramp.reshape(hdu.data.shape) # Add signal ramp to dark ramp
-    data = hdu.data
-
-    #### Add in IPC (TBI) ####
-
-    # Get rid of any drops at the beginning (nd1)
-    if nd1>0: data = data[nd1:,:,:]
-
-    # Convert to ADU (16-bit UINT)
+    header = det.make_header(filter, pupil, obs_time,targ_name=targ_name,DMS=DMS)
     if out_ADU:
-        gain = det.gain
-        data /= gain
-        data[data < 0] = 0
-        data[data >= 2**16] = 2**16 - 1
-        data = data.astype('uint16')
-        hdu.header['UNITS'] = 'ADU'
-
-    ## Save the first frame (so-called ZERO frame) for the zero frame extension
-    zeroData = deepcopy(data[0,:,:])
-
-    # Remove drops and average grouped data
-    if nf>1 or nd2>0:
-        # Trailing drop frames already excluded, so need to pull off last group of avg'ed frames
-        data_end = data[-nf:,:,:].mean(axis=0) if nf>1 else data[-1:,:,:]
-        data_end = data_end.reshape([1,ypix,xpix])
-
-        # Only care about first (n-1) groups
-        # Last group is handled separately
-        data = data[:-nf,:,:]
-
-        # Reshape for easy group manipulation
-        data = data.reshape([-1,nf+nd2,ypix,xpix])
-
-        # Trim off the dropped frames (nd2)
-        if nd2>0: data = data[:,:nf,:,:]
-
-        # Average the frames within groups
-        # In reality, the 16-bit data is bit-shifted
-        data = data.reshape([-1,ypix,xpix]) if nf==1 else data.mean(axis=1)
-
-        # Add back the last group (already averaged)
-        data = np.append(data,data_end,axis=0)
-
-    hdu.data = data
-    
+        header['UNITS'] = 'ADU'
     if file_out is not None:
-        hdu.header['FILENAME'] = os.path.split(file_out)[1]
+        header['FILENAME'] = os.path.split(file_out)[1]
+
+    # Ramp generator; the first element is the ZERO frame
+    groups = slope_to_ramp_iter(det, im_slope, out_ADU=out_ADU, dark=dark, bias=bias,
+                                stream_noise=stream_noise)
+    zeroData = next(groups)
+
+    shape = (ngroup,ypix,xpix)
+    if stream and (file_out is not None):
+        _stream_ramp(file_out, header, zeroData, groups, shape, DMS=DMS)
+        # Unsigned data carry BZERO, which can't be applied to a memory map
+        if return_results: return fits.open(file_out, memmap=False)
+        return
+
+    # Build the ramp in memory one group at a time
+    data = None
+    for i, group in enumerate(groups):
+        if data is None:
+            data = np.empty(shape, dtype=group.dtype)
+        data[i] = group
+
+    hdu = fits.PrimaryHDU(data)
+    hdu.header = header
     
     if DMS == True:
         primHDU = fits.PrimaryHDU(header=hdu.header)
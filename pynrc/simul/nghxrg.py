@@ -87,12 +87,18 @@ Modification History:
     * For more info: https://pypi.python.org/pypi/pyFFTW
 - Version 3.0
 
+Oct 2026
+- Add mknoise_iter() to generate noise one frame at a time
+    * 1/f noise components are drawn from a streaming filter (PinkNoiseStream)
+    * Large FFT arrays are only created when needed by mknoise()
+- Version 3.1
+
 """
 # Necessary for Python 2.6 and later
 #from __future__ import division, print_function
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-__version__ = "3.0"
+__version__ = "3.1"
 
 import os
 import warnings
@@ -117,6 +123,100 @@ warnings.filterwarnings('ignore')
 import logging
 _log = logging.getLogger('nghxrg')
 
+
+class PinkNoiseStream(object):
+    """
+    Generate a continuous stream of 1/f noise in arbitrary sized blocks.
+
+    Rather than shaping a full-length white noise vector in Fourier space
+    (as in HXRGNoise.pink_noise()), white noise is passed through a cascade
+    of first-order pole/zero filters spaced evenly in log frequency (npd
+    per decade) between f_min and f_max. This approximates a 1/f power
+    spectrum to within a few percent, except near f_min, where the power
+    is about 10-15% lower than that of pink_noise() (see 
+    benchmarks/check_noise_stream.py). A short FIR filter corrects the 
+    response near the Nyquist frequency. The filter states are carried 
+    between calls to next(), so consecutive blocks form a single continuous
+    time series and memory usage only depends on the block size.
+
+    The output is normalized so that the standard deviation measured 
+    over nstep samples is approximately 1, similar to pink_noise().
+
+    Parameters:
+        nstep - Total number of time steps that will be generated.
+        f_min - Lowest frequency (in units of the sample rate) where the
+                spectrum follows 1/f. Defaults to 1/nstep.
+        f_max - Highest frequency (default 0.5, Nyquist).
+        npd   - Number of filter poles per decade of frequency.
+        nfir  - Number of taps in the high-frequency correction filter.
+    """
+
+    def __init__(self, nstep, f_min=None, f_max=0.5, npd=2, nfir=15):
+
+        from scipy import signal
+
+        nstep = int(nstep)
+        f_min = 1. / nstep if f_min is None else f_min
+
+        # Pole/zero frequencies
+        npole = int(np.log10(f_max/f_min) * npd) + 1
+        fp = f_min * 10**(np.arange(npole) / npd)
+        fp = fp[fp < f_max]
+        fz = fp * 10**(0.5/npd)
+        p = np.exp(-2*np.pi*fp)
+        z = np.exp(-2*np.pi*fz)
+        # Pair up into second-order sections
+        if p.size % 2:
+            p = np.append(p, 0.)
+            z = np.append(z, 0.)
+        sos = np.zeros([p.size//2, 6])
+        for i in range(p.size//2):
+            sos[i,:3] = np.convolve([1,-z[2*i]], [1,-z[2*i+1]])
+            sos[i,3:] = np.convolve([1,-p[2*i]], [1,-p[2*i+1]])
+
+        # FIR correction to restore 1/f above ~0.01 of the sample rate,
+        # where the pole spacing is too coarse
+        f = np.linspace(0, 0.5, 257)
+        h_sos = np.abs(self._response(sos, f))
+        f_ref = 0.01
+        k = np.abs(self._response(sos, f_ref)) * np.sqrt(f_ref)
+        corr = np.ones_like(f)
+        ind = f > f_ref
+        corr[ind] = k / np.sqrt(f[ind]) / h_sos[ind]
+        fir = signal.firwin2(nfir, f, corr, fs=1.0)
+
+        # Expected variance of nstep samples with their mean removed
+        f = np.logspace(np.log10(1e-3/nstep), np.log10(0.5), 4000)
+        h2 = np.abs(self._response(sos, f) * np.polyval(fir[::-1], np.exp(-2j*np.pi*f)))**2
+        y = h2 * (1 - np.sinc(nstep*f)**2)
+        var = 2 * np.sum(0.5 * (y[1:] + y[:-1]) * np.diff(f))
+        fir /= np.sqrt(var)
+
+        self.nstep = nstep
+        self.sos = sos
+        self.fir = fir
+        self._zi_sos = np.zeros([sos.shape[0], 2])
+        self._zi_fir = np.zeros(nfir-1)
+
+    @staticmethod
+    def _response(sos, f):
+        """Complex frequency response of sos filter at frequencies f."""
+        zm1 = np.exp(-2j*np.pi*np.asarray(f))
+        h = 1.
+        for b0, b1, b2, a0, a1, a2 in sos:
+            h = h * (b0 + b1*zm1 + b2*zm1**2) / (a0 + a1*zm1 + a2*zm1**2)
+        return h
+
+    def next(self, n):
+        """Return the next n samples of the noise stream."""
+        from scipy import signal
+
+        res, self._zi_sos = signal.sosfilt(self.sos, np.random.standard_normal(n), 
+                                           zi=self._zi_sos)
+        res, self._zi_fir = signal.lfilter(self.fir, 1., res, zi=self._zi_fir)
+        return res
+
+
 class HXRGNoise(object):
     """
     HXRGNoise is a class for making realistic Teledyne HxRG system
@@ -283,39 +383,18 @@ class HXRGNoise(object):
         self.tframe = self.nstep_frame * self.dt
         self.inttime = self.tframe * self.naxis3
 
-        # For adding in ACN, it is handy to have masks of the even
-        # and odd pixels on one output neglecting any gaps
-        self.m_even = np.zeros((self.naxis3,self.naxis2,self.xsize))
-        self.m_odd = np.zeros_like(self.m_even)
-        for x in np.arange(0,self.xsize,2):
-            self.m_even[:,:self.naxis2,x] = 1
-            self.m_odd[:,:self.naxis2,x+1] = 1
-        self.m_even = np.reshape(self.m_even, np.size(self.m_even))
-        self.m_odd = np.reshape(self.m_odd, np.size(self.m_odd))
+        # Pinkening filter exponent.
+        # Hard code for 1/f noise until proven otherwise
+        self.alpha = -1
 
-        # Also for adding in ACN, we need a mask that point to just
-        # the real pixels in ordered vectors of just the even or odd
-        # pixels
-        self.m_short = np.zeros((self.naxis3, self.naxis2+self.nfoh, \
-                                      (self.xsize+self.nroh)//2))
-        self.m_short[:,:self.naxis2,:self.xsize//2] = 1
-        self.m_short = np.reshape(self.m_short, np.size(self.m_short))
-
-        # Define frequency arrays       
-        self.f1 = np.fft.rfftfreq(self.nstep2) # Frequencies for nstep elements
-        self.f2 = np.fft.rfftfreq(2*self.nstep2) # ... for 2*nstep elements
+        # Frequency array and pinkening filter for reference instability
         self.f3 = np.fft.rfftfreq(2*self.naxis3)
-
-        # Define pinkening filters. F1 and p_filter1 are used to
-        # generate ACN. F2 and p_filter2 are used to generate 1/f noise.
-        self.alpha = -1 # Hard code for 1/f noise until proven otherwise
-        self.p_filter1 = np.sqrt(self.f1**self.alpha)
-        self.p_filter2 = np.sqrt(self.f2**self.alpha)
         self.p_filter3 = np.sqrt(self.f3**self.alpha)
-        self.p_filter1[0] = 0.
-        self.p_filter2[0] = 0.
         self.p_filter3[0] = 0.
 
+        # Frequency arrays and pinkening filters for the full ramp are only
+        # created when needed by mknoise(). They are very large for long ramps.
+        self._fft_arrays_init = False
 
         # Initialize pca0. This includes scaling to the correct size,
         # zero offsetting, and renormalization. We use robust statistics
@@ -415,6 +494,46 @@ class HXRGNoise(object):
         if self.verbose is True:
             print('NG: ' + message_text + ' at DATETIME = ', (datetime.datetime.now().time()))
 
+    def _init_fft_arrays(self):
+        """
+        Create the masks, frequency arrays, and pinkening filters used by
+        mknoise() and pink_noise(). Their sizes scale with the number of
+        time steps in the full ramp, so they are not created by __init__.
+        """
+        if self._fft_arrays_init:
+            return
+
+        # For adding in ACN, it is handy to have masks of the even
+        # and odd pixels on one output neglecting any gaps
+        self.m_even = np.zeros((self.naxis3,self.naxis2,self.xsize))
+        self.m_odd = np.zeros_like(self.m_even)
+        for x in np.arange(0,self.xsize,2):
+            self.m_even[:,:self.naxis2,x] = 1
+            self.m_odd[:,:self.naxis2,x+1] = 1
+        self.m_even = np.reshape(self.m_even, np.size(self.m_even))
+        self.m_odd = np.reshape(self.m_odd, np.size(self.m_odd))
+
+        # Also for adding in ACN, we need a mask that point to just
+        # the real pixels in ordered vectors of just the even or odd
+        # pixels
+        self.m_short = np.zeros((self.naxis3, self.naxis2+self.nfoh, \
+                                      (self.xsize+self.nroh)//2))
+        self.m_short[:,:self.naxis2,:self.xsize//2] = 1
+        self.m_short = np.reshape(self.m_short, np.size(self.m_short))
+
+        # Define frequency arrays       
+        self.f1 = np.fft.rfftfreq(self.nstep2) # Frequencies for nstep elements
+        self.f2 = np.fft.rfftfreq(2*self.nstep2) # ... for 2*nstep elements
+
+        # Define pinkening filters. F1 and p_filter1 are used to
+        # generate ACN. F2 and p_filter2 are used to generate 1/f noise.
+        self.p_filter1 = np.sqrt(self.f1**self.alpha)
+        self.p_filter2 = np.sqrt(self.f2**self.alpha)
+        self.p_filter1[0] = 0.
+        self.p_filter2[0] = 0.
+
+        self._fft_arrays_init = True
+
     def white_noise(self, nstep=None):
         """
         Generate white noise for an HxRG including all time steps
@@ -433,6 +552,9 @@ class HXRGNoise(object):
             mode - Selected from {'pink', 'acn', 'ref_inst'}
         """
 
+        if ('pink' in mode) or ('acn' in mode):
+            self._init_fft_arrays()
+
         # Configure depending on mode setting
         if 'pink' in mode:
             nstep  = 2*self.nstep
@@ -491,66 +613,16 @@ class HXRGNoise(object):
 
 
 
-    def mknoise(self, o_file=None, gain=None,
-                rd_noise=None, c_pink=None, u_pink=None, 
+    def _set_noise_params(self, gain=None, rd_noise=None, c_pink=None, u_pink=None, 
                 acn=None, aco_a=None, aco_b=None, pca0_amp=None,
                 reference_pixel_noise_ratio=None, ktc_noise=None,
                 bias_off_avg=None, bias_off_sig=None, bias_amp=None,
-                ch_off=None, ref_f2f_corr=None, ref_f2f_ucorr=None, ref_inst=None,
-                out_ADU=True):
+                ch_off=None, ref_f2f_corr=None, ref_f2f_ucorr=None, ref_inst=None):
         """
-        Generate a FITS cube containing only noise.
-
-        Parameters:
-            o_file   - Output filename
-            gain     - Gain in e/ADU. Defaults to 1.0.
-            Pixel Noise values:
-              ktc_noise- kTC noise in electrons. Set this equal to
-                         sqrt(k*T*C_pixel)/q_e, where k is Boltzmann's constant, 
-                         T is detector temperature, and C_pixel is pixel 
-                         capacitance. For an H2RG, the pixel capacitance is 
-                         typically about 40 fF.
-              rd_noise - Standard deviation of read noise in electrons
-              c_pink   - Standard deviation of correlated pink noise in electrons
-              u_pink   - Standard deviation of uncorrelated pink noise in electrons
-              acn      - Standard deviation of alterating column noise in electrons
-              pca0_amp - Standard deviation of pca0 in electrons
-              reference_pixel_noise_ratio - Ratio of the standard deviation of the
-                         reference pixels to the regular pixels. Reference pixels 
-                         are usually a little lower noise.                                          
-            Offset values:
-              bias_off_avg - On average, integrations start here in electrons. Set
-                             this so that all pixels are in range.
-              bias_off_sig - bias_off_avg has some variation. This is its std dev.
-              bias_amp     - A multiplicative factor that we multiply bias_image by
-                             to simulate a bias pattern. This is completely
-                             independent from adding in "picture frame" noise. Set to
-                             0.0 remove bias pattern. For NIRCam, default is 1.0.
-              ch_off       - Offset of each channel relative to bias_off_avg.
-              ref_f2f_corr - Random frame-to-frame reference offsets due to PA reset,
-                             correlated between channels.
-              ref_f2f_ucorr- Random frame-to-frame reference offsets due to PA reset,
-                             per channel.
-              aco_a        - Relative offsets of altnernating columns "a"
-              aco_b        - Relative offsets of altnernating columns "b"
-              ref_inst     - Reference instability relative to active pixels.
-              out_ADU      - Boolean to return as converted to ADU (True) or raw electrons
-              
-        Note1:
-        Because of the noise correlations, there is no simple way to
-        predict the noise of the simulated images. However, to a
-        crude first approximation, these components add in
-        quadrature.
-
-        Note2:
-        The units in the above are mostly "electrons". This follows convention
-        in the astronomical community. From a physics perspective, holes are
-        actually the physical entity that is collected in Teledyne's p-on-n
-        (p-type implants in n-type bulk) HgCdTe architecture.
+        Set the noise parameters used by mknoise() and mknoise_iter().
+        See mknoise() for a description of each parameter.
         """
 
-        self.message('Starting mknoise()')
-
         # ======================================================================
         #
         # DEFAULT NOISE PARAMETERS
@@ -597,10 +669,13 @@ class HXRGNoise(object):
         
         # ======================================================================
 
-        # Initialize the result cube and add a bias pattern.
-        self.message('Initializing results cube')
-        result = np.zeros((self.naxis3, self.naxis2, self.naxis1), dtype=np.float32)
-        
+
+    def _bias_pattern(self):
+        """
+        Create the bias image for an integration (bias_image, overall offset, 
+        kTC noise, channel offsets, and alternating column offsets).
+        """
+
         # Inject a bias pattern.
         bias_pattern = self.bias_image*self.bias_amp
 
@@ -652,7 +727,84 @@ class HXRGNoise(object):
         for ch in range(self.n_out):
             chan = bias_pattern[:,self.xsize*ch:self.xsize*(ch+1)]
             chan[:,indb] += temp[ch]
+
+        return bias_pattern
+
+
+    def mknoise(self, o_file=None, gain=None,
+                rd_noise=None, c_pink=None, u_pink=None, 
+                acn=None, aco_a=None, aco_b=None, pca0_amp=None,
+                reference_pixel_noise_ratio=None, ktc_noise=None,
+                bias_off_avg=None, bias_off_sig=None, bias_amp=None,
+                ch_off=None, ref_f2f_corr=None, ref_f2f_ucorr=None, ref_inst=None,
+                out_ADU=True):
+        """
+        Generate a FITS cube containing only noise.
+
+        Parameters:
+            o_file   - Output filename
+            gain     - Gain in e/ADU. Defaults to 1.0.
+            Pixel Noise values:
+              ktc_noise- kTC noise in electrons. Set this equal to
+                         sqrt(k*T*C_pixel)/q_e, where k is Boltzmann's constant, 
+                         T is detector temperature, and C_pixel is pixel 
+                         capacitance. For an H2RG, the pixel capacitance is 
+                         typically about 40 fF.
+              rd_noise - Standard deviation of read noise in electrons
+              c_pink   - Standard deviation of correlated pink noise in electrons
+              u_pink   - Standard deviation of uncorrelated pink noise in electrons
+              acn      - Standard deviation of alterating column noise in electrons
+              pca0_amp - Standard deviation of pca0 in electrons
+              reference_pixel_noise_ratio - Ratio of the standard deviation of the
+                         reference pixels to the regular pixels. Reference pixels 
+                         are usually a little lower noise.                                          
+            Offset values:
+              bias_off_avg - On average, integrations start here in electrons. Set
+                             this so that all pixels are in range.
+              bias_off_sig - bias_off_avg has some variation. This is its std dev.
+              bias_amp     - A multiplicative factor that we multiply bias_image by
+                             to simulate a bias pattern. This is completely
+                             independent from adding in "picture frame" noise. Set to
+                             0.0 remove bias pattern. For NIRCam, default is 1.0.
+              ch_off       - Offset of each channel relative to bias_off_avg.
+              ref_f2f_corr - Random frame-to-frame reference offsets due to PA reset,
+                             correlated between channels.
+              ref_f2f_ucorr- Random frame-to-frame reference offsets due to PA reset,
+                             per channel.
+              aco_a        - Relative offsets of altnernating columns "a"
+              aco_b        - Relative offsets of altnernating columns "b"
+              ref_inst     - Reference instability relative to active pixels.
+              out_ADU      - Boolean to return as converted to ADU (True) or raw electrons
+              
+        Note1:
+        Because of the noise correlations, there is no simple way to
+        predict the noise of the simulated images. However, to a
+        crude first approximation, these components add in
+        quadrature.
+
+        Note2:
+        The units in the above are mostly "electrons". This follows convention
+        in the astronomical community. From a physics perspective, holes are
+        actually the physical entity that is collected in Teledyne's p-on-n
+        (p-type implants in n-type bulk) HgCdTe architecture.
+        """
+
+        self.message('Starting mknoise()')
+
+        self._set_noise_params(gain=gain, rd_noise=rd_noise, c_pink=c_pink, 
+            u_pink=u_pink, acn=acn, aco_a=aco_a, aco_b=aco_b, pca0_amp=pca0_amp,
+            reference_pixel_noise_ratio=reference_pixel_noise_ratio, 
+            ktc_noise=ktc_noise, bias_off_avg=bias_off_avg, bias_off_sig=bias_off_sig, 
+            bias_amp=bias_amp, ch_off=ch_off, ref_f2f_corr=ref_f2f_corr, 
+            ref_f2f_ucorr=ref_f2f_ucorr, ref_inst=ref_inst)
+        self._init_fft_arrays()
+
+        # Initialize the result cube and add a bias pattern.
+        self.message('Initializing results cube')
+        result = np.zeros((self.naxis3, self.naxis2, self.naxis1), dtype=np.float32)
         
+        bias_pattern = self._bias_pattern()
+
         # Add in the bias pattern
         for z in np.arange(self.naxis3):
             result[z,:,:] += bias_pattern
@@ -903,4 +1055,193 @@ class HXRGNoise(object):
     
         self.message('Exiting mknoise()')
 
-        return hdu
\ No newline at end of file
+        return hdu
+
+
+    def mknoise_iter(self, gain=None, rd_noise=None, c_pink=None, u_pink=None, 
+                     acn=None, aco_a=None, aco_b=None, pca0_amp=None,
+                     reference_pixel_noise_ratio=None, ktc_noise=None,
+                     bias_off_avg=None, bias_off_sig=None, bias_amp=None,
+                     ch_off=None, ref_f2f_corr=None, ref_f2f_ucorr=None, 
+                     ref_inst=None, out_ADU=True):
+        """
+        Generator version of mknoise() that yields one (naxis2, naxis1) frame
+        at a time, so the full data cube never has to exist in memory.
+
+        Parameters are the same as mknoise(). Correlated and uncorrelated 
+        pink noise, ACN, and PCA-zero noise are drawn from PinkNoiseStream
+        objects, which approximate the 1/f spectra generated by pink_noise()
+        but carry their state from frame to frame. Frame and CDS noise agree
+        with mknoise() to about 1%, but the power at the lowest frequencies
+        is somewhat lower; use mknoise() when the exact spectrum matters.
+        Frames are float32 in e-, or uint16 if out_ADU=True.
+        """
+
+        self.message('Starting mknoise_iter()')
+
+        self._set_noise_params(gain=gain, rd_noise=rd_noise, c_pink=c_pink, 
+            u_pink=u_pink, acn=acn, aco_a=aco_a, aco_b=aco_b, pca0_amp=pca0_amp,
+            reference_pixel_noise_ratio=reference_pixel_noise_ratio, 
+            ktc_noise=ktc_noise, bias_off_avg=bias_off_avg, bias_off_sig=bias_off_sig, 
+            bias_amp=bias_amp, ch_off=ch_off, ref_f2f_corr=ref_f2f_corr, 
+            ref_f2f_ucorr=ref_f2f_ucorr, ref_inst=ref_inst)
+
+        nz, ny, nx = (self.naxis3, self.naxis2, self.naxis1)
+        xsize = self.xsize
+        w = self.ref_all
+        r = self.reference_pixel_noise_ratio
+
+        bias_pattern = self._bias_pattern()
+
+        # Channel-specific frame-to-frame bias offsets
+        if self.ref_f2f_ucorr is not None:
+            if isinstance(self.ref_f2f_ucorr, (np.ndarray,list)):
+                f2f_ucorr = np.asarray(self.ref_f2f_ucorr)
+                if f2f_ucorr.size != self.n_out:
+                    _log.warning('Number of elements in ref_f2f_ucorr not equal to n_out')
+                    os.sys.exit()
+            else:
+                f2f_ucorr = np.ones(self.n_out) * self.ref_f2f_ucorr
+
+        # Reference instability is only naxis3 elements long
+        if self.ref_inst is not None:
+            ref_noise = self.ref_inst * self.pink_noise('ref_inst')
+
+        if self.rd_noise is not None:
+            if isinstance(self.rd_noise, (np.ndarray,list)):
+                temp = np.asarray(self.rd_noise)
+                if temp.size != self.n_out:
+                    _log.warning('Number of elements in rd_noise not equal to n_out')
+                    os.sys.exit()
+            else:
+                self.rd_noise = np.ones(self.n_out) * self.rd_noise
+            rd_ref = r * np.mean(self.rd_noise)
+
+        # Number of time steps per frame that include real pixels
+        nrow = self.naxis2 + self.nfoh
+        ncol = self.xsize + self.nroh
+        modnum = 1 if self.reverse_scan_direction else 0
+
+        if self.c_pink is not None:
+            c_stream = PinkNoiseStream(self.nstep)
+
+        if self.u_pink is not None:
+            if isinstance(self.u_pink, (np.ndarray,list)):
+                temp = np.asarray(self.u_pink)
+                if temp.size != self.n_out:
+                    _log.warning('Number of elements in u_pink not equal to n_out')
+                    os.sys.exit()
+            else:
+                self.u_pink = np.ones(self.n_out) * self.u_pink
+            u_streams = [PinkNoiseStream(self.nstep) for op in range(self.n_out)] \
+                if self.u_pink.any() else None
+
+        # Even and odd columns ('a' and 'b') are independent for ACN
+        if self.acn is not None:
+            acn_streams = [(PinkNoiseStream(self.nstep//2), PinkNoiseStream(self.nstep//2))
+                           for op in range(self.n_out)]
+
+        # PCA-zero modulation is sampled once per row
+        if self.pca0_amp is not None:
+            pca0_stream = PinkNoiseStream(ny*nz)
+
+        if self.dark_image is not None:
+            dark_frame = self.dark_image * self.tframe * self.gain # electrons
+            # Set reference pixels' dark current equal to 0
+            if w[0] > 0: # lower
+                dark_frame[:w[0],:] = 0
+            if w[1] > 0: # upper
+                dark_frame[-w[1]:,:] = 0
+            if w[2] > 0: # left
+                dark_frame[:,:w[2]] = 0
+            if w[3] > 0: # right
+                dark_frame[:,-w[3]:] = 0
+            dark_temp = np.zeros([ny,nx])
+
+        for z in range(nz):
+            result = bias_pattern.astype(np.float32)
+
+            # Random frame-to-frame bias offsets
+            if self.ref_f2f_corr is not None:
+                result += self.ref_f2f_corr * np.random.randn()
+            if self.ref_f2f_ucorr is not None:
+                for ch in range(self.n_out):
+                    result[:,xsize*ch:xsize*(ch+1)] += f2f_ucorr[ch] * np.random.randn()
+            # Reference instability
+            if self.ref_inst is not None:
+                if w[0] > 0:
+                    result[:w[0], :] += ref_noise[z]
+                if w[1] > 0:
+                    result[-w[1]:,:] += ref_noise[z]
+                if w[2] > 0:
+                    result[:, :w[2]] += ref_noise[z]
+                if w[3] > 0:
+                    result[:,-w[3]:] += ref_noise[z]
+
+            # White read noise
+            if self.rd_noise is not None:
+                here = np.zeros((ny,nx))
+                for op in range(self.n_out):
+                    x0 = op * xsize
+                    x1 = x0 + xsize
+                    here[:,x0:x1] = self.rd_noise[op] * np.random.standard_normal((ny,xsize))
+                if w[0] > 0: # lower
+                    here[:w[0],:] = rd_ref * np.random.standard_normal((w[0],nx))
+                if w[1] > 0: # upper
+                    here[-w[1]:,:] = rd_ref * np.random.standard_normal((w[1],nx))
+                if w[2] > 0: # left
+                    here[:,:w[2]] = rd_ref * np.random.standard_normal((ny,w[2]))
+                if w[3] > 0: # right
+                    here[:,-w[3]:] = rd_ref * np.random.standard_normal((ny,w[3]))
+                result += here
+
+            # Correlated pink noise
+            if self.c_pink is not None:
+                tt = self.c_pink * c_stream.next(self.nstep_frame)
+                tt = np.reshape(tt[:nrow*ncol], (nrow, ncol))[:ny,:xsize]
+                for op in range(self.n_out):
+                    x0 = op * xsize
+                    x1 = x0 + xsize
+                    if np.mod(op,2) == modnum:
+                        result[:,x0:x1] += tt
+                    else:
+                        result[:,x0:x1] += tt[:,::-1]
+
+            # Uncorrelated pink noise
+            if (self.u_pink is not None) and (u_streams is not None):
+                for op in range(self.n_out):
+                    x0 = op * xsize
+                    x1 = x0 + xsize
+                    tt = self.u_pink[op] * u_streams[op].next(self.nstep_frame)
+                    result[:,x0:x1] += np.reshape(tt[:nrow*ncol], (nrow, ncol))[:ny,:xsize]
+
+            # ACN
+            if self.acn is not None:
+                nacn = nrow * (ncol//2)
+                for op, (sa, sb) in enumerate(acn_streams):
+                    a = np.reshape(sa.next(nacn), (nrow, ncol//2))[:ny,:xsize//2]
+                    b = np.reshape(sb.next(nacn), (nrow, ncol//2))[:ny,:xsize//2]
+                    x0 = op * xsize
+                    x1 = x0 + xsize
+                    result[:,x0:x1] += self.acn * np.stack((a,b), axis=-1).reshape([ny,-1])
+
+            # PCA-zero
+            if self.pca0_amp is not None:
+                gamma = pca0_stream.next(ny)
+                result += self.pca0_amp * self.pca0 * gamma.reshape([-1,1])
+
+            # Dark current
+            if self.dark_image is not None:
+                dark_temp += np.random.poisson(dark_frame, size=None)
+                result += dark_temp
+
+            if out_ADU:
+                if self.gain != 1:
+                    result /= self.gain
+                result[result < 0] = 0
+                result[result >= 2**16] = 2**16 - 1
+                result = result.astype('uint16')
+
+            yield result
+
+        self.message('Exiting mknoise_iter()')
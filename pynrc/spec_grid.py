@@ -0,0 +1,503 @@
+"""
+Memory-mapped stellar atmosphere model grids
+
+The BOSZ and Phoenix model grids are converted once into a single array of
+shape [nteff, nmetal, nlogg, nwave] on a common wavelength grid, which is
+saved as an .npy file in PYNRC_PATH/spec_grids/ and memory-mapped when
+loaded. Spectra for any number of stars are then generated with vectorized
+multilinear interpolation in (Teff, [M/H], log g) without opening any
+FITS files. Fluxes are surface fluxes in flam (erg/s/cm^2/A) and wavelengths
+are in Angstrom.
+
+The Spiegel & Burrows (2012) planet models are stored similarly (see
+build_sb12_store and PlanetGrid), with one row per (atmo, mass, age, 
+entropy) combination and an index that maps parameters to rows.
+
+Example
+==========
+# Convert the grid (only needs to be done once)
+build_bosz_grid('/data/bosz_grids/', res=2000)
+
+grid = get_spec_grid('bosz', res=2000)
+teff = np.random.uniform(4000, 6000, 10000)
+flux = grid.interp(teff, 0.0, 4.5)          # [10000, nwave] array
+sp = grid.spectrum(5750, 0.0, 4.5)          # Pysynphot spectrum
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+import os, re, itertools
+
+from astropy.io import fits
+
+from . import conf
+from .psf_cache import _replace
+
+import logging
+_log = logging.getLogger('pynrc')
+
+
+def _grid_dir(name, res=None):
+    """Directory path of a converted model grid."""
+    if res is not None:
+        name = '{}_R{}'.format(name, res)
+    return conf.PYNRC_PATH + 'spec_grids/' + name + '/'
+
+
+def _save_grid(out_dir, teff, metal, logg, wave, valid, fill_func):
+    """
+    Write the flux array and grid axes to out_dir. fill_func(flux) fills
+    the memory-mapped flux array. Files are written under temporary names
+    and then renamed, so partially converted grids are never loaded.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    shape = (teff.size, metal.size, logg.size, wave.size)
+    tmp_flux = out_dir + 'flux.npy.tmp'
+    flux = np.lib.format.open_memmap(tmp_flux, mode='w+', dtype=np.float32, shape=shape)
+    fill_func(flux)
+    flux.flush()
+    del flux
+
+    # np.savez appends .npz if it's not already at the end of the file name
+    tmp_axes = out_dir + 'axes.tmp.npz'
+    np.savez(tmp_axes, teff=teff, metal=metal, logg=logg, wave=wave, valid=valid)
+
+    _replace(tmp_flux, out_dir + 'flux.npy')
+    _replace(tmp_axes, out_dir + 'axes.npz')
+
+
+def build_bosz_grid(model_dir=None, res=2000, out_dir=None):
+    """
+    Convert the BOSZ model FITS files into a memory-mapped grid.
+
+    Parameters
+    ==========
+    model_dir : Directory containing the R{res}/ subdirectories of BOSZ
+                models. Default is PYNRC_PATH/bosz_grids/.
+    res       : Spectral resolution (200 or 2000).
+    out_dir   : Output directory. Default is PYNRC_PATH/spec_grids/bosz_R{res}/.
+
+    Ref: https://archive.stsci.edu/prepds/bosz/
+    """
+
+    if model_dir is None:
+        model_dir = conf.PYNRC_PATH + 'bosz_grids/'
+    res_dir = os.path.join(model_dir, 'R{}/'.format(res))
+    if not os.path.isdir(res_dir):
+        raise IOError('Resolution directory does not exist: {}'.format(res_dir))
+    if out_dir is None:
+        out_dir = _grid_dir('bosz', res)
+
+    teff = np.concatenate((np.arange(3500,12000,250), np.arange(12000,20000,500),
+                           np.arange(20000,36000,1000))).astype(float)
+    metal = np.arange(-2.5,0.75,0.25)
+    logg = np.arange(0,5.5,0.5)
+
+    def fname(t, m, g):
+        mstr = '{}{:02.0f}'.format('m' if m<0 else 'p', int(abs(m*10)+0.5))
+        return res_dir + 'a{}cp00op00t{:04.0f}g{:02.0f}v20modrt0b{}rs.fits'.\
+            format(mstr, t, int(g*10), res)
+
+    # Common wavelength grid from the first available model
+    wave = None
+    for t, m, g in itertools.product(teff, metal, logg):
+        if os.path.isfile(fname(t,m,g)):
+            wave = np.asarray(fits.getdata(fname(t,m,g), 1)['Wavelength'], dtype=float)
+            break
+    if wave is None:
+        raise IOError('No BOSZ models found in {}'.format(res_dir))
+
+    valid = np.zeros([teff.size, metal.size, logg.size], dtype=bool)
+    def fill(flux):
+        for (i,t), (j,m), (k,g) in itertools.product(enumerate(teff), enumerate(metal), enumerate(logg)):
+            f = fname(t,m,g)
+            if not os.path.isfile(f):
+                continue
+            d = fits.getdata(f, 1)
+            w = d['Wavelength']
+            fl = np.pi * d['SpecificIntensity'] # erg/s/cm^2/A
+            flux[i,j,k] = fl if np.array_equal(w, wave) else np.interp(wave, w, fl)
+            valid[i,j,k] = True
+
+    _log.info('Converting BOSZ R{} grid to {}'.format(res, out_dir))
+    _save_grid(out_dir, teff, metal, logg, wave, valid, fill)
+
+
+def build_phoenix_grid(out_dir=None, wave=None):
+    """
+    Convert the Pysynphot (CDBS) Phoenix models into a memory-mapped grid.
+
+    Parameters
+    ==========
+    out_dir : Output directory. Default is PYNRC_PATH/spec_grids/phoenix/.
+    wave    : Common wavelength grid in Angstrom. Default is the
+              wavelength grid of the first model.
+    """
+    import pysynphot as S
+
+    if out_dir is None:
+        out_dir = _grid_dir('phoenix')
+
+    teff = np.concatenate((np.arange(2000,7000,100), np.arange(7000,12000,200),
+                           np.arange(12000,70001,1000))).astype(float)
+    metal = np.array([-4.0, -3.0, -2.5, -2.0, -1.5, -1.0, -0.5, 0.0, 0.3, 0.5])
+    logg = np.arange(0,6.0,0.5)
+
+    def get_sp(t, m, g):
+        try:
+            sp = S.Icat('phoenix', t, m, g)
+        except Exception:
+            return None
+        sp.convert('angstrom')
+        sp.convert('flam')
+        # Phoenix grid points that weren't computed are all zeros
+        return sp if sp.flux.any() else None
+
+    if wave is None:
+        for t, m, g in itertools.product(teff, metal, logg):
+            sp = get_sp(t, m, g)
+            if sp is not None:
+                wave = np.asarray(sp.wave, dtype=float)
+                break
+
+    valid = np.zeros([teff.size, metal.size, logg.size], dtype=bool)
+    def fill(flux):
+        for (i,t), (j,m), (k,g) in itertools.product(enumerate(teff), enumerate(metal), enumerate(logg)):
+            sp = get_sp(t, m, g)
+            if sp is None:
+                continue
+            flux[i,j,k] = np.interp(wave, sp.wave, sp.flux)
+            valid[i,j,k] = True
+
+    _log.info('Converting Phoenix grid to {}'.format(out_dir))
+    _save_grid(out_dir, teff, metal, logg, wave, valid, fill)
+
+
+def _bracket(grid, x, label):
+    """Lower grid index and fractional offset for each value of x."""
+    if (x.min() < grid[0]) or (x.max() > grid[-1]):
+        raise ValueError('{} must be between {} and {}.'.format(label, grid[0], grid[-1]))
+    if grid.size == 1:
+        return np.zeros(x.shape, dtype=int), np.zeros(x.shape)
+    i = np.clip(np.searchsorted(grid, x, side='right') - 1, 0, grid.size-2)
+    frac = (x - grid[i]) / (grid[i+1] - grid[i])
+    return i, frac
+
+
+def _corner_weights(grids, values, valid, labels, renorm=True):
+    """
+    Multilinear interpolation weights for each of the 2**ndim grid points
+    surrounding the values (list of 1D arrays, one per grid axis). 
+
+    If renorm=True, grid points that are not part of the model set 
+    (valid=False) are excluded by renormalizing the weights of the 
+    remaining corners, and a ValueError is raised if none of the corners
+    exist. Otherwise, a ValueError is raised if any corner with a
+    non-zero weight is missing.
+
+    Returns a list of index tuples and an array of weights [ncorner, nval].
+    """
+    brackets = [_bracket(g, x, l) for g, x, l in zip(grids, values, labels)]
+
+    idx = []; wts = []
+    for corner in itertools.product([0,1], repeat=len(grids)):
+        w = 1.
+        i = []
+        for d, g, (ii, ff) in zip(corner, grids, brackets):
+            w = w * (ff if d else 1-ff)
+            i.append(ii + d*min(g.size-1, 1))
+        i = tuple(i)
+        idx.append(i)
+        if not renorm:
+            bad = (w > 0) & ~valid[i]
+            if bad.any():
+                j = np.where(bad)[0][0]
+                vals = ', '.join('{}={}'.format(l, x[j]) for l, x in zip(labels, values))
+                raise ValueError('Missing model grid points surrounding {}.'.format(vals))
+        wts.append(w * valid[i])
+    wts = np.array(wts)
+
+    wsum = wts.sum(axis=0)
+    bad = wsum <= 0
+    if bad.any():
+        j = np.where(bad)[0][0]
+        vals = ', '.join('{}={}'.format(l, x[j]) for l, x in zip(labels, values))
+        raise ValueError('No models surrounding {}.'.format(vals))
+    wts /= wsum
+
+    return idx, wts
+
+
+class SpectralGrid(object):
+    """
+    Memory-mapped model grid with vectorized multilinear interpolation.
+
+    Parameters
+    ==========
+    grid_dir : Directory created by build_bosz_grid() or build_phoenix_grid().
+    name     : Name used for Pysynphot spectra.
+    """
+
+    def __init__(self, grid_dir, name='grid'):
+
+        self.grid_dir = grid_dir
+        self.name = name
+
+        with np.load(grid_dir + 'axes.npz') as d:
+            self.teff  = d['teff']
+            self.metal = d['metal']
+            self.logg  = d['logg']
+            self.wave  = d['wave']
+            self.valid = d['valid']
+        self.flux = np.load(grid_dir + 'flux.npy', mmap_mode='r')
+
+    def interp(self, teff, metallicity, log_g, nchunk=1000):
+        """
+        Interpolate the grid for arrays of stellar parameters, which
+        follow the usual numpy broadcasting rules. Returns a flux array
+        with shape [nstar, nwave] (or [nwave] if all inputs are scalars).
+
+        A ValueError is raised if any of the grid points surrounding
+        a set of parameters is not part of the model set.
+        """
+        scalar = (np.ndim(teff) + np.ndim(metallicity) + np.ndim(log_g)) == 0
+        teff, metal, logg = np.broadcast_arrays(np.asarray(teff, dtype=float),
+            np.asarray(metallicity, dtype=float), np.asarray(log_g, dtype=float))
+        shape = teff.shape
+        teff = teff.ravel(); metal = metal.ravel(); logg = logg.ravel()
+
+        idx, wts = _corner_weights([self.teff, self.metal, self.logg], 
+            [teff, metal, logg], self.valid, ['Teff', '[M/H]', 'log_g'], renorm=False)
+
+        out = np.zeros([teff.size, self.wave.size])
+        for i0 in range(0, teff.size, nchunk):
+            sl = slice(i0, i0+nchunk)
+            for (i,j,k), w in zip(idx, wts):
+                wsl = w[sl]
+                if not wsl.any(): continue
+                out[sl] += wsl.reshape([-1,1]) * self.flux[i[sl], j[sl], k[sl]]
+
+        if scalar:
+            return out[0]
+        return out.reshape(shape + (self.wave.size,))
+
+    def spectrum(self, teff, metallicity, log_g, name=None):
+        """
+        Pysynphot spectrum (or list of spectra for array inputs)
+        interpolated from the grid.
+        """
+        import pysynphot as S
+
+        flux = self.interp(teff, metallicity, log_g)
+        if flux.ndim == 1:
+            if name is None:
+                name = '{}(Teff={},z={},logG={})'.format(self.name, teff, metallicity, log_g)
+            return S.ArraySpectrum(self.wave, flux, 'angstrom', 'flam', name=name)
+
+        pars = np.broadcast_arrays(teff, metallicity, log_g)
+        pars = [p.ravel() for p in pars]
+        flux = flux.reshape([-1, self.wave.size])
+        sp_list = []
+        for i, fl in enumerate(flux):
+            t, m, g = pars[0][i], pars[1][i], pars[2][i]
+            nm = '{}(Teff={},z={},logG={})'.format(self.name, t, m, g)
+            sp_list.append(S.ArraySpectrum(self.wave, fl, 'angstrom', 'flam', name=nm))
+        return sp_list
+
+
+_spec_grids = {}
+def get_spec_grid(name='bosz', res=2000):
+    """
+    Return the memory-mapped grid ('bosz' or 'phoenix'), or None if it has
+    not been converted yet (see build_bosz_grid() and build_phoenix_grid()).
+    """
+    name = name.lower()
+    key = (name, res if name=='bosz' else None)
+    grid = _spec_grids.get(key)
+    if grid is None:
+        grid_dir = _grid_dir(*key)
+        if not os.path.isfile(grid_dir + 'axes.npz'):
+            return None
+        label = 'BOSZ' if name=='bosz' else 'Phoenix'
+        grid = SpectralGrid(grid_dir, name=label)
+        _spec_grids[key] = grid
+    return grid
+
+
+def build_sb12_store(base_dir=None, out_dir=None):
+    """
+    Convert the Spiegel & Burrows (2012) planet model files into an indexed
+    binary store. Every (atmo, mass, age, entropy) combination becomes one row 
+    of a memory-mapped flux array (mJy at 10 pc) with index arrays that give 
+    the parameters of each row.
+
+    Parameters
+    ==========
+    base_dir : Location of the SB.{atmo}/ sub-directories.
+               Default is PYNRC_PATH/spiegel/.
+    out_dir  : Output directory. Default is base_dir/sb12_store/.
+    """
+
+    if base_dir is None:
+        base_dir = conf.PYNRC_PATH + 'spiegel/'
+    if out_dir is None:
+        out_dir = base_dir + 'sb12_store/'
+
+    wave = None
+    flux_list = []
+    atmo_arr = []; mass_arr = []; age_arr = []; ent_arr = []; file_arr = []
+    for atmo in ['hy1s', 'hy3s', 'cf1s', 'cf3s']:
+        sub_dir = base_dir + 'SB.' + atmo + '/'
+        if not os.path.isdir(sub_dir):
+            continue
+        for file in sorted(os.listdir(sub_dir)):
+            fsplit = re.split('[_\.]',file)
+            try:
+                mass = int(fsplit[fsplit.index('mass') + 1])
+                age = int(fsplit[fsplit.index('age') + 1])
+            except (ValueError, IndexError):
+                continue
+
+            #   Row #, Value
+            #   1      col 1: age (Myr);
+            #          cols 2-601: wavelength (in microns, in range 0.8-15.0)
+            #   2-end  col 1: initial S;
+            #          cols 2-601: F_nu (in mJy for a source at 10 pc)
+            arr = np.loadtxt(sub_dir + file, ndmin=2)
+            if wave is None:
+                wave = arr[0,1:]
+            flux = arr[1:,1:]
+            if not np.array_equal(arr[0,1:], wave):
+                flux = np.array([np.interp(wave, arr[0,1:], f) for f in flux])
+
+            nrow = flux.shape[0]
+            flux_list.append(flux.astype(np.float32))
+            ent_arr.append(arr[1:,0])
+            atmo_arr += [atmo] * nrow
+            mass_arr += [mass] * nrow
+            age_arr += [age] * nrow
+            file_arr += [file] * nrow
+
+    if wave is None:
+        raise IOError('No Spiegel & Burrows models found in {}'.format(base_dir))
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    _log.info('Converting Spiegel & Burrows models to {}'.format(out_dir))
+    flux = np.concatenate(flux_list)
+    np.save(out_dir + 'flux.npy.tmp.npy', flux)
+    np.savez(out_dir + 'index.tmp.npz', wave=wave, atmo=np.array(atmo_arr), 
+             mass=np.array(mass_arr), age=np.array(age_arr), 
+             entropy=np.concatenate(ent_arr), fname=np.array(file_arr))
+    _replace(out_dir + 'flux.npy.tmp.npy', out_dir + 'flux.npy')
+    _replace(out_dir + 'index.tmp.npz', out_dir + 'index.npz')
+
+
+class PlanetGrid(object):
+    """
+    Memory-mapped Spiegel & Burrows (2012) planet spectra created by
+    build_sb12_store(). Fluxes are in mJy at 10 pc and wavelengths in um.
+
+    Parameters
+    ==========
+    store_dir : Directory created by build_sb12_store().
+    """
+
+    def __init__(self, store_dir):
+
+        self.store_dir = store_dir
+        with np.load(store_dir + 'index.npz') as d:
+            self.wave    = d['wave']
+            self.atmo    = d['atmo']
+            self.mass    = d['mass']
+            self.age     = d['age']
+            self.entropy = d['entropy']
+            self.file    = d['fname']
+        self.flux = np.load(store_dir + 'flux.npy', mmap_mode='r')
+
+        # Dense (mass, age, entropy) -> row lookup tables for each atmosphere
+        self._tables = {}
+        for atmo in np.unique(self.atmo):
+            rows = np.where(self.atmo == atmo)[0]
+            masses = np.unique(self.mass[rows])
+            ages = np.unique(self.age[rows])
+            ents = np.unique(self.entropy[rows])
+            table = np.zeros([masses.size, ages.size, ents.size], dtype=int) - 1
+            im = np.searchsorted(masses, self.mass[rows])
+            ia = np.searchsorted(ages, self.age[rows])
+            ie = np.searchsorted(ents, self.entropy[rows])
+            table[im, ia, ie] = rows
+            self._tables[atmo] = (masses, ages, ents, table)
+
+    def nearest(self, atmo, mass, age, entropy):
+        """
+        Row index of the model closest in mass, then age (at that mass),
+        then initial entropy (for that file). This follows the selection 
+        in planets_sb12.get_file() and planets_sb12.read_file().
+        """
+        rows = np.where(self.atmo == atmo)[0]
+        if rows.size == 0:
+            raise ValueError('Atmosphere type {} not in planet store.'.format(atmo))
+
+        mdiff = np.abs(self.mass[rows] - mass)
+        rows = rows[mdiff == mdiff.min()]
+        adiff = np.abs(self.age[rows] - age)
+        rows = rows[adiff == adiff.min()]
+        # Only consider rows from a single file
+        rows = rows[self.file[rows] == self.file[rows[0]]]
+        ediff = np.abs(self.entropy[rows] - entropy)
+        return rows[np.argmin(ediff)]
+
+    def interp(self, atmo, mass, age, entropy):
+        """
+        Interpolate planet spectra for arrays of mass (MJup), age (Myr), 
+        and initial entropy, which follow the usual numpy broadcasting rules.
+        Interpolation is linear in mass and entropy and logarithmic in age.
+        Returns flux array [nplanet, nwave] in mJy at 10 pc (or [nwave] if 
+        all inputs are scalars).
+        """
+        scalar = (np.ndim(mass) + np.ndim(age) + np.ndim(entropy)) == 0
+        mass, age, entropy = np.broadcast_arrays(np.asarray(mass, dtype=float),
+            np.asarray(age, dtype=float), np.asarray(entropy, dtype=float))
+        shape = mass.shape
+        mass = mass.ravel(); age = age.ravel(); entropy = entropy.ravel()
+
+        if atmo not in self._tables:
+            raise ValueError('Atmosphere type {} not in planet store.'.format(atmo))
+        masses, ages, ents, table = self._tables[atmo]
+
+        grids = [masses.astype(float), np.log10(ages.astype(float)), ents]
+        idx, wts = _corner_weights(grids, [mass, np.log10(age), entropy], table >= 0,
+                                   ['mass', 'age', 'entropy'])
+
+        out = np.zeros([mass.size, self.wave.size])
+        for i, w in zip(idx, wts):
+            ind = w > 0
+            if not ind.any(): continue
+            out[ind] += w[ind].reshape([-1,1]) * self.flux[table[i][ind]]
+
+        if scalar:
+            return out[0]
+        return out.reshape(shape + (self.wave.size,))
+
+
+_planet_grids = {}
+def get_planet_grid(base_dir=None):
+    """
+    Return the Spiegel & Burrows planet store for base_dir, or None if it 
+    has not been created yet (see build_sb12_store()).
+    """
+    if base_dir is None:
+        base_dir = conf.PYNRC_PATH + 'spiegel/'
+    grid = _planet_grids.get(base_dir)
+    if grid is None:
+        store_dir = base_dir + 'sb12_store/'
+        if not os.path.isfile(store_dir + 'index.npz'):
+            return None
+        grid = PlanetGrid(store_dir)
+        _planet_grids[base_dir] = grid
+    return grid
@@ -0,0 +1,52 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import numpy as np
+
+from ..bg_provider import AnalyticProvider, HTTPProvider, StandInServer
+
+
+def test_http_provider_stand_in():
+    """HTTPProvider returns the stand-in server's values."""
+    locstr = ['266.4 -29.0', '10.0 80.0']
+    wave = [1.0, 5.5]
+    with StandInServer() as server:
+        prov = HTTPProvider(url=server.url, cache_file=None, nthread=4)
+        try:
+            vals = prov.zodi(locstr, 2019, [100, 200], wave)
+        finally:
+            prov.close()
+
+    expected = AnalyticProvider().zodi(locstr, 2019, [100, 200], wave)
+    assert vals.shape == (2, 2)
+    np.testing.assert_allclose(vals, expected, rtol=1e-5)
+
+
+def test_http_provider_cache(tmpdir):
+    """Cached lookups don't send any further requests."""
+    cache_file = str(tmpdir.join('zodi_cache.json'))
+    with StandInServer() as server:
+        prov = HTTPProvider(url=server.url, cache_file=cache_file, nthread=2)
+        try:
+            vals1 = prov.zodi(['266.4 -29.0', '10.0 80.0'], 2019, 100)
+            nreq = server.nrequests
+            assert nreq == 4
+
+            # Same values from the in-memory cache
+            vals2 = prov.zodi(['266.4 -29.0', '10.0 80.0'], 2019, 100)
+            assert server.nrequests == nreq
+            np.testing.assert_array_equal(vals1, vals2)
+
+            # Only the new target is requested
+            prov.zodi(['266.4 -29.0', '45.0 0.0'], 2019, 100)
+            assert server.nrequests == nreq + 2
+        finally:
+            prov.close()
+
+        # A new provider reads the disk cache
+        with open(cache_file, 'r') as f:
+            assert len(json.load(f)) == 6
+        prov = HTTPProvider(url=server.url, cache_file=cache_file)
+        vals3 = prov.zodi(['266.4 -29.0', '10.0 80.0'], 2019, 100)
+        assert server.nrequests == nreq + 2
+        np.testing.assert_array_equal(vals1, vals3)